@@ -23,7 +23,7 @@ FROM species_list AS sl
 WHERE sl.rotation_num = 11
 
 --select all nests that aren't in a current rotation
---comment out the WHERE rotation_num = ? part to get a list of all nests that have never had a report
+--take the rotation_num = ? part out of the join to get a list of all nests that have never had a report
 SELECT
 	nls.nest_id
 	,nls.official_name AS 'Primary Name'
@@ -31,12 +31,10 @@ SELECT
 	,nbz.name AS 'Neighborhood'
 	,regions.name AS 'Location'
 FROM nest_locations AS nls
+	LEFT OUTER JOIN species_list AS sl ON (sl.rotation_num = 10 AND sl.nestid = nls.nest_id)
 	LEFT OUTER JOIN neighborhoods AS nbz ON (nls.location = nbz.id)
 	LEFT OUTER JOIN regions ON (nbz.region = regions.id)
-WHERE nls.nest_id NOT IN (
-	SELECT nestid FROM species_list
-	WHERE rotation_num = 10
-)
+WHERE sl.nestid IS NULL
 
 --selects everything but the alt names that would be displayed on a nest editing screen
 SELECT
@@ -51,4 +51,15 @@ CREATE TABLE IF NOT EXISTS alt_names (
 	main_entry integer NOT NULL,
 	hideme integer,
 	FOREIGN KEY (main_entry) REFERENCES nest_locations (nest_id)
-)
\ No newline at end of file
+);
+
+-- keep in sync with MIGRATIONS in migrations.py
+CREATE INDEX IF NOT EXISTS alt_names_main_entry ON alt_names (main_entry);
+CREATE INDEX IF NOT EXISTS species_list_nestid ON species_list (nestid);
+CREATE INDEX IF NOT EXISTS rotation_dates_date ON rotation_dates (date);
+CREATE INDEX IF NOT EXISTS neighborhoods_name ON neighborhoods (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS nest_locations_location ON nest_locations (location);
+-- versions 2 to 5, the park name search index, the render cache, the hist-list import record,
+-- and the search index again with stable alt name keys,
+-- are built by migrations.py
+PRAGMA user_version = 1;
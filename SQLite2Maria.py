@@ -1,82 +1,380 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
+# coding=UTF-8
+# -*- coding: UTF-8 -*-
+# vim: set fileencoding=UTF-8 :
 
-# this was found on some Stack Overflow-like site
+# Exports a nest database to a MariaDB/MySQL script: python3 SQLite2Maria.py nests.db -o nests.sql
+# The schema comes from the tables themselves rather than from rewriting a dump line by line,
+# and the rows go out as multi-row INSERTs of --batch-size rows, streamed from a cursor
+# Load the result with: mariadb nests < nests.sql
 
-""" NOTE: this does not do the full job and naming conventions need to be
-edited in the resulting file pipe a SQLite3 dump into this and then > the
-output into your SQL file, then edit until Maria is happy with you and
-everything is imported """
+import re
+import sqlite3
+import sys
 
+import click
 
-import re
-import fileinput
-
-def this_line_is_useless(line):
-    useless_es = [
-        'BEGIN TRANSACTION',
-        'COMMIT',
-        'sqlite_sequence',
-        'CREATE UNIQUE INDEX',
-        'PRAGMA foreign_keys=OFF',
-    ]
-    for useless in useless_es:
-        if re.search(useless, line):
-            return True
-
-def has_primary_key(line):
-    return bool(re.search(r'PRIMARY KEY', line))
-
-searching_for_end = False
-for line in fileinput.input():
-    if this_line_is_useless(line):
-        continue
-
-    # this line was necessary because ''); was getting
-    # converted (inappropriately) to \');
-    if re.match(r".*, ''\);", line):
-        line = re.sub(r"''\);", r'``);', line)
-
-    if re.match(r'^CREATE TABLE.*', line):
-        searching_for_end = True
-
-    m = re.search('CREATE TABLE "?([a-zA-Z_]*)"?(.*)', line)
-    if m:
-        name, sub = m.groups()
-        line = "DROP TABLE IF EXISTS %(name)s;\nCREATE TABLE IF NOT EXISTS `%(name)s`%(sub)s\n"
-        line = line % dict(name=name, sub=sub)
-    else:
-        m = re.search('INSERT INTO "([a-zA-Z_]*)"(.*)', line)
-        if m:
-            line = 'INSERT INTO %s%s\n' % m.groups()
-            line = line.replace('"', r'\"')
-            line = line.replace('"', "'")
-    line = re.sub(r"([^'])'t'(.)", "\1THIS_IS_TRUE\2", line)
-    line = line.replace('THIS_IS_TRUE', '1')
-    line = re.sub(r"([^'])'f'(.)", "\1THIS_IS_FALSE\2", line)
-    line = line.replace('THIS_IS_FALSE', '0')
-
-    # Add auto_increment if it's not there since sqlite auto_increments ALL
-    # primary keys
-    if searching_for_end:
-        if re.search(r"integer(?:\s+\w+)*\s*PRIMARY KEY(?:\s+\w+)*\s*,", line):
-            line = line.replace("PRIMARY KEY", "PRIMARY KEY AUTO_INCREMENT")
-        # replace " and ' with ` because mysql doesn't like quotes in CREATE commands
-        if line.find('DEFAULT') == -1:
-            line = line.replace(r'"', r'`').replace(r"'", r'`')
+batch_size = 1000  # rows per INSERT
+max_statement = 1024 * 1024  # characters per INSERT, well under MariaDB's default max_allowed_packet
+write_buffer = 1024 * 1024
+skip_tables = {"render_cache"}  # rebuilt by update.py whenever it's needed
+
+# MariaDB string escapes, since it treats \ as an escape character
+escapes = str.maketrans({"\\": "\\\\", "'": "\\'", "\0": "\\0", "\n": "\\n", "\r": "\\r", "\x1a": "\\Z"})
+
+
+def quote_name(name):
+    return "`" + name.replace("`", "``") + "`"
+
+
+# MariaDB has no NaN or infinity, so they go out as NULL
+def finite(value):
+    return value == value and value not in (float("inf"), float("-inf"))
+
+
+def quote_text(value):
+    return "'" + value.translate(escapes) + "'"
+
+
+# how each type SQLite hands back is written as a MariaDB literal
+literals = {
+    type(None): lambda value: "NULL",
+    int: str,
+    str: quote_text,
+    float: lambda value: repr(value) if finite(value) else "NULL",
+    bytes: lambda value: "X'" + value.hex() + "'",
+}
+
+
+# a Python value from SQLite as a MariaDB literal
+def literal(value):
+    return literals[type(value)](value)
+
+
+# the tables to export: every table but SQLite's own, full-text indexes and their shadow tables, and caches
+def export_tables(dbc):
+    rows = dbc.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table' ORDER BY rowid").fetchall()
+    virtual = [name for name, sql in rows if sql is not None and sql.upper().startswith("CREATE VIRTUAL")]
+    return [name for name, sql in rows if not name.startswith("sqlite_") and name not in skip_tables and
+            name not in virtual and not any(name.startswith(vname + "_") for vname in virtual)]
+
+
+# the MariaDB type of a column, by SQLite's type affinity rules
+# every SQLite integer is 64 bits, e.g. hist_imports.mtime holds nanoseconds, so INTEGER affinity is BIGINT
+# text that's part of a key needs a length in MariaDB
+def column_type(decltype, keyed=False):
+    decltype = decltype.upper()
+    if "INT" in decltype:
+        return "BIGINT"
+    if "CHAR" in decltype or "CLOB" in decltype or "TEXT" in decltype:
+        return "VARCHAR(255)" if keyed else "TEXT"
+    if decltype == "" or "BLOB" in decltype:
+        return "VARBINARY(255)" if keyed else "BLOB"
+    if "REAL" in decltype or "FLOA" in decltype or "DOUB" in decltype:
+        return "DOUBLE"
+    return "DECIMAL(30,10)"
+
+
+# the CREATE TABLE and CREATE INDEX statements of a table in MariaDB's dialect
+def table_schema(dbc, table):
+    qtable = quote_name(table)
+    columns = dbc.execute("PRAGMA table_info(" + qtable + ")").fetchall()
+    indexes = []
+    for _, iname, unique, origin, _ in dbc.execute("PRAGMA index_list(" + qtable + ")").fetchall():
+        icols = [row[2] for row in dbc.execute("PRAGMA index_info(" + quote_name(iname) + ")")]
+        if None in icols:
+            continue  # an index on an expression has no MariaDB equivalent
+        indexes.append((iname, unique, origin, icols))
+    keys = [col for col in columns if col[5] > 0]
+    keyed = set(col[1] for col in keys).union(*[set(icols) for *_, icols in indexes])
+
+    lines = []
+    for _, name, decltype, notnull, default, pk in columns:
+        line = "  " + quote_name(name) + " " + column_type(decltype, name in keyed)
+        if notnull or pk > 0:
+            line += " NOT NULL"
+        if default is not None:
+            line += " DEFAULT " + default
+        # an INTEGER PRIMARY KEY is the rowid, which SQLite hands out like AUTO_INCREMENT
+        if pk > 0 and len(keys) == 1 and decltype.upper() == "INTEGER":
+            line += " AUTO_INCREMENT"
+        lines.append(line)
+    if len(keys) > 0:
+        lines.append("  PRIMARY KEY (" + ", ".join(quote_name(col[1]) for col in sorted(keys, key=lambda col: col[5]))
+                     + ")")
+    for iname, unique, origin, icols in indexes:
+        if origin == "u":
+            lines.append("  UNIQUE KEY " + quote_name(table + "_" + "_".join(icols)) + " (" +
+                         ", ".join(map(quote_name, icols)) + ")")
+    foreign = {}
+    for row in dbc.execute("PRAGMA foreign_key_list(" + qtable + ")"):
+        foreign.setdefault(row[0], (row[2], []))[1].append((row[3], row[4]))
+    for parent, pairs in foreign.values():
+        if any(dst is None for _, dst in pairs):  # REFERENCES parent with no columns means its primary key
+            parent_keys = sorted((col for col in dbc.execute("PRAGMA table_info(" + quote_name(parent) + ")")
+                                  if col[5] > 0), key=lambda col: col[5])
+            pairs = [(src, col[1]) for (src, _), col in zip(pairs, parent_keys)]
+        lines.append("  FOREIGN KEY (" + ", ".join(quote_name(src) for src, _ in pairs) + ") REFERENCES " +
+                     quote_name(parent) + " (" + ", ".join(quote_name(dst) for _, dst in pairs) + ")")
+
+    statements = ["DROP TABLE IF EXISTS " + qtable + ";",
+                  "CREATE TABLE " + qtable + " (\n" + ",\n".join(lines) + "\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;"]
+    for iname, unique, origin, icols in indexes:
+        if origin == "c":
+            statements.append("CREATE " + ("UNIQUE " if unique else "") + "INDEX " + quote_name(iname) + " ON " +
+                              qtable + " (" + ", ".join(map(quote_name, icols)) + ");")
+    return statements
+
+
+# writes the rows of a table as INSERTs of up to rows rows, reading them from a cursor as it goes
+# returns the number of rows and of statements written
+def write_rows(dbc, table, out, rows=batch_size):
+    cur = dbc.execute("SELECT * FROM " + quote_name(table))
+    prefix = "INSERT INTO " + quote_name(table) + " (" + ", ".join(quote_name(col[0]) for col in cur.description) + \
+             ") VALUES\n"
+    count = statements = 0
+    batch = []
+    size = 0
+    for row in cur:
+        values = "(" + ",".join([literals[type(value)](value) for value in row]) + ")"
+        if len(batch) >= rows or (len(batch) > 0 and size + len(values) > max_statement):
+            out.write(prefix + ",\n".join(batch) + ";\n")
+            statements += 1
+            batch = []
+            size = 0
+        batch.append(values)
+        size += len(values) + 2
+        count += 1
+    if len(batch) > 0:
+        out.write(prefix + ",\n".join(batch) + ";\n")
+        statements += 1
+    return count, statements
+
+
+# writes the whole MariaDB script for a database
+# returns {table: (rows, INSERT statements)}
+def export(dbc, out, rows=batch_size):
+    out.write("SET NAMES utf8mb4;\nSET FOREIGN_KEY_CHECKS = 0;\nSET UNIQUE_CHECKS = 0;\nSTART TRANSACTION;\n\n")
+    counts = {}
+    for table in export_tables(dbc):
+        out.write("\n".join(table_schema(dbc, table)) + "\n")
+        counts[table] = write_rows(dbc, table, out, rows)
+        out.write("\n")
+    out.write("COMMIT;\nSET UNIQUE_CHECKS = 1;\nSET FOREIGN_KEY_CHECKS = 1;\n")
+    return counts
+
+
+# MariaDB's string escapes undone, for reading an export back
+unescapes = {"0": "\0", "n": "\n", "r": "\r", "Z": "\x1a", "b": "\b", "t": "\t"}
+
+# one literal in a VALUES list, the way MariaDB reads them
+sql_literal = re.compile(r"""\s*(?:
+    (?P<null>NULL) |
+    '(?P<str>(?:[^'\\]|\\.|'')*)' |
+    X'(?P<hex>[0-9A-Fa-f]*)' |
+    (?P<num>-?[0-9]+(?:\.[0-9]*)?(?:[eE][-+]?[0-9]+)?)
+    )\s*(?P<end>[,)])""", re.VERBOSE | re.DOTALL)
+
+
+# a quoted name in an export
+sql_name = r"`((?:[^`]|``)+)`"
+
+
+def unquote_name(name):
+    return name.replace("``", "`")
+
+
+# reads the table and columns of one CREATE TABLE statement written by export
+# returns the table and a dict of column -> (MariaDB type, NOT NULL)
+def parse_create(statement):
+    table = unquote_name(re.match(r"CREATE TABLE " + sql_name, statement).group(1))
+    columns = {}
+    for name, mtype, rest in re.findall(r"^  " + sql_name + r" ([A-Z]+(?:\([0-9,]+\))?)(.*)$", statement,
+                                      re.MULTILINE):
+        columns[unquote_name(name)] = (mtype, " NOT NULL" in rest and "AUTO_INCREMENT" not in rest)
+    return table, columns
+
+
+# reads the rows of one INSERT statement written by export, following MariaDB's rules for literals
+# raises ValueError on anything MariaDB wouldn't read the same way
+# returns the table, its columns, and the rows
+def parse_insert(statement):
+    match = re.match(r"INSERT INTO " + sql_name + r" \((.*?)\) VALUES\n", statement)
+    if match is None:
+        raise ValueError("Not an INSERT: " + statement[:60])
+    table = unquote_name(match.group(1))
+    columns = [unquote_name(name) for name in re.findall(sql_name, match.group(2))]
+    rows = []
+    pos = match.end()
+    while True:
+        if statement[pos] != "(":
+            raise ValueError("Expected ( at " + str(pos) + " in " + table)
+        pos += 1
+        row = []
+        while True:
+            lit = sql_literal.match(statement, pos)
+            if lit is None:
+                raise ValueError("Unreadable value at " + str(pos) + " in " + table + ": " + statement[pos:pos + 40])
+            if lit.group("null") is not None:
+                row.append(None)
+            elif lit.group("str") is not None:
+                row.append(re.sub(r"\\(.)|''", lambda esc: "'" if esc.group(1) is None else
+                                  unescapes.get(esc.group(1), esc.group(1)), lit.group("str"), flags=re.DOTALL))
+            elif lit.group("hex") is not None:
+                row.append(bytes.fromhex(lit.group("hex")))
+            else:
+                num = lit.group("num")
+                row.append(int(num) if num.lstrip("-").isdigit() else float(num))
+            pos = lit.end()
+            if lit.group("end") == ")":
+                break
+        rows.append(tuple(row))
+        if statement.startswith(",\n", pos):
+            pos += 2
+        elif statement.startswith(";", pos):
+            return table, columns, rows
         else:
-            parts = line.split('DEFAULT')
-            parts[0] = parts[0].replace(r'"', r'`').replace(r"'", r'`')
-            line = 'DEFAULT'.join(parts)
+            raise ValueError("Expected , or ; at " + str(pos) + " in " + table)
+
 
-    # And now we convert it back (see above)
-    if re.match(r".*, ``\);", line):
-        line = re.sub(r'``\);', r"'');", line)
+# the integers each MariaDB integer type holds, from -limit to limit - 1
+int_limits = {"INT": 2 ** 31, "BIGINT": 2 ** 63}
+# the bytes each MariaDB string type holds, or characters for VARCHAR
+string_limits = {"TEXT": 65535, "BLOB": 65535, "VARBINARY(255)": 255, "VARCHAR(255)": 255}
 
-    if searching_for_end and re.match(r'.*\);', line):
-        searching_for_end = False
 
-    if re.match(r"CREATE INDEX", line):
-        line = re.sub('"', '`', line)
+# a number MariaDB reads from a string in a numeric column, or None if strict mode rejects the string
+def as_number(value):
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+
+# why MariaDB in strict mode would reject or change a value in a column of type mtype, or None if it won't
+def value_problem(value, mtype):
+    if value is None:
+        return None
+    if mtype in int_limits or mtype == "DOUBLE" or mtype.startswith("DECIMAL"):
+        if isinstance(value, bytes):
+            return "binary data in a " + mtype + " column"
+        if isinstance(value, str):
+            value = as_number(value.strip())
+            if value is None:
+                return "text in a " + mtype + " column"
+        if mtype in int_limits:
+            if isinstance(value, float):
+                if not value.is_integer():
+                    return "a fraction rounded off in a " + mtype + " column"
+                value = int(value)
+            if not -int_limits[mtype] <= value < int_limits[mtype]:
+                return "out of range for " + mtype
+        elif mtype.startswith("DECIMAL") and abs(value) >= 10 ** 20:
+            return "out of range for " + mtype
+        return None
+    if mtype in string_limits:
+        if isinstance(value, str):
+            size = len(value) if mtype.startswith("VARCHAR") else len(value.encode("utf-8"))
+        else:
+            size = len(value) if isinstance(value, bytes) else len(literal(value))
+        if size > string_limits[mtype]:
+            return "too long for " + mtype
+        return None
+    return "an unknown type " + mtype
+
+
+# SQLite-only syntax that MariaDB rejects or reads differently
+sqlite_only = [r"\bAUTOINCREMENT\b", r"\bWITHOUT ROWID\b", r'^CREATE[^"]*"', r"\bCOLLATE NOCASE\b", r"\bPRAGMA\b",
+               r"\bVIRTUAL\b", r"\bTRIGGER\b"]
+
+
+# the statements of an export, split on the ; that ends each one
+def read_statements(sqlfile):
+    statement = []
+    with open(sqlfile, 'r') as fin:
+        for line in fin:
+            statement.append(line)
+            if line.endswith(";\n"):
+                yield "".join(statement).strip()
+                statement = []
+
+
+# checks an export against its database: every statement is in MariaDB's dialect, every value fits the
+# MariaDB type its CREATE TABLE gives the column, and reading the INSERTs back the way MariaDB would
+# gives exactly the rows of each table
+# returns a list of problems, empty when the export is good
+def check_export(dbc, sqlfile):
+    problems = []
+    exported = {}
+    schemas = {}  # table -> {column: (MariaDB type, NOT NULL)}
+    misfits = {}  # (table, column, problem) -> [rows, first value]
+    for statement in read_statements(sqlfile):
+        if statement.startswith("INSERT"):
+            try:
+                table, columns, rows = parse_insert(statement)
+            except ValueError as e:
+                problems.append(str(e))
+                continue
+            exported.setdefault(table, []).extend(rows)
+            schema = schemas.get(table)
+            if schema is None:
+                problems.append(table + " is filled before it is created")
+                continue
+            types = [schema.get(column, ("an undeclared column", False)) for column in columns]
+            for row in rows:
+                for column, (mtype, notnull), value in zip(columns, types, row):
+                    problem = "NULL in a NOT NULL column" if value is None and notnull else value_problem(value, mtype)
+                    if problem is not None:
+                        misfit = misfits.setdefault((table, column, problem), [0, value])
+                        misfit[0] += 1
+            continue
+        if statement.startswith("CREATE TABLE"):
+            table, schema = parse_create(statement)
+            schemas[table] = schema
+        for pattern in sqlite_only:
+            if re.search(pattern, statement, re.MULTILINE):
+                problems.append("SQLite syntax " + pattern + " in: " + statement[:60])
+    for (table, column, problem), (count, value) in misfits.items():
+        problems.append(table + "." + column + ": " + str(count) + " values MariaDB won't take as they are, " +
+                        problem + ", e.g. " + literal(value)[:60])
+    for table in export_tables(dbc):
+        original = [tuple(None if isinstance(value, float) and not finite(value) else value for value in row)
+                    for row in dbc.execute("SELECT * FROM " + quote_name(table))]
+        if original != exported.pop(table, []):
+            problems.append(table + " doesn't read back the same")
+    for table in exported:
+        problems.append(table + " was exported but isn't in the database")
+    return problems
+
+
+@click.command()
+@click.argument('dbfile', default="nests.db")
+@click.option('-o', '--output', default="-", help="File to write the MariaDB script to, - for stdout")
+@click.option('-b', '--batch-size', default=batch_size, show_default=True, help="Rows per INSERT statement")
+@click.option('--check', is_flag=True, help="Read the script back and compare it with the database")
+def main(dbfile, output, batch_size, check):
+    if check and output == "-":
+        raise click.UsageError("--check needs the script in a file, use --output")
+    dbc = sqlite3.connect("file:" + dbfile + "?mode=ro", uri=True)
+    if output == "-":
+        counts = export(dbc, sys.stdout, batch_size)
+    else:
+        with open(output, 'w', encoding="utf-8", buffering=write_buffer) as out:
+            counts = export(dbc, out, batch_size)
+    for table, (rows, statements) in counts.items():
+        print(table + ": " + str(rows) + " rows in " + str(statements) + " INSERTs", file=sys.stderr)
+    if check:
+        problems = check_export(dbc, output)
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        print("The export reads back the same" if len(problems) == 0 else str(len(problems)) + " problems",
+              file=sys.stderr)
+        if len(problems) > 0:
+            sys.exit(1)
 
-    print(line)
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+# -*- coding: UTF-8 -*-
+# vim: set fileencoding=UTF-8 :
+
+# Answers the questions people ask about a city's nest history: which parks a species likes,
+# what a park usually gets, the longest streaks, and which species share parks
+# The whole history is held as a rotation × park matrix of species numbers, which needs numpy
+# The matrix is saved next to the database so that later runs only load the new and changed rotations
+
+import os
+import zlib
+
+import click
+
+import citydb
+import importoldlists as dbutils
+import species as speciesdb
+import timings
+import update as output
+
+no_report = 0  # a park nobody reported in a rotation
+unknown_species = -1  # a report whose species isn't in the registry
+
+# a checksum of each rotation's reports: the count, two sums that mix the nest ID with the species number
+# so that swapping two parks' species changes them, and the reports that only have a species name
+sql_checksums = """SELECT rotation_num, count(*),
+        sum(((nestid * 7919 + 1) % 1000003) * (coalesce(species_no, 0) * 65537 + 1) % 2147483647),
+        sum(((nestid * 7919 + 1) % 1000003) * (coalesce(species_no, 0) + 1)),
+        group_concat(CASE WHEN species_no IS NULL THEN nestid || ':' || species_txt END, '|')
+    FROM species_list GROUP BY rotation_num"""
+no_reports = (0, 0, 0, 0)  # the checksum of a rotation nobody has reported in
+
+
+# numpy is only needed here, so the rest of the tools run without it
+def load_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise click.ClickException("The nest statistics need numpy: pip3 install numpy")
+    return numpy
+
+
+# every report in species_list as a matrix with one row per rotation (in date order) and one
+# column per park (in nest ID order) holding the species number, no_report, or unknown_species
+# the matrix also keeps the database's data_version (see update.get_data_version) and a checksum of each
+# rotation from when it was loaded, so that it knows which rotations have been edited since
+class NestMatrix:
+    def __init__(self, rotations=(), dates=(), nests=(), matrix=None, checksums=None, version=None):
+        np = load_numpy()
+        self.rotations = np.asarray(rotations, dtype=np.int64)
+        self.dates = np.asarray(dates, dtype=str)
+        self.nests = np.asarray(nests, dtype=np.int64)
+        if matrix is None:
+            matrix = np.zeros((len(self.rotations), len(self.nests)), dtype=np.int16)
+        self.matrix = matrix
+        if checksums is None:  # reloads every rotation
+            checksums = np.full((len(self.rotations), len(no_reports)), -1, dtype=np.int64)
+        self.checksums = checksums
+        self.version = version
+
+    # loads a matrix saved with save, or returns an empty one if there isn't one
+    @classmethod
+    def load(cls, file):
+        np = load_numpy()
+        if not os.path.isfile(file):
+            return cls()
+        with np.load(file) as saved:
+            if "checksums" not in saved.files:  # saved before the checksums
+                return cls(saved["rotations"], saved["dates"], saved["nests"], saved["matrix"])
+            version = int(saved["version"])
+            return cls(saved["rotations"], saved["dates"], saved["nests"], saved["matrix"], saved["checksums"],
+                       version if version >= 0 else None)
+
+    def save(self, file):
+        np = load_numpy()
+        with open(file, 'wb') as out:  # savez would add .npz to a name without it
+            np.savez(out, rotations=self.rotations, dates=self.dates, nests=self.nests, matrix=self.matrix,
+                     checksums=self.checksums, version=np.int64(self.version if self.version is not None else -1))
+
+    # brings the matrix up to date with the database
+    # nothing is read when no table has been edited since the last refresh; otherwise every rotation whose
+    # checksum changed is reloaded along with the new ones, so an edit or reimport of an old rotation shows up
+    # pass rebuild to reload everything, e.g. after the species registry changes
+    # returns the number of rotations loaded from the database
+    def refresh(self, dbc, rebuild=False):
+        np = load_numpy()
+        version = output.get_data_version(dbc)
+        if not rebuild and version is not None and version == self.version:
+            return 0
+        rotations = dbc.execute("SELECT num, date FROM rotation_dates ORDER BY date, num").fetchall()
+        nests = np.array([row[0] for row in dbc.execute("SELECT nest_id FROM nest_locations ORDER BY nest_id")],
+                         dtype=np.int64)
+        nums = np.array([row[0] for row in rotations], dtype=np.int64)
+        matrix = np.zeros((len(nums), len(nests)), dtype=np.int16)
+        checks = rotation_checksums(dbc)
+        checksums = np.array([checks.get(int(num), no_reports) for num in nums], dtype=np.int64)
+        checksums = checksums.reshape(len(nums), len(no_reports))
+
+        rowof = dict((int(num), row) for row, num in enumerate(nums))
+        saved = dict((int(num), tuple(row)) for num, row in zip(self.rotations, self.checksums.tolist()))
+        settled = set()
+        if not rebuild:
+            settled = set(num for num in rowof if saved.get(num) == checks.get(num, no_reports))
+        keep_rows = np.array([int(num) in settled and int(num) in rowof for num in self.rotations], dtype=bool)
+        keep_cols = np.isin(self.nests, nests)
+        if keep_rows.any() and keep_cols.any():
+            rows = [rowof[int(num)] for num in self.rotations[keep_rows]]
+            cols = np.searchsorted(nests, self.nests[keep_cols])
+            matrix[np.ix_(rows, cols)] = self.matrix[np.ix_(keep_rows, keep_cols)]
+
+        todo = [int(num) for num in nums if int(num) not in settled]
+        registry = speciesdb.registry(dbc)
+        for start in range(0, len(todo), 500):  # stay under SQLite's limit on ? parameters
+            batch = todo[start:start + 500]
+            sql = ("SELECT rotation_num, nestid, species_no, species_txt FROM species_list WHERE rotation_num IN (" +
+                   ",".join("?" * len(batch)) + ")")
+            reports = dbc.execute(sql, batch).fetchall()
+            rows = np.array([rowof[report[0]] for report in reports], dtype=np.int64)
+            nestids = np.array([report[1] for report in reports], dtype=np.int64)
+            spnums = np.array([report[2] if report[2] is not None else self.species_num(registry, report[3])
+                               for report in reports], dtype=np.int16)
+            found = np.isin(nestids, nests)  # skips reports for parks that have since been deleted
+            matrix[rows[found], np.searchsorted(nests, nestids[found])] = spnums[found]
+
+        self.rotations = nums
+        self.dates = np.array([row[1] for row in rotations], dtype=str)
+        self.nests = nests
+        self.matrix = matrix
+        self.checksums = checksums
+        self.version = version
+        return len(todo)
+
+    # the species number of a report that only has the species name
+    @staticmethod
+    def species_num(registry, name):
+        found = registry.lookup(name)
+        return found.num if found is not None else unknown_species
+
+    # the column of a nest ID
+    def column(self, nestid):
+        np = load_numpy()
+        col = np.searchsorted(self.nests, nestid)
+        if col >= len(self.nests) or self.nests[col] != nestid:
+            return None
+        return int(col)
+
+    # how many rotations each park had spnum, one count per park
+    def park_counts(self, spnum):
+        return (self.matrix == spnum).sum(axis=0)
+
+    # how many times each species nested in the park at col
+    # returns a list of (species number, rotations) with the most frequent first
+    def park_species(self, col):
+        np = load_numpy()
+        reports = self.matrix[:, col]
+        nums, counts = np.unique(reports[reports != no_report], return_counts=True)
+        order = np.argsort(-counts, kind="stable")
+        return [(int(nums[i]), int(counts[i])) for i in order]
+
+    # the longest run of consecutive rotations with spnum at each park, and the rotation row it ended on
+    def streaks(self, spnum):
+        np = load_numpy()
+        hits = np.zeros((len(self.rotations) + 2, len(self.nests)), dtype=np.int8)
+        hits[1:-1] = self.matrix == spnum
+        edges = np.diff(hits, axis=0).T  # one row per park, so nonzero walks each park in rotation order
+        cols, starts = np.nonzero(edges == 1)
+        _, ends = np.nonzero(edges == -1)
+        lengths = ends - starts
+        longest = np.zeros(len(self.nests), dtype=np.int64)
+        np.maximum.at(longest, cols, lengths)
+        last = np.full(len(self.nests), -1, dtype=np.int64)
+        best = lengths == longest[cols]
+        np.maximum.at(last, cols[best], ends[best] - 1)
+        return longest, last
+
+    # how many rotations in a row each park has had the species it has in the latest rotation
+    def current_streaks(self):
+        np = load_numpy()
+        if len(self.rotations) == 0:
+            return np.zeros(len(self.nests), dtype=np.int64)
+        same = (self.matrix == self.matrix[-1]) & (self.matrix[-1] != no_report)
+        broken = ~same[::-1]
+        return np.where(broken.any(axis=0), broken.argmax(axis=0), len(self.rotations))
+
+    # how often each species has nested in a park where spnum has also nested
+    # counts parks, not rotations, so a species that sits in one park all year counts once
+    # returns a list of (species number, parks) with the most shared parks first
+    def shared_parks(self, spnum):
+        np = load_numpy()
+        nums = np.unique(self.matrix[(self.matrix != no_report) & (self.matrix != unknown_species)])
+        index = np.searchsorted(nums, self.matrix)
+        present = np.zeros((len(nums), len(self.nests)), dtype=np.int32)
+        rows, cols = np.nonzero(np.isin(self.matrix, nums))
+        present[index[rows, cols], cols] = 1
+        mine = np.searchsorted(nums, spnum)
+        if mine >= len(nums) or nums[mine] != spnum:
+            return []
+        together = present @ present[mine]
+        together[mine] = 0
+        order = np.argsort(-together, kind="stable")
+        return [(int(nums[i]), int(together[i])) for i in order if together[i] > 0]
+
+
+# rotation number -> the checksum of its reports, see sql_checksums
+def rotation_checksums(dbc):
+    return dict((row[0], (row[1], row[2], row[3], zlib.crc32((row[4] or "").encode("utf-8"))))
+                for row in dbc.execute(sql_checksums))
+
+
+# the saved matrix for a database
+def matrix_file(dbfile):
+    return os.path.splitext(dbfile)[0] + ".stats.npz"
+
+
+# returns the database's matrix, updated with any rotations added or edited since it was saved
+def load_matrix(dbc, dbfile, rebuild=False):
+    nests = NestMatrix.load(matrix_file(dbfile))
+    version = nests.version
+    loaded = nests.refresh(dbc, rebuild)
+    if loaded > 0 or nests.version != version:
+        nests.save(matrix_file(dbfile))
+    return nests
+
+
+# the registry entry for a species argument, which has to match exactly one species
+def pick_species(dbc, text):
+    matches = speciesdb.registry(dbc).match(text)
+    if len(matches) != 1:
+        raise click.ClickException(("No species matches " if len(matches) == 0 else "Be more specific than ") +
+                                   text + " " + str(matches))
+    return matches[0]
+
+
+# the name of a species number in the output
+def species_name(registry, spnum):
+    if spnum == unknown_species:
+        return "(not a nesting species)"
+    found = registry.get(spnum)
+    return found.name if found is not None else "#" + str(spnum)
+
+
+# park names with their neighborhood, for the output
+def park_names(dbc):
+    return dict((row[0], row[1] + " [" + str(row[2] or "Missing") + "]") for row in dbc.execute(
+        """SELECT nest_id, official_name, neighborhoods.name FROM nest_locations
+            LEFT OUTER JOIN neighborhoods ON nest_locations.location = neighborhoods.id"""))
+
+
+@click.group()
+@click.option('--db', 'dbfile', default=None, help="Database to read, nests.db by default")
+@click.option('--rebuild', is_flag=True, help="Reload every rotation instead of just the new and edited ones")
+@click.option(
+    '--profile',
+    default="render",
+    help="Database connection profile, see connection_profiles in importoldlists.py and general.cfg")
+@citydb.city_option(many=False)
+@timings.option
+@click.pass_context
+def main(ctx, dbfile, rebuild, profile, cities=((None, citydb.default_database),)):
+    if dbfile is not None and cities[0][0] is not None:
+        raise click.UsageError("Pick the database with --db or --city, not both")
+    dbfile = dbfile or cities[0][1]
+    dbc = dbutils.create_connection(dbfile, profile)
+    with timings.phase("load matrix"):
+        ctx.obj = dbc, load_matrix(dbc, dbfile, rebuild)
+
+
+@main.command()
+@click.argument('name')
+@click.option('-n', '--top', default=15, help="Number of parks to list")
+@click.pass_obj
+def parks(obj, name, top):
+    """The parks where a species has nested most often"""
+    dbc, nests = obj
+    found = pick_species(dbc, name)
+    counts = nests.park_counts(found.num)
+    longest, _ = nests.streaks(found.num)
+    names = park_names(dbc)
+    print(found.name + " has nested " + str(int(counts.sum())) + " times in " + str(len(nests.rotations)) +
+          " rotations")
+    for col in load_numpy().argsort(-counts, kind="stable")[:top]:
+        if counts[col] == 0:
+            break
+        print(f"{int(counts[col]):>5}  longest streak {int(longest[col]):>3}  {names[int(nests.nests[col])]}")
+
+
+@main.command()
+@click.argument('search')
+@click.pass_obj
+def park(obj, search):
+    """How often each species has nested in a park"""
+    dbc, nests = obj
+    results, _ = dbutils.query_nest(search, dbc)
+    if results is None:
+        raise click.ClickException("No park matches " + search)
+    registry = speciesdb.registry(dbc)
+    names = park_names(dbc)
+    current = nests.current_streaks()
+    for nestid in list(dict.fromkeys(result[0] for result in results)):
+        col = nests.column(nestid)
+        if col is None:
+            continue
+        history = nests.park_species(col)
+        print(names[nestid] + ": reported in " + str(sum(count for _, count in history)) + " of " +
+              str(len(nests.rotations)) + " rotations")
+        if current[col] > 0:
+            print(f"    currently {species_name(registry, int(nests.matrix[-1, col]))} "
+                  f"for {int(current[col])} rotations in a row")
+        for spnum, count in history:
+            print(f"{count:>7}  {species_name(registry, spnum)}")
+
+
+@main.command()
+@click.argument('name', required=False)
+@click.option('-n', '--top', default=15, help="Number of streaks to list")
+@click.pass_obj
+def streaks(obj, name, top):
+    """The longest runs of one species in one park, or the current runs if no species is given"""
+    dbc, nests = obj
+    np = load_numpy()
+    names = park_names(dbc)
+    if name is None:
+        registry = speciesdb.registry(dbc)
+        current = nests.current_streaks()
+        for col in np.argsort(-current, kind="stable")[:top]:
+            if current[col] == 0:
+                break
+            print(f"{int(current[col]):>5}  {species_name(registry, int(nests.matrix[-1, col]))} at "
+                  f"{names[int(nests.nests[col])]}")
+        return
+    found = pick_species(dbc, name)
+    longest, last = nests.streaks(found.num)
+    for col in np.argsort(-longest, kind="stable")[:top]:
+        if longest[col] == 0:
+            break
+        print(f"{int(longest[col]):>5}  until {nests.dates[last[col]]}  {names[int(nests.nests[col])]}")
+
+
+@main.command()
+@click.argument('name')
+@click.option('-n', '--top', default=15, help="Number of species to list")
+@click.pass_obj
+def shared(obj, name, top):
+    """The species that nest in the same parks as a species"""
+    dbc, nests = obj
+    found = pick_species(dbc, name)
+    registry = speciesdb.registry(dbc)
+    mine = int((nests.park_counts(found.num) > 0).sum())
+    print(found.name + " has nested in " + str(mine) + " parks, which have also had")
+    for spnum, count in nests.shared_parks(found.num)[:top]:
+        print(f"{count:>5}  {species_name(registry, spnum)}")
+
+
+if __name__ == "__main__":
+    main()
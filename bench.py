@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+# -*- coding: UTF-8 -*-
+# vim: set fileencoding=UTF-8 :
+
+# Benchmarks for the slow paths, run with synthetic data so they work without a real city
+# python3 bench.py --help lists them
+
+import csv
+import datetime
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+import click
+
+import SQLite2Maria as maria
+import importoldlists as dbutils
+import sort
+import synthcity
+import update
+
+
+# runs func once and returns its result, the seconds it took, and the peak traced memory in bytes
+def measure(func, *args, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+# runs func once and returns its result and the seconds it took, for runs too big to trace memory
+def stopwatch(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def report(label, elapsed, peak):
+    print(f"{label:<32}{elapsed:>9.3f}s{peak / 1e6:>10.1f} MB")
+
+
+# builds a rotation in the same shape get_nests returns, spread over 200 locations
+# returns the nested nest list, the empties, and the species summary
+def fake_rotation(size, seed=57):
+    rng = random.Random(seed)
+    nests = update.NestGroups()
+    empties = update.NestGroups()
+    species = update.NestGroups()
+    for num in range(size):
+        loc = "Region " + str(num % 200)
+        name = "Park " + str(num)
+        if rng.random() < 0.3:
+            empties.add(loc, name, update.Nest(private=rng.random() < 0.1))
+            continue
+        nest = update.Nest(
+            species="Species " + str(rng.randrange(300)),
+            status=rng.choice([1, 2]),
+            private=rng.random() < 0.1,
+            ghost=rng.random() < 0.05,
+            alt="Alt " + str(num) if rng.random() < 0.3 else '',
+            note="Note " + str(num) if rng.random() < 0.1 else None)
+        nests.add(loc, name, nest)
+        species.add(nest.species, name, nest)
+    return nests, empties, species
+
+
+# the nest shape update.py used before Nest: a recursive defaultdict per nest
+def dict_nest(row):
+    nested_dict = lambda: defaultdict(nested_dict)
+    nest = nested_dict()
+    nest["Official Name"], nest["Short Name"], nest["Neighborhood"], nest["Region"] = row[:4]
+    nest["Species"], nest["Private"], nest["Note"], nest["Status"] = row[4:8]
+    nest["Ghost"], nest["SpNum"], nest["Alt"] = row[8:]
+    return nest
+
+
+def slotted_nest(row):
+    return update.Nest(
+        official_name=row[0], short_name=row[1], neighborhood=row[2], region=row[3],
+        species=row[4], private=row[5], note=row[6], status=row[7],
+        ghost=row[8], species_num=row[9], alt=row[10])
+
+
+@click.group()
+def main():
+    pass
+
+
+# the Facebook renderers the way update.py wrote them before streaming, one string built with +=
+# the nests are Nest records so the output can be compared byte for byte with write_FB_post
+def old_FB_format_nests(nnl):
+    list = ""
+    for location in sorted(nnl.keys()):
+        list += update.decorate_text(location.split("ZZZ")[-1], "{~()~}") + '\n'
+        for nestname, nest in nnl[location].items():
+            if nest.ghost:
+                list += update.ghost_icon
+            if nest.private:
+                list += update.private_reminder
+            list += nestname
+            if nest.alt != "":
+                list += "/" + nest.alt
+            if nest.note is not None and nest.note != "":
+                list += " " + update.gen_parenthetical(nest.note, '')
+            list += ": " + nest.species
+            if nest.status == 1:
+                list += "*"
+            list += '\n'
+        list += '\n'
+    return list
+
+
+def old_FB_empty(empties):
+    list = update.decorate_text("No Reports", "[--  --]") + '\n'
+    for location in sorted(empties.keys()):
+        list += "• " + location + ": "
+        first = True
+        for park in sorted(empties[location].keys()):
+            if first is False:
+                list += ","
+            list += " " + (update.private_reminder if empties[location][park].private else '') + park
+            first = False
+        list += '\n'
+    return list
+
+
+def old_FB_summary(summary):
+    icons = {"Wailmer": update.smallwhale, "Wailord": update.largewhale, "Girafarig": update.giraffe_icon,
+             "Hoothoot": update.hoothoot, "Rattata": update.rat_icon, "Water Biome": update.water_icon}
+    out = update.decorate_text("Summary", "[--  --]")
+    for species in sorted(summary.keys()):
+        spico = update.ghost_icon if species in summary.spooked else icons.get(species, '')
+        out += "\n" + spico + species + ":"
+        first = True
+        for park in sorted(summary[species].keys()):
+            if first is False:
+                out += ","
+            if summary[species][park].private:
+                out += update.private_reminder
+            out += " " + park
+            if summary[species][park].status == 1:
+                out += "*"
+            first = False
+    out += "\n\n"
+    return out
+
+
+def old_FB_preamble(updated8, rotationday, rotnum):
+    out = "#Nests #Tracking #Migration\n"
+    out += "* = Unconfirmed, "
+    out += update.private_reminder + "️ = Private property, please be respectful\n"
+    out += rotationday + " nest shift (#" + str(rotnum) + ")\n"
+    out += "Last updated: " + updated8 + "\n\n"
+    return out
+
+
+def old_write_FB_post(nnl, rundate, shiftdate, mt=None, slist=None, rotnum=0):
+    out = old_FB_preamble(rundate, shiftdate, rotnum)
+    if slist is not None:
+        out += old_FB_summary(slist)
+        out += update.decorate_text(" • ", "---==<>==---") + "\n\n"
+    out += old_FB_format_nests(nnl)
+    if mt is not None:
+        out += old_FB_empty(mt)
+    return out
+
+
+# the fastest of runs untraced timings of func, in seconds
+def best_of(runs, func, *args, **kwargs):
+    return min(stopwatch(func, *args, **kwargs)[1] for _ in range(runs))
+
+
+@main.command()
+@click.option('-n', '--size', default=10000, help="Number of parks in the rotation")
+@click.option('-r', '--runs', default=5, help="Untraced runs to take the fastest of")
+def fb(size, runs):
+    """Time and peak memory of the Facebook post renderer, before and after streaming"""
+    nests, empties, species = fake_rotation(size)
+    args = (nests, "run", "shift")
+    kwargs = {"mt": empties, "slist": species}
+    print(f"{'':<32}{'untraced':>10}{'traced':>10}{'peak':>13}")
+    old, elapsed, peak = measure(old_write_FB_post, *args, **kwargs)
+    print(f"{'+= string (before)':<32}{best_of(runs, old_write_FB_post, *args, **kwargs):>9.3f}s"
+          f"{elapsed:>9.3f}s{peak / 1e6:>10.1f} MB")
+    post, elapsed, peak = measure(update.write_FB_post, *args, **kwargs)
+    print(f"{'streamed to a string':<32}{best_of(runs, update.write_FB_post, *args, **kwargs):>9.3f}s"
+          f"{elapsed:>9.3f}s{peak / 1e6:>10.1f} MB")
+    with open(os.devnull, 'w') as sink:
+        _, elapsed, peak = measure(update.write_FB_post, *args, out=sink, **kwargs)
+        untraced = best_of(runs, update.write_FB_post, *args, out=sink, **kwargs)
+    print(f"{'streamed to a file':<32}{untraced:>9.3f}s{elapsed:>9.3f}s{peak / 1e6:>10.1f} MB")
+    print(str(len(post)) + " characters, " + ("the same as before" if post == old else "DIFFERENT from before"))
+
+
+@main.command()
+@click.option('-n', '--size', default=100000, help="Number of nests to hold in memory")
+def memory(size):
+    """Memory used per nest by the old dict nests and by Nest records"""
+    rows = [("Park " + str(num), None, "Neighborhood " + str(num % 500), "Region " + str(num % 50),
+             "Species " + str(num % 300), 0, None, 2, False, num % 300, '') for num in range(size)]
+    for label, build in [("defaultdict nests", dict_nest), ("Nest records", slotted_nest)]:
+        nests, elapsed, peak = measure(lambda: [build(row) for row in rows])
+        report(label, elapsed, peak)
+        print(f"{'':<32}{peak / size:>10.0f} bytes per nest")
+        del nests
+
+
+# the empties query update.py used before the anti-join, with the nest row layout nstrw2nnl reads
+old_sqmt = """SELECT NULL, NULL, nls.nest_id, nls.official_name, nls.short_name, nls.notes, nls.private,
+            nbz.name, regions.name, NULL
+        FROM nest_locations AS nls
+            LEFT OUTER JOIN neighborhoods AS nbz ON (nls.location = nbz.id)
+            LEFT OUTER JOIN regions ON (nbz.region = regions.id)
+        WHERE nls.nest_id NOT IN (SELECT nestid FROM species_list WHERE rotation_num = ?)"""
+
+
+# the No Reports section the way get_nests built it before the anti-join
+def old_empties(dbc, rotnum):
+    empties = update.NestGroups()
+    alts = update.load_alt_names(dbc)
+    for nestrow in dbc.execute(old_sqmt, [rotnum]):
+        empties.add(nestrow[7], update.nestname(nestrow), update.nstrw2nnl(nestrow, alts=alts))
+    return empties
+
+
+def new_empties(dbc, rotnum):
+    empties = update.NestGroups()
+    for oname, sname, private, neighborhood in dbc.execute(update.sqmt, [rotnum]):
+        empties.add(neighborhood, sname if sname is not None else oname,
+                    update.Nest(private=private, official_name=oname, short_name=sname, neighborhood=neighborhood))
+    return empties
+
+
+@main.command()
+@click.option('-n', '--size', default=50000, help="Number of parks in the city")
+@click.option('-w', '--weeks', default=52, help="Number of rotations, each with a third of the parks reported")
+def empties(size, weeks):
+    """The No Reports section of one rotation, before and after the anti-join"""
+    rng = random.Random(57)
+    dbc = dbutils.create_connection(":memory:")
+    dbutils.setup_db(dbc)
+    dbc.executemany("INSERT INTO regions(name) VALUES (?)", [("Region " + str(num),) for num in range(50)])
+    dbc.executemany("INSERT INTO neighborhoods(name, region) VALUES (?,?)",
+                    [("Neighborhood " + str(num), num % 50 + 1) for num in range(size // 20 + 1)])
+    dbc.executemany("INSERT INTO nest_locations(official_name, location, private) VALUES (?,?,?)",
+                    [("Park " + str(num), num % (size // 20 + 1) + 1, rng.random() < 0.1) for num in range(size)])
+    for week in range(1, weeks + 1):
+        dbc.execute("INSERT INTO rotation_dates(date) VALUES (?)", [str(week)])
+        dbc.executemany("INSERT INTO species_list(rotation_num, nestid, species_txt) VALUES (?,?,?)",
+                        [(week, nest, "Eevee") for nest in rng.sample(range(1, size + 1), size // 3)])
+    dbc.commit()
+    rotnum = weeks // 2
+    for label, build in [("NOT IN and full nest rows", old_empties), ("anti-join", new_empties)]:
+        mt, elapsed, peak = measure(build, dbc, rotnum)
+        report(label, elapsed, peak)
+        with open(os.devnull, 'w') as sink:
+            _, elapsed, peak = measure(update.FB_empty, mt, out=sink)
+        report("    No Reports section", elapsed, peak)
+    for row in dbc.execute("EXPLAIN QUERY PLAN " + update.sqmt, [rotnum]):
+        print("    " + row[3])
+
+
+# update.load_nests before csv.reader: a DictReader dict per row, copied into a Nest
+def old_load_nests(nestfile):
+    nestlist = update.NestGroups()
+    empties = update.NestGroups()
+    f = open(nestfile, 'r')
+    nests = csv.DictReader(f, delimiter="\t")
+    for nest in nests:
+        loc = nest["Location"].strip()
+        if loc == "":
+            loc = "ZZZZZZNo location information"  # sort at the end
+        stat = update.assign_status(nest["Species"], nest["Confirm?"])
+        name = nest["Primary Name"].strip()
+        if stat == 0:
+            list = empties
+        else:
+            list = nestlist
+        list.add(loc, name, update.Nest(
+            species=nest["Species"].strip(),
+            status=stat,
+            private=update.true_if_Y(nest["Private Property?"]),
+            alt=nest["Alternate Name"].strip(),
+            note=nest["Notes"].strip()))
+    f.close()
+    return nestlist, empties
+
+
+@main.command()
+@click.option('-n', '--size', default=300000, help="Number of parks in the list")
+@click.option('-r', '--runs', default=3, help="Untraced runs to take the fastest of")
+def tsv(size, runs):
+    """Loading and rendering a large old TSV nest list with DictReader and with csv.reader"""
+    folder = tempfile.mkdtemp()
+    try:
+        parks, _ = synthcity.make_city(size * 3)  # each old list reports a third of the parks
+        nestfile = synthcity.write_history(folder, parks, 1)[0]
+        print(str(os.path.getsize(nestfile) // 1000000) + " MB, " + str(size) + " parks")
+        print(f"{'':<32}{'load':>10}{'render':>10}{'traced peak':>14}")
+        posts = {}
+        for label, load in [("DictReader", old_load_nests), ("csv.reader", update.load_nests)]:
+            loaded = best_of(runs, load, nestfile)
+            (nests, mt), _, peak = measure(load, nestfile)
+            with open(os.devnull, 'w') as sink:
+                rendered = best_of(runs, update.write_FB_post, nests, "run", "shift", mt=mt, out=sink)
+            posts[label] = update.write_FB_post(nests, "run", "shift", mt=mt)
+            print(f"{label:<32}{loaded:>9.3f}s{rendered:>9.3f}s{peak / 1e6:>11.1f} MB")
+            del nests, mt
+        print("The posts are " + ("the same" if len(set(posts.values())) == 1 else "DIFFERENT"))
+    finally:
+        shutil.rmtree(folder)
+
+
+@main.command()
+@click.option('-r', '--runs', default=10, help="Cold starts to time for each subcommand")
+def startup(runs):
+    """Interpreter start plus import time of each nestlister subcommand"""
+    import nestlister
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def cold_start(code):
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=here, check=True)
+            times.append(time.perf_counter() - start)
+        return statistics.median(times)
+
+    print(f"{'bare interpreter':<32}{cold_start('pass'):>9.3f}s")
+    for name in nestlister.subcommands:
+        elapsed = cold_start("import nestlister; nestlister.load('" + name + "')")
+        print(f"{name:<32}{elapsed:>9.3f}s")
+
+
+@main.command()
+@click.option('-n', '--size', default=20000, help="Number of parks in the city")
+@click.option('-w', '--weeks', default=20, help="Number of historical rotations")
+def profiles(size, weeks):
+    """Import and render times under each database connection profile"""
+    folder = tempfile.mkdtemp()
+    try:
+        cfile, hfolder = synthcity.write_synthetic_city(folder, "Benchville", size, weeks)
+        for profile in [None, "render", "import"]:
+            dbfile = os.path.join(folder, str(profile) + ".db")
+            dbc = dbutils.create_connection(dbfile, profile)
+            dbutils.setup_db(dbc)
+            start = time.perf_counter()
+            dbutils.import_city(cfile, dbc)
+            dbc.commit()
+            dbutils.import_old_lists(hfolder, dbc, workers=1)
+            imported = time.perf_counter() - start
+            start = time.perf_counter()
+            for rotnum, shiftdate in dbc.execute("SELECT num, date FROM rotation_dates").fetchall():
+                update.render_rotation(dbc, rotnum, shiftdate, "run", ["Facebook", "Discord"])
+            rendered = time.perf_counter() - start
+            # nestedit commits once per session, but bots editing one park at a time commit after each
+            start = time.perf_counter()
+            for nestid in range(1, 1001):
+                dbc.execute("UPDATE nest_locations SET notes = ? WHERE nest_id = ?", ["edited", nestid])
+                dbc.commit()
+            edited = time.perf_counter() - start
+            dbc.close()
+            print(f"{str(profile):<12}import {imported:>8.3f}s   render {rendered:>8.3f}s   "
+                  f"1000 edits {edited:>8.3f}s")
+    finally:
+        shutil.rmtree(folder)
+
+
+@main.command()
+@click.option('-n', '--size', default=20000, help="Number of parks in the city")
+@click.option('-w', '--weeks', default=52, help="Number of historical rotations")
+@click.option('--batches', default="1,100,1000,10000", help="Comma-separated rows per INSERT to time")
+def export(size, weeks, batches):
+    """Throughput of the MariaDB export at each batch size, and a read-back check of its output"""
+    folder = tempfile.mkdtemp()
+    try:
+        cfile, hfolder = synthcity.write_synthetic_city(folder, "Benchville", size, weeks)
+        dbfile = os.path.join(folder, "nests.db")
+        dbc = dbutils.create_connection(dbfile, "import")
+        dbutils.setup_db(dbc)
+        dbutils.import_city(cfile, dbc)
+        dbc.commit()
+        dbutils.import_old_lists(hfolder, dbc, workers=1)
+        dbc.close()
+        dbc = sqlite3.connect(dbfile)
+        sqlfile = os.path.join(folder, "nests.sql")
+        for rows in [int(batch) for batch in batches.split(",")]:
+            with open(sqlfile, 'w', encoding="utf-8", buffering=maria.write_buffer) as out:
+                counts, elapsed = stopwatch(maria.export, dbc, out, rows)
+            total = sum(count for count, _ in counts.values())
+            statements = sum(inserts for _, inserts in counts.values())
+            megabytes = os.path.getsize(sqlfile) / 1e6
+            print(f"{rows:>6} rows per INSERT {elapsed:>8.3f}s {total / elapsed:>10.0f} rows/s "
+                  f"{megabytes / elapsed:>7.1f} MB/s {statements:>9} INSERTs {megabytes:>7.1f} MB")
+        problems, elapsed = stopwatch(maria.check_export, dbc, sqlfile)
+        print("read-back check " + ("passed" if len(problems) == 0 else "failed: " + "; ".join(problems[:5])) +
+              f" in {elapsed:.3f}s")
+    finally:
+        shutil.rmtree(folder)
+
+
+# the commit being benchmarked, or None outside of a git checkout
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+@main.command()
+@click.option('--sizes', default="1000,10000,100000,1000000", help="Comma-separated city sizes in parks")
+@click.option('-w', '--weeks', default=6, help="Number of historical rotations")
+@click.option('--searches', default=200, help="Number of park searches to time")
+@click.option('-o', '--results', default="bench-results.jsonl", help="File to add one JSON line per timing to")
+def scale(sizes, weeks, searches, results):
+    """Times each stage of the tools on synthetic cities from 1k to 1M parks"""
+    run = {"date": datetime.datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+           "python": sys.version.split()[0], "sqlite": sqlite3.sqlite_version, "weeks": weeks}
+    with open(results, 'a') as out:
+        for size in [int(size) for size in sizes.split(",")]:
+            folder = tempfile.mkdtemp()
+            try:
+                timings = scale_city(folder, size, weeks, searches)
+            finally:
+                shutil.rmtree(folder)
+            for stage, elapsed, count, error in timings:
+                if error is None:
+                    print(f"{size:>9} {stage:<20}{elapsed:>10.3f}s  {count:>9} rows")
+                    elapsed = round(elapsed, 6)
+                else:
+                    print(f"{size:>9} {stage:<20}    failed  {error}")
+                out.write(json.dumps(dict(run, size=size, stage=stage, seconds=elapsed, count=count, error=error)) +
+                          "\n")
+    print("Results added to " + results)
+
+
+# times each stage on one synthetic city written to folder
+# a stage that fails is recorded with its error instead of a time, and the stages after it still run
+# returns a list of (stage, seconds, rows or items handled, error)
+def scale_city(folder, size, weeks, searches):
+    rng = random.Random(size)
+    timings = []
+
+    def timed(stage, count, func, *args, **kwargs):
+        try:
+            result, elapsed = stopwatch(func, *args, **kwargs)
+        except Exception as e:
+            timings.append((stage, None, None, str(e)))
+            return None
+        timings.append((stage, elapsed, count(result) if callable(count) else count, None))
+        return result
+
+    cfile, hfolder = timed("generate", size, synthcity.write_synthetic_city, folder, "Benchville", size, weeks)
+    dbc = dbutils.create_connection(os.path.join(folder, "nests.db"), "import")
+    dbutils.setup_db(dbc)
+    regions = dbutils.load_neighborhood_regions("Benchville", synthcity.regions_file(folder, "Benchville"))
+    timed("import_city", len, dbutils.import_city, cfile, dbc, regions)
+    dbc.commit()
+    resolver = dbutils.NestResolver(dbc)
+    timed("import_old_lists", lambda _: dbc.execute("SELECT count(*) FROM species_list").fetchone()[0],
+          dbutils.import_old_lists, hfolder, dbc, resolver=resolver)
+    dbc.commit()
+    timings.append(("resolver_fallback", resolver.search_seconds, resolver.misses, None))
+
+    rotnum, shiftdate = dbc.execute("SELECT num, date FROM rotation_dates ORDER BY date DESC").fetchone()
+    nests, empties, species = timed("get_nests", size, update.get_nests, rotnum, dbc) or (None, None, None)
+    with open(os.devnull, 'w') as sink:
+        timed("FB_post", size, update.write_FB_post, nests, "run", shiftdate, mt=empties, slist=species, out=sink)
+    timed("disc_posts", len, update.disc_messages, nests, "run", shiftdate, slist=species)
+
+    names = [row[0] for row in dbc.execute("SELECT official_name FROM nest_locations ORDER BY random() LIMIT ?",
+                                           [searches])]
+    terms = [name.split(" ")[rng.randrange(2)] if rng.random() < 0.5 else name for name in names]
+    timed("query_nest", len(terms), lambda: [dbutils.query_nest(term, dbc) for term in terms])
+    dbc.close()
+
+    parks, _ = synthcity.make_city(size)
+    sfile = os.path.join(folder, "sort.tsv")
+    synthcity.write_city(sfile, parks)
+    timed("sort", size, sort.sort_city, sfile)
+    return timings
+
+
+if __name__ == "__main__":
+    main()
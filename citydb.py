@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+# -*- coding: UTF-8 -*-
+# vim: set fileencoding=UTF-8 :
+
+# The databases of every city the tools serve, so one run can work on a whole state's metro areas
+# Each tool takes --city (or --all-cities) to pick them, keeps their connections in a bounded pool,
+# and spreads the work of several cities over worker processes with fan_out
+# Without --city the tools work on nests.db like they always have
+
+import configparser
+import contextlib
+import functools
+import os
+import sys
+from collections import OrderedDict
+
+import click
+
+config_file = "general.cfg"  # the same file as importoldlists.config_file
+default_database = "nests.db"
+city_section = "Cities"
+template_city = "blank"  # cities/blank.tsv is the template for a new city's list
+
+
+# every city the tools know about -> its database file
+# a city with a list in cities/ keeps its database in <City>.db, which is where the importer writes it,
+# and a [Cities] section in general.cfg can add cities or point them at a database anywhere
+def city_databases(cfgfile=config_file, folder=None):
+    import sort
+    if folder is None:
+        folder = sort.citypath
+    dbs = {}
+    if os.path.isdir(folder):
+        for file in sorted(os.listdir(folder)):
+            city = file[:-len(sort.ext)]
+            if file.endswith(sort.ext) and city != template_city:
+                dbs[city] = city + ".db"
+    cfg = configparser.ConfigParser(delimiters=(':',), interpolation=None, allow_no_value=True)
+    cfg.optionxform = str  # keep the city capitalization
+    cfg.read(cfgfile)
+    if cfg.has_section(city_section):
+        for city, dbfile in cfg.items(city_section):
+            dbs[city] = dbfile.strip() if dbfile else city + ".db"
+    return dbs
+
+
+# the (city, database) pairs that --city and --all-cities choose, or [(None, nests.db)] when neither is given
+# with imported, a city has to have a database already: --all-cities skips the ones that don't
+def pick_cities(names=(), all_cities=False, imported=True):
+    if not all_cities and len(names) == 0:
+        return [(None, default_database)]
+    dbs = city_databases()
+    if all_cities:
+        picked = list(dbs.items())
+    else:
+        known = dict((city.casefold(), city) for city in dbs)
+        picked = []
+        for name in names:
+            city = known.get(name.strip().casefold())
+            if city is None:
+                raise click.BadParameter(name + " is not one of the cities: " + ", ".join(dbs), param_hint="--city")
+            if (city, dbs[city]) not in picked:
+                picked.append((city, dbs[city]))
+    if imported:
+        for city, dbfile in picked:
+            if os.path.isfile(dbfile):
+                continue
+            if not all_cities:
+                raise click.BadParameter(city + " has no database at " + dbfile + ", import it first",
+                                         param_hint="--city")
+            print("Skipping " + city + " because it has no database at " + dbfile, file=sys.stderr)
+        picked = [(city, dbfile) for city, dbfile in picked if os.path.isfile(dbfile)]
+    if len(picked) == 0:
+        raise click.UsageError("There are no cities to work on, add them to cities/ or the [" + city_section +
+                               "] section of " + config_file)
+    return picked
+
+
+# adds --city (repeatable when many) and --all-cities to a click command
+# the command gets the (city, database) pairs they pick, see pick_cities, as its cities argument
+def city_option(many=True, imported=True, help=None):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, city_names=(), all_cities=False, **kwargs):
+            if city_names is None or isinstance(city_names, str):
+                city_names = [city_names] if city_names is not None else []
+            return func(*args, cities=pick_cities(city_names, all_cities, imported), **kwargs)
+
+        if many:
+            wrapper = click.option(
+                '--all-cities',
+                is_flag=True,
+                help="Work on every city in cities/ and general.cfg")(wrapper)
+        return click.option(
+            '--city',
+            'city_names',
+            multiple=many,
+            help=(help or "Work on this city's database instead of " + default_database) +
+                 (" (can be repeated)" if many else ""))(wrapper)
+
+    return decorate
+
+
+# keeps up to size idle connections open for reuse, closing the least recently used beyond that,
+# so one process can work through many city databases without piling up open files
+class ConnectionPool:
+    def __init__(self, profile=None, size=None):
+        import importoldlists as dbutils  # it imports the tools that import this
+        self.profile = profile
+        if size is None:
+            size = int((dbutils.load_profile(profile) or {}).get("connections", 8)) if profile is not None else 8
+        self.size = max(1, size)
+        self.idle = OrderedDict()  # database file -> connection that's open but not in use
+
+    # with pool.connection("Columbus.db") as dbc: ...
+    # commits when the block finishes and rolls back when it raises
+    @contextlib.contextmanager
+    def connection(self, db_file):
+        import importoldlists as dbutils
+        dbc = self.idle.pop(db_file, None)
+        if dbc is None:
+            dbc = dbutils.create_connection(db_file, self.profile)
+            if dbc is None:
+                raise dbutils.Error("Cannot open the database " + db_file)
+        try:
+            yield dbc
+            dbc.commit()
+        except BaseException:
+            dbc.rollback()
+            raise
+        finally:
+            self.idle[db_file] = dbc
+            while len(self.idle) > self.size:
+                self.idle.popitem(last=False)[1].close()
+
+    def close(self):
+        while len(self.idle) > 0:
+            self.idle.popitem(last=False)[1].close()
+
+
+_pools = {}
+
+
+# returns the process-wide pool of connections for a profile
+def connection_pool(profile=None):
+    if profile not in _pools:
+        _pools[profile] = ConnectionPool(profile)
+    return _pools[profile]
+
+
+# a job's error as fan_out reports it
+def job_error(e):
+    return type(e).__name__ + ": " + str(e)
+
+
+# runs func(*job) for every job, spread over worker processes when there is more than one job
+# a single job runs here and raises as usual; otherwise a job that fails doesn't stop the others,
+# whether the jobs run in worker processes or one after another here with workers=1
+# returns a list of (job, result, error message or None) in the order of the jobs
+def fan_out(func, jobs, workers=None):
+    if len(jobs) < 2:
+        return [(job, func(*job), None) for job in jobs]
+    results = []
+    if workers == 1:
+        for job in jobs:
+            try:
+                results.append((job, func(*job), None))
+            except Exception as e:
+                results.append((job, None, job_error(e)))
+        return results
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers or min(len(jobs), os.cpu_count() or 1)) as pool:
+        futures = [pool.submit(func, *job) for job in jobs]
+        for job, future in zip(jobs, futures):
+            try:
+                results.append((job, future.result(), None))
+            except Exception as e:
+                results.append((job, None, job_error(e)))
+    return results
@@ -3,25 +3,47 @@
 # -*- coding: UTF-8 -*-
 # vim: set fileencoding=UTF-8 :
 
-import os
-import sqlite3
+import sys
+
+import click
+
+import citydb
 import importoldlists as dbutils
+import timings
+
+
+# renumbers the rotations to match their `order` column
+def renumber(dbc):
+	dates = dbc.execute("SELECT * FROM rotation_dates WHERE num<>`order`").fetchall()
+	for date in dates:
+		if date[0] == 0:
+			continue
+		species = dbc.execute("SELECT * FROM species_list WHERE rotation_num = ?", [date[0]]).fetchall()
+		print("Renaming rotation " + str(date[0]) + " to " + str(date[3]) + " and moving " + str(len(species)) + " records")
+		dbc.execute("UPDATE species_list SET rotation_num = 0 WHERE rotation_num = ?", [date[0]])
+		dbc.execute("UPDATE rotation_dates SET num = `order` WHERE num = ? AND `order` = ?", [date[0], date[3]])
+		dbc.execute("UPDATE species_list SET rotation_num = ? WHERE rotation_num = 0", [date[3]])
 
 
-dbfile = "nests.db"
-dbc = dbutils.create_connection(dbfile)
-if dbc is None:
-	print("Error creating database")
-	sys.exit(1)
+@click.command()
+@click.argument('dbfile', required=False)
+@citydb.city_option()
+@timings.option
+def main(dbfile=None, cities=((None, citydb.default_database),)):
+	if dbfile is not None:
+		cities = [(None, dbfile)]
+	for city, dbfile in cities:
+		if city is not None:
+			print("Renumbering " + city)
+		dbc = dbutils.create_connection(dbfile, "import")
+		if dbc is None:
+			print("Error creating database")
+			sys.exit(1)
 
-dates = dbc.execute("SELECT * FROM rotation_dates WHERE num<>`order`").fetchall()
-for date in dates:
-	if date[0] == 0:
-		continue
-	species = dbc.execute("SELECT * FROM species_list WHERE rotation_num = ?", [date[0]]).fetchall()
-	print("Renaming rotation " + str(date[0]) + " to " + str(date[3]) + " and moving " + str(len(species)) + " records")
-	dbc.execute("UPDATE species_list SET rotation_num = 0 WHERE rotation_num = ?", [date[0]])
-	dbc.execute("UPDATE rotation_dates SET num = `order` WHERE num = ? AND `order` = ?", [date[0], date[3]])
-	dbc.execute("UPDATE species_list SET rotation_num = ? WHERE rotation_num = 0", [date[3]])
+		with timings.phase("renumber rotations"):
+			renumber(dbc)
+		dbc.commit()
+		dbc.close()
 
-dbc.commit()
\ No newline at end of file
+if __name__ == "__main__":
+	main()
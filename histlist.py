@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+# -*- coding: UTF-8 -*-
+# vim: set fileencoding=UTF-8 :
+
+# A manifest of each hist-list/<City>/ folder: the rotation date, size, mtime, and content hash of every old list
+# It's saved next to the folder as .<City>.manifest.json and the folder is only scanned again when its mtime
+# changes, since listing and stat-ing thousands of files on a network share is slow
+
+import bisect
+import hashlib
+import json
+import os
+import time
+
+from dateutil.parser import parse
+
+manifest_version = 1
+settle_ns = 2 * 10 ** 9  # a folder changed this recently can change again without its mtime moving
+
+
+# works out the date of an old nest list from its file name
+# returns YYYY-MM-DD or None if the name isn't a date
+def date_from_filename(file):
+    try:
+        d8 = parse(file.split(".")[0])
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return str(d8.date())
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# the manifest of hist-list/Columbus/ is hist-list/.Columbus.manifest.json,
+# outside the folder so that saving it doesn't change the folder's mtime
+def manifest_path(folder):
+    folder = os.path.normpath(folder)
+    return os.path.join(os.path.dirname(folder), "." + os.path.basename(folder) + ".manifest.json")
+
+
+class Manifest:
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = manifest_path(folder)
+        self.folder_mtime = None
+        self.files = {}  # file name -> {"date", "size", "mtime", "hash"}
+        self.by_date = {}  # rotation date -> file name, the first by name when several files have one date
+        self.dates = []  # the rotation dates in order, for bisecting
+        self.load()
+
+    def __len__(self):
+        return len(self.files)
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as fin:
+                saved = json.load(fin)
+        except (OSError, ValueError):
+            return
+        if saved.get("version") != manifest_version:
+            return
+        self.folder_mtime = saved["folder_mtime"]
+        self.files = saved["files"]
+        self.index()
+
+    def save(self):
+        temp = self.path + ".tmp"
+        try:
+            with open(temp, 'w') as out:
+                json.dump({"version": manifest_version, "folder_mtime": self.folder_mtime, "files": self.files}, out)
+            os.replace(temp, self.path)
+        except OSError as e:
+            # everything still works without it, the folder just gets scanned again next time
+            print("Cannot save the manifest " + self.path + ": " + str(e))
+
+    def index(self):
+        self.by_date = {}
+        for name in sorted(self.files):
+            date = self.files[name]["date"]
+            if date is not None and date not in self.by_date:
+                self.by_date[date] = name
+        self.dates = sorted(self.by_date)
+
+    # brings the manifest up to date with the folder and returns the names of the new and changed files
+    # an unchanged folder mtime means no file was added, removed, or renamed, so the folder isn't listed;
+    # a file rewritten in place doesn't change the folder though, so stat_files checks every file's size and mtime
+    # only a file whose size or mtime changed is hashed again
+    def refresh(self, stat_files=False):
+        try:
+            folder_mtime = os.stat(self.folder).st_mtime_ns
+        except OSError:
+            folder_mtime = None
+        if folder_mtime is not None and folder_mtime == self.folder_mtime and not stat_files:
+            return []
+        if folder_mtime is None:
+            names = []
+        elif folder_mtime == self.folder_mtime:
+            names = list(self.files)
+        else:
+            names = [entry.name for entry in os.scandir(self.folder)
+                     if not entry.name.startswith('.') and entry.is_file()]
+        files = {}
+        changed = []
+        for name in names:
+            path = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # deleted since the folder was listed
+            known = self.files.get(name)
+            if known is not None and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime_ns:
+                files[name] = known
+                continue
+            files[name] = {"date": date_from_filename(name), "size": stat.st_size, "mtime": stat.st_mtime_ns,
+                           "hash": file_hash(path)}
+            changed.append(name)
+        if folder_mtime is not None and time.time_ns() - folder_mtime < settle_ns:
+            folder_mtime = None  # too fresh to trust, look again next time
+        modified = len(changed) > 0 or files.keys() != self.files.keys() or folder_mtime != self.folder_mtime
+        self.files = files
+        self.folder_mtime = folder_mtime
+        if modified:
+            self.index()
+            self.save()
+        return changed
+
+    def file_path(self, name):
+        return os.path.join(self.folder, name)
+
+    # the (date, path) of the most recent list on or before date, or None if every list is after it
+    def on_or_before(self, date):
+        loc = bisect.bisect_right(self.dates, str(date)) - 1
+        if loc < 0:
+            return None
+        return self.dates[loc], self.file_path(self.by_date[self.dates[loc]])
+
+    # the (date, path) of the oldest list, or None for an empty folder
+    def oldest(self):
+        if len(self.dates) == 0:
+            return None
+        return self.dates[0], self.file_path(self.by_date[self.dates[0]])
+
+    # (date, file name, manifest entry) for each rotation, in date order
+    def rotations(self):
+        return [(date, self.by_date[date], self.files[self.by_date[date]]) for date in self.dates]
+
+    # the files without a date in their name
+    def undated(self):
+        return sorted(name for name, entry in self.files.items() if entry["date"] is None)
+
+    # (file name, the file used for its date instead) for each file whose date another file already has
+    def duplicates(self):
+        return sorted((name, self.by_date[entry["date"]]) for name, entry in self.files.items()
+                      if entry["date"] is not None and self.by_date[entry["date"]] != name)
+
+
+_manifests = {}
+
+
+# returns the process-wide manifest of a folder, refreshed
+def manifest(folder, stat_files=False):
+    key = os.path.normpath(folder)
+    if key not in _manifests:
+        _manifests[key] = Manifest(folder)
+    _manifests[key].refresh(stat_files)
+    return _manifests[key]
@@ -5,25 +5,96 @@
 
 import sqlite3
 from sqlite3 import Error
+import configparser
 import csv
+import itertools
 import sys
 import os
+import time
+from collections import defaultdict, deque
+
+import click
 from dateutil.parser import *
 
-# this has helper functions in all 3 other files
+import citydb
+import histlist
+import migrations
+import species
+# these have helper functions
 import sort
+import timings
 import update
-import rotate
 
 
-def create_connection(db_file):
+# the settings for each connection profile, overridden by a [Connection <profile>] section in general.cfg
+# render is for the read-heavy tools (update, edit, rotate); import is for bulk writes
+# statements is the size of the prepared statement cache; everything else is a PRAGMA
+connection_profiles = {
+    "render": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": "-65536",  # negative is KiB, so 64 MiB
+        "mmap_size": "268435456",
+        "temp_store": "MEMORY",
+        "busy_timeout": "5000",
+        "foreign_keys": "ON",
+        "statements": "256",
+        "connections": "8",  # open databases a ConnectionPool keeps for reuse
+    },
+    "import": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",  # an interrupted import can simply be run again
+        "cache_size": "-262144",
+        "mmap_size": "1073741824",
+        "temp_store": "MEMORY",
+        "busy_timeout": "30000",
+        "foreign_keys": "OFF",
+        "statements": "256",
+        "connections": "8",  # open databases a ConnectionPool keeps for reuse
+    },
+}
+profile_pragmas = ["journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "busy_timeout",
+                   "foreign_keys"]
+config_file = "general.cfg"
+
+
+# returns the settings of a connection profile, or None if there is no such profile
+def load_profile(profile, cfgfile=config_file):
+    cfg = configparser.ConfigParser(delimiters=(':',), interpolation=None, allow_no_value=True)
+    cfg.read(cfgfile)
+    section = "Connection " + profile
+    if profile not in connection_profiles and not cfg.has_section(section):
+        return None
+    settings = dict(connection_profiles.get(profile, {}))
+    if cfg.has_section(section):
+        settings.update(cfg.items(section))
+    return settings
+
+
+def create_connection(db_file, profile=None):
     """ create a database connection to the SQLite database
-        specified by db_file
+        specified by db_file and bring its schema up to date
     :param db_file: database file
+    :param profile: name of the connection profile to apply, None for SQLite's defaults
     :return: Connection object or None
     """
+    settings = {}
+    if profile is not None:
+        settings = load_profile(profile)
+        if settings is None:
+            print("There is no connection profile named " + profile + ", using the defaults")
+            settings = {}
     try:
-        dbc = sqlite3.connect(db_file)
+        with timings.phase("connect"):
+            dbc = timings.connect(db_file, cached_statements=int(settings.get("statements", 128)))
+            for pragma in profile_pragmas:
+                if pragma in settings:
+                    value = str(settings[pragma]).strip()
+                    if not value.lstrip('-').isalnum():
+                        print("Ignoring invalid " + pragma + " setting " + value)
+                        continue
+                    dbc.execute("PRAGMA " + pragma + " = " + value)  # PRAGMA doesn't take ? parameters
+            migrations.migrate(dbc)
         return dbc
     except Error as e:
         print(e)
@@ -111,6 +182,17 @@ def setup_db(dbc):
     create_table(dbc, sql_create_species_table)
     # set up table of alternate names
     create_table(dbc, sql_create_altname_table)
+    # fill the nesting species from nest_species.csv
+    species.load_species_table(dbc)
+    # add the indexes
+    migrations.migrate(dbc)
+
+
+# normalizes a park or neighborhood name for exact matching
+def normalize_name(name):
+    if name is None:
+        return ''
+    return " ".join(name.split()).casefold()
 
 
 # insert a row into the neighborhood table
@@ -127,8 +209,12 @@ def query_neighborhood(neighborhood, dbc):
     if neighborhood.strip() == '':
         return None
     cur = dbc.cursor()
-    cur.execute("SELECT id FROM neighborhoods WHERE name LIKE ?", ['%' + neighborhood + '%'])
+    # an exact match uses the index and avoids picking the wrong one of several partial matches
+    cur.execute("SELECT id FROM neighborhoods WHERE name = ? COLLATE NOCASE", [neighborhood])
     result = cur.fetchall()
+    if len(result) == 0:
+        cur.execute("SELECT id FROM neighborhoods WHERE name LIKE ?", ['%' + neighborhood + '%'])
+        result = cur.fetchall()
     if len(result) > 1:
         print("Error!  Multiple matches found for \"" + neighborhood + "\".  Using first match.")
     if len(result) == 0:
@@ -144,16 +230,15 @@ def new_alt_names(altnames, parentID, dbc):
         cur.execute("INSERT INTO alt_names(main_entry, name) VALUES(?,?)", (parentID, alt))
 
 
-# insert a row into the nest table
-# assumes no duplicate nests in the list
-# many of these variables are made simply to make the code more readable
-def add_nest(nestdict, dbc):
+# pulls the nest_locations values out of a city list row, accommodating old-style lists
+# returns (official name, short name, neighborhood, notes, private, permanent species, alt names)
+# with None for anything blank
+def nest_fields(nestdict):
     # prepare for NULL values
     for key in nestdict.keys():
-        if nestdict[key].strip() == "":
+        if nestdict[key] is None or nestdict[key].strip() == "":
             nestdict[key] = None
 
-    # easier to read, accommodates old-style lists
     if "Short Name" in nestdict.keys():
         oname = nestdict["Official Name"]
         sname = nestdict["Short Name"]
@@ -162,78 +247,165 @@ def add_nest(nestdict, dbc):
         oname = nestdict["Primary Name"]
         sname = None
         altnames = nestdict["Alternate Name"]
-    neighborhood = nestdict["Location"]
-    notes = nestdict["Notes"]
     private = nestdict["Private Property?"]
-    perm_nest = nestdict["Species"]
-    nid = None
-
-    # data wrangling
-    if neighborhood is not None:
-        nid = query_neighborhood(neighborhood, dbc)
-        if nid is None:
-            nid = add_neighborhood(neighborhood, dbc)
     if private is not None:
         if private[0].lower() == 'y':
             private = 1
         elif private[0].lower() == 'n':
             private = 0
-        elif private.isnumeric:
+        elif private.isnumeric():
             private = int(private)
         else:
             private = None
+    return oname, sname, nestdict["Location"], nestdict["Notes"], private, nestdict["Species"], altnames
 
-    nest_tuple = (oname, sname, nid, notes, private, perm_nest)
-    # print(nest_tuple)
-    sql = """INSERT INTO nest_locations(official_name, short_name, location,
+
+sql_insert_nest = """INSERT INTO nest_locations(official_name, short_name, location,
                 notes, private, permanent_species)
                 VALUES(?,?,?,?,?,?)"""
+
+
+# insert a row into the nest table
+# assumes no duplicate nests in the list
+def add_nest(nestdict, dbc):
+    oname, sname, neighborhood, notes, private, perm_nest, altnames = nest_fields(nestdict)
+    nid = None
+    if neighborhood is not None:
+        nid = query_neighborhood(neighborhood, dbc)
+        if nid is None:
+            nid = add_neighborhood(neighborhood, dbc)
+
+    nest_tuple = (oname, sname, nid, notes, private, perm_nest)
     cur = dbc.cursor()
-    cur.execute(sql, nest_tuple)
+    cur.execute(sql_insert_nest, nest_tuple)
     nestid = cur.lastrowid
     if altnames is not None:
         new_alt_names(altnames, nestid, dbc)
     return nestid
 
 
-# reads a tsv city nest list into the DB
+# reads the region each neighborhood of a city belongs to from cities/neighborhoods.cfg
+# and cities/<City>.neighborhoods.cfg, where synthcity.py writes a made-up city's regions
+# each line is Neighborhood:Region under a [City] heading
+# returns a dict of normalized neighborhood -> region name
+def load_neighborhood_regions(city, cfgfile=None):
+    if cfgfile is None:
+        cfgfile = [sort.citypath + "neighborhoods.cfg", sort.citypath + city + ".neighborhoods.cfg"]
+    cfg = configparser.ConfigParser(delimiters=(':',), interpolation=None)
+    cfg.read(cfgfile)
+    if not cfg.has_section(city):
+        return {}
+    return {normalize_name(neighborhood): region.strip() for neighborhood, region in cfg.items(city)}
+
+
+# the tables import_city writes
+bulk_tables = ["neighborhoods", "regions", "nest_locations", "alt_names"]
+
+
+# reads a tsv city nest list into the DB in one pass
+# neighborhoods are matched by exact name and created if they're missing
+# neighborhoods listed in cities/neighborhoods.cfg are put in their region
+# nests, neighborhoods, and alt names are each written with a batch insert,
+# without the triggers that index and version them until they're all in, see migrations.bulk_load
 # this assumes the soon to be removed "new" TSV formatting
 # As the new never got used in production, the history import uses the old/current TSV format
-def import_city(cfile, dbc):
-    cmem = open(cfile, "r")
-    nestin = csv.DictReader(cmem, delimiter="\t")
-    for nest in nestin:
-        add_nest(nest, dbc)
-    cmem.close()
+def import_city(cfile, dbc, regions=None):
+    if regions is None:
+        regions = load_neighborhood_regions(os.path.basename(cfile)[:-len(sort.ext)])
+    with open(cfile, "r") as cmem:
+        nests = [nest_fields(nest) for nest in csv.DictReader(cmem, delimiter="\t")]
+    with migrations.bulk_load(dbc, bulk_tables):
+        cur = dbc.cursor()
+
+        # map every neighborhood name to its ID, creating the ones this list introduces
+        nmap = {}
+        for lid, name in cur.execute("SELECT id, name FROM neighborhoods ORDER BY id"):
+            nmap.setdefault(normalize_name(name), lid)
+        newhoods = {}
+        for nest in nests:
+            if nest[2] is not None and normalize_name(nest[2]) not in nmap:
+                newhoods.setdefault(normalize_name(nest[2]), nest[2].strip())
+        lastid = cur.execute("SELECT coalesce(max(id), 0) FROM neighborhoods").fetchone()[0]
+        cur.executemany("INSERT INTO neighborhoods(name) VALUES(?)", [[name] for name in newhoods.values()])
+        for lid, name in cur.execute("SELECT id, name FROM neighborhoods WHERE id > ? ORDER BY id", [lastid]):
+            nmap.setdefault(normalize_name(name), lid)
+
+        # put the neighborhoods that don't have a region yet into the ones from the config
+        regions = {hood: region for hood, region in regions.items() if hood in nmap}
+        rmap = {}
+        for rid, name in cur.execute("SELECT id, name FROM regions ORDER BY id"):
+            rmap.setdefault(normalize_name(name), rid)
+        for region in regions.values():
+            if normalize_name(region) not in rmap:
+                rmap[normalize_name(region)] = cur.execute("INSERT INTO regions(name) VALUES(?)", [region]).lastrowid
+        cur.executemany("UPDATE neighborhoods SET region = ? WHERE id = ? AND region IS NULL", [
+            (rmap[normalize_name(region)], nmap[hood]) for hood, region in regions.items()])
+
+        # nest IDs are handed out in order, so the new ones line up with the rows
+        lastid = cur.execute("SELECT coalesce(max(nest_id), 0) FROM nest_locations").fetchone()[0]
+        cur.executemany(sql_insert_nest, [
+            (nest[0], nest[1], nmap.get(normalize_name(nest[2])), nest[3], nest[4], nest[5]) for nest in nests])
+        nestids = [row[0] for row in cur.execute(
+            "SELECT nest_id FROM nest_locations WHERE nest_id > ? ORDER BY nest_id", [lastid])]
+
+        alts = []
+        for nest, nestid in zip(nests, nestids):
+            if nest[6] is not None:
+                alts += [(nestid, alt) for alt in nest[6].split("/") if alt.strip() != '']
+        cur.executemany("INSERT INTO alt_names(main_entry, name) VALUES(?,?)", alts)
+    return nestids
+
+
+# searches the park name index built by migrations.add_search_index
+# results are ranked with exact name matches first, then by bm25
+# returns one row per park; altnm is the alt name that matched, if any
+def search_nest_index(search, dbc, area=None):
+    match = '"' + search.replace('"', '""') + '"'  # search for the whole term as a phrase
+    query = """SELECT nl.nest_id, nl.official_name, nl.short_name, nl.location,
+            CASE WHEN ns.kind = 'alt' THEN ns.name END AS altnm,
+            min(CASE WHEN ns.name = ? COLLATE NOCASE THEN -1000000 ELSE 0 END + ns.rank) AS score
+        FROM nest_search AS ns JOIN nest_locations AS nl ON nl.nest_id = ns.nest_id
+        WHERE ns.name MATCH ? """
+    params = [search, match]
+    if area is not None:
+        query += " AND nl.location = ?"
+        params.append(area)
+    query += " GROUP BY nl.nest_id ORDER BY score"
+    return [row[:5] for row in dbc.execute(query, params)]
 
 
 # searches for a nest and returns matching results and the neighborhood ID
 # each result in the returned list is in tuplet form:
 # (nest_id, official_name, short_name, neighborhood_id, altname)
 # can be restricted by neighborhood
+# uses the trigram index when there is one and the search is long enough for it (3+ characters)
 def query_nest(search, dbc, area=None):
-    if search.strip == '':  # don't return everything if you search for nothing
+    if search.strip() == '':  # don't return everything if you search for nothing
         return None, area
-    cur = dbc.cursor()
-    search = '%' + search + '%'
-    query = """SELECT nest_id, official_name, short_name, location, an.name AS altnm
-        FROM nest_locations AS nl LEFT OUTER JOIN alt_names AS an
-        ON nl.nest_id = an.main_entry
-        WHERE (official_name LIKE ? OR short_name LIKE ? OR an.name LIKE ?) """
-    addendum = " AND nl.location = ?"
-    tuple = (search, search, search)
 
     try:
         if not area.isnumeric():
             area = query_neighborhood(area, dbc)
     except (AttributeError):
         pass  # when None is passed in
-    if area is not None:
-        query = query + addendum
-        tuple = (search, search, search, area)
 
-    cur.execute(query, tuple)
-    results = cur.fetchall()
+    if len(search) >= 3 and migrations.has_table(dbc, "nest_search"):
+        results = search_nest_index(search, dbc, area)
+    else:
+        cur = dbc.cursor()
+        search = '%' + search + '%'
+        query = """SELECT nest_id, official_name, short_name, location, an.name AS altnm
+            FROM nest_locations AS nl LEFT OUTER JOIN alt_names AS an
+            ON nl.nest_id = an.main_entry
+            WHERE (official_name LIKE ? OR short_name LIKE ? OR an.name LIKE ?) """
+        addendum = " AND nl.location = ?"
+        tuple = (search, search, search)
+        if area is not None:
+            query = query + addendum
+            tuple = (search, search, search, area)
+        cur.execute(query, tuple)
+        results = cur.fetchall()
+
     if len(results) == 0:
         # print("No results found for " + search + " in " + str(area))
         return None, area
@@ -284,105 +456,295 @@ def findanest(nestdict, dbc):
     return n
 
 
-# adds a specific old nest to the database
-def add_old_nest(nestd, d8, d8id, dbc):
+# resolves spreadsheet rows to nest IDs from memory during a bulk history import
+# loads the parks, alt names, and neighborhoods once and follows the same priority as findanest:
+# official/short/primary name, then alt names, with the neighborhood as the tie-break
+# rows without an exact name match fall back to findanest's database search
+class NestResolver:
+    def __init__(self, dbc):
+        self.dbc = dbc
+        self.hits = 0
+        self.misses = 0
+        self.search_seconds = 0.0  # spent searching the database for the misses
+        self.names = defaultdict(list)  # normalized name -> [(nest_id, neighborhood_id)]
+        self.neighborhoods = {}  # normalized name -> neighborhood_id
+        locations = {}
+        for nid, oname, sname, loc in dbc.execute(
+                "SELECT nest_id, official_name, short_name, location FROM nest_locations ORDER BY nest_id"):
+            locations[nid] = loc
+            self.add_name(oname, nid, loc)
+            self.add_name(sname, nid, loc)
+        for name, nid in dbc.execute("SELECT name, main_entry FROM alt_names ORDER BY rowid"):
+            self.add_name(name, nid, locations.get(nid))
+        for lid, name in dbc.execute("SELECT id, name FROM neighborhoods ORDER BY id"):
+            self.neighborhoods.setdefault(normalize_name(name), lid)
+
+    def add_name(self, name, nid, loc):
+        key = normalize_name(name)
+        if key == '' or (nid, loc) in self.names[key]:
+            return
+        self.names[key].append((nid, loc))
+
+    # same as query_neighborhood, but remembers the answer for every spelling it has seen
+    def neighborhood(self, name):
+        key = normalize_name(name)
+        if key not in self.neighborhoods:
+            self.neighborhoods[key] = query_neighborhood(name, self.dbc)
+        return self.neighborhoods[key]
+
+    # same tie-break as nandn_nmatch
+    def match(self, name, loc):
+        found = self.names.get(normalize_name(name))
+        if not found:
+            return None
+        for nid, nloc in found:
+            if nloc == loc:
+                return nid
+        return found[0][0]
+
+    def find(self, nestdict):
+        headers = nestdict.keys()
+        loc = self.neighborhood(nestdict["Location"])
+        candidates = [nestdict[key] for key in ["Official Name", "Short Name", "Primary Name"] if key in headers]
+        for althead in ["Alternate Name", "Alternate Names"]:
+            if althead in headers:
+                candidates += nestdict[althead].split("/")
+        for name in candidates:
+            nid = self.match(name, loc)
+            if nid is not None:
+                self.hits += 1
+                return nid
+        self.misses += 1
+        start = time.perf_counter()
+        with timings.phase("search for unresolved rows"):
+            nid = findanest(nestdict, self.dbc)
+        self.search_seconds += time.perf_counter() - start
+        return nid
+
+    def report(self):
+        print("Resolved " + str(self.hits) + " rows from memory and searched the database for " +
+              str(self.misses) + " rows in " + format(self.search_seconds, ".2f") + "s")
+
+
+# turns a row from an old nest list into the parameters for a species_list insert
+# the species number is filled in when the species name is an exact match in the registry
+# pass a NestResolver to look the nest up from memory instead of searching the database,
+# and the database's species registry when calling this for many rows
+# returns None for empty rows and nests that can't be found
+def old_nest_params(nestd, d8, d8id, dbc, resolver=None, registry=None):
     if nestd["Species"].strip() == '':
-        return
-    nstid = findanest(nestd, dbc)
+        return None
+    if resolver is not None:
+        nstid = resolver.find(nestd)
+    else:
+        nstid = findanest(nestd, dbc)
     if nstid is None:
         print("Cannot find matching nest ID for row " + str(nestd) + " on date " + d8 + " rotation #" + str(d8id))
-        return
-    sqins = """INSERT INTO species_list(rotation_num, nestid, species_txt, confirmation)
-               VALUES(?,?,?,?)"""
-    cur = dbc.cursor()
+        return None
     con = nestd["Confirm?"]
     if len(con) > 0 and update.true_if_Y(con):
         con = 1
     else:
         con = None
+    if registry is None:
+        registry = species.registry(dbc)
+    spnum = registry.lookup(nestd["Species"])
+    return d8id, nstid, nestd["Species"], con, spnum.num if spnum is not None else None
+
+
+sql_insert_old_nest = """INSERT INTO species_list(rotation_num, nestid, species_txt, confirmation, species_no)
+                         VALUES(?,?,?,?,?)"""
+sql_record_import = "INSERT OR REPLACE INTO hist_imports(date, file, size, mtime, hash) VALUES (?,?,?,?,?)"
 
-    params = (d8id, nstid, nestd["Species"], con)
+
+# adds a specific old nest to the database
+def add_old_nest(nestd, d8, d8id, dbc, resolver=None):
+    params = old_nest_params(nestd, d8, d8id, dbc, resolver)
+    if params is None:
+        return
     try:
-        cur.execute(sqins, params)
+        dbc.execute(sql_insert_old_nest, params)
     except (sqlite3.IntegrityError):
-        print("Duplicate nest entries for nest #" + str(nstid) + " on " + d8 + " rot#" + str(d8id))
+        print("Duplicate nest entries for nest #" + str(params[1]) + " on " + d8 + " rot#" + str(d8id))
     except (sqlite3.InterfaceError):
         print("Something went wrong with " + str(params) + " on " + d8 + " rot#" + str(d8id))
 
 
-# adds an old rotation to add it to the DB
-def add_old_rotation(file, date, dbc):
-    # get a rotation ID
-    cur = dbc.cursor()
-    cur.execute("INSERT INTO rotation_dates(date) VALUES(?)", [date])
-    dateID = cur.lastrowid
-    # print("Rotation on " + date + " has ID " + str(dateID))
+# reads an old nest list and keeps the rows that have a species
+# runs in the worker processes of import_old_lists, so it must not touch the database
+def read_old_list(file):
+    with open(file, 'r') as fin:
+        return [nest for nest in csv.DictReader(fin, delimiter="\t")
+                if nest.get("Species") is not None and nest["Species"].strip() != '']
 
-    # deal with the file
-    fin = open(file, 'r')
-    nestlist = csv.DictReader(fin, delimiter="\t")
-    for nest in nestlist:
-        add_old_nest(nest, date, dateID, dbc)
-    fin.close()
-    dbc.commit()  # commit DB changes in case things error badly on the next file
 
+# pool.map, but with at most window items handed to the pool ahead of the result being used,
+# so the parsed lists don't pile up in memory when the one writer is slower than the readers
+def read_ahead(pool, func, items, window):
+    items = iter(items)
+    futures = deque(pool.submit(func, item) for item in itertools.islice(items, window))
+    while len(futures) > 0:
+        future = futures.popleft()
+        for item in itertools.islice(items, 1):
+            futures.append(pool.submit(func, item))
+        yield future.result()
 
-# goes through a folder of old nest lists and chucks out most invalid files before
-# sending them to add_old_rotation
-def import_old_lists(cfolder, dbc):
-    for file in os.listdir(cfolder):
-        fnm = file.split(".")[0]
-        if fnm.strip() == '' or not os.path.isfile(cfolder + file):
-            print("Skipping junk file " + file)
-            continue  # skip .DS_Store and subdirectories
-
-        try:  # ensure it's a valid date
-            d8 = parse(fnm)
-        except (TypeError, ValueError):
-            print("Cannot determine date associated with " + file + ".")
-            instr = "Enter a valid date to import the data in " + file + " under or enter junk to skip importing " + file
-            try:
-                d8 = parse(input(instr))
-            except (ValueError, TypeError):
-                continue
-        d8str = str(d8).split(" ")[0]
 
-        # skip previously-imported lists in case of retries due to errors
-        cur = dbc.cursor()
-        cur.execute("SELECT num FROM rotation_dates WHERE date LIKE ?", (d8str,))
-        result = cur.fetchall()
-        if len(result) > 0:
-            print("Skipping import of " + file + " because a rotation for " + d8str + " is already imported")
+# inserts the parsed rows of one old nest list as a new rotation, or in place of the reports of rotation rotnum
+# duplicate nests within the rotation are reported and skipped before the batch insert
+# doesn't commit so that the caller can group many rotations into one transaction
+def write_old_rotation(nestlist, date, dbc, resolver=None, rotnum=None):
+    cur = dbc.cursor()
+    if rotnum is None:
+        cur.execute("INSERT INTO rotation_dates(date) VALUES(?)", [date])
+        dateID = cur.lastrowid
+    else:
+        cur.execute("DELETE FROM species_list WHERE rotation_num = ?", [rotnum])
+        dateID = rotnum
+    batch = []
+    seen = set()
+    registry = species.registry(dbc)
+    for nest in nestlist:
+        params = old_nest_params(nest, date, dateID, dbc, resolver, registry)
+        if params is None:
             continue
-        else:
-            add_old_rotation(cfolder + file, d8str, dbc)
+        if params[1] in seen:
+            print("Duplicate nest entries for nest #" + str(params[1]) + " on " + date + " rot#" + str(dateID))
+            continue
+        seen.add(params[1])
+        batch.append(params)
+    cur.executemany(sql_insert_old_nest, batch)
+    return len(batch)
 
 
-# main method
-def main():
-    cfile = sort.choose_city(None)
-    cname = cfile.split("/")[1][:-len(sort.ext)]  # just the name
-    database = cname + ".db"
-    dbc = create_connection(database)
+# adds an old rotation to add it to the DB
+def add_old_rotation(file, date, dbc, resolver=None):
+    write_old_rotation(read_old_list(file), date, dbc, resolver)
+    dbc.commit()  # commit DB changes in case things error badly on the next file
+
+
+# goes through a folder of old nest lists and chucks out most invalid files before
+# parsing them in a pool of worker processes and writing them to the DB from this one
+# files without a date in their name are reported at the end instead of prompting for one
+# a list already imported is skipped unless its content hash in the folder's manifest has changed,
+# in which case its rotation's reports are replaced
+# the rotations are written without their data_version triggers, see migrations.bulk_load
+# pass a NestResolver to see its hits and misses afterwards
+# commits after every batch_size rows and returns the list of unresolved files
+def import_old_lists(cfolder, dbc, workers=None, batch_size=50000, resolver=None):
+    lists = histlist.manifest(cfolder, stat_files=True)
+    rotations = dict(dbc.execute("SELECT date, num FROM rotation_dates"))
+    imported = dict(dbc.execute("SELECT date, hash FROM hist_imports"))  # the rotations that came from a list
+    todo = []  # (date, file name, manifest entry, rotation to replace or None)
+    for d8str, name, entry in lists.rotations():
+        if d8str not in rotations:
+            todo.append((d8str, name, entry, None))
+        elif d8str not in imported:
+            print("Skipping import of " + name + " because a rotation for " + d8str + " is already imported")
+        elif imported[d8str] != entry["hash"]:
+            print(name + " has changed since it was imported, importing it again")
+            todo.append((d8str, name, entry, rotations[d8str]))
+        # otherwise the list hasn't changed since it was imported
+    for name, used in lists.duplicates():
+        print("Skipping import of " + name + " because " + used + " is also for " + lists.files[name]["date"])
+    unresolved = lists.undated()
+
+    files = [lists.file_path(job[1]) for job in todo]
+    if resolver is None:
+        with timings.phase("load name index"):
+            resolver = NestResolver(dbc)
+    pending = 0
+    if workers == 1 or len(files) < 2:
+        parsed = map(read_old_list, files)
+        pool = None
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        workers = workers or os.cpu_count() or 1
+        pool = ProcessPoolExecutor(max_workers=workers)
+        parsed = read_ahead(pool, read_old_list, files, workers * 2)
+    try:
+        with migrations.bulk_load(dbc, ["rotation_dates", "species_list"]):
+            for d8str, name, entry, rotnum in todo:
+                with timings.phase("read old lists"):  # only the wait when the lists are read in worker processes
+                    nestlist = next(parsed)
+                with timings.phase("write old lists"):
+                    pending += write_old_rotation(nestlist, d8str, dbc, resolver, rotnum)
+                    dbc.execute(sql_record_import, [d8str, name, entry["size"], entry["mtime"], entry["hash"]])
+                    if pending >= batch_size:
+                        dbc.commit()
+                        pending = 0
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    resolver.report()
+
+    if len(unresolved) > 0:
+        print("Cannot determine the date of these files, rename them to YYYY-MM-DD and import again:")
+        for file in unresolved:
+            print("  " + lists.file_path(file))
+    return unresolved
+
+
+# imports a city's list and history into its database
+# returns the files in its history that couldn't be imported, or None if the database couldn't be opened
+def import_one_city(cname, database, profile="import", workers=None):
+    cfile = sort.citypath + cname + sort.ext
+    dbc = create_connection(database, profile)
     if dbc is None:
         print("Error creating database")
         return None
-    setup_db(dbc)
+    with timings.phase("setup"):
+        setup_db(dbc)
 
     # comment out the below three lines if you have successfully imported the nest list
     # but had trouble importing the historical nest data
-    import_city(cfile, dbc)
-    dbc.commit()
+    with timings.phase("import city"):
+        import_city(cfile, dbc)
+        dbc.commit()
     print("Successfully imported nest list from " + cfile + " into database " + database)
 
     archivefolder = "hist-list/"
     cityfolder = archivefolder + cname + "/"
     print("Attempting to import historical migration data…")
     if not update.city_folder_check(cname, archivefolder):
-        return  # ensures there will be actual nest data to import
-    import_old_lists(cityfolder, dbc)
+        dbc.close()
+        return []  # ensures there will be actual nest data to import
+    unresolved = import_old_lists(cityfolder, dbc, workers)
     dbc.commit()  # maybe I need to do it here?
-    print("Imported nest data for " + cname + ".\nRename the output .db file to nests.db to use it as the main database in the future.")
+    dbc.close()
+    print("Imported nest data for " + cname + " into " + database + ", use --city " + cname +
+          " to work on it with the other tools")
+    return unresolved
+
+
+@click.command()
+@click.option(
+    '--profile',
+    default="import",
+    help="Database connection profile, see connection_profiles above and general.cfg")
+@click.option(
+    '-j',
+    '--jobs',
+    type=int,
+    default=None,
+    help="Cities to import at once with --all-cities or several --city, one process each")
+@citydb.city_option(imported=False, help="Import this city's list from cities/ without asking")
+@timings.option
+# main method
+def main(profile="import", jobs=None, cities=((None, citydb.default_database),)):
+    if cities[0][0] is None:
+        cfile = sort.choose_city(None)
+        cname = cfile.split("/")[1][:-len(sort.ext)]  # just the name
+        import_one_city(cname, citydb.city_databases().get(cname, cname + ".db"), profile)
+        return
+    # each city's history is read in its own process, so the cities don't also start a pool each
+    workers = None if len(cities) == 1 else 1
+    results = citydb.fan_out(import_one_city, [(city, database, profile, workers) for city, database in cities], jobs)
+    for (city, database, *_), unresolved, error in results:
+        if error is not None:
+            print("Failed to import " + city + ": " + error, file=sys.stderr)
+        elif unresolved is None:
+            print("Failed to import " + city + ", see above", file=sys.stderr)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+# -*- coding: UTF-8 -*-
+# vim: set fileencoding=UTF-8 :
+
+# Brings an existing nests.db up to the current schema without a re-import
+# The schema version is stored in PRAGMA user_version
+# Run this file directly to migrate nests.db and check the query plans of the hot queries
+
+import contextlib
+import os
+import sqlite3
+
+# trigram index over every name a park goes by, used by importoldlists.query_nest
+# kind is official, short, or alt
+sql_search_table = """CREATE VIRTUAL TABLE IF NOT EXISTS nest_search
+    USING fts5(name, nest_id UNINDEXED, kind UNINDEXED, tokenize = 'trigram')"""
+
+# the triggers that keep nest_search in step with the park names, name -> (table, CREATE TRIGGER statement)
+# alt_names has no INTEGER PRIMARY KEY, so VACUUM can renumber its rowids; an alt name's index row is found
+# by (main_entry, name) instead, one row at a time so a name entered twice for a park is indexed twice
+search_triggers = {
+    "nest_search_nest_ins": ("nest_locations",
+        """CREATE TRIGGER IF NOT EXISTS nest_search_nest_ins AFTER INSERT ON nest_locations BEGIN
+            INSERT INTO nest_search(name, nest_id, kind) VALUES (new.official_name, new.nest_id, 'official');
+            INSERT INTO nest_search(name, nest_id, kind)
+                SELECT new.short_name, new.nest_id, 'short' WHERE new.short_name IS NOT NULL;
+        END"""),
+    "nest_search_nest_del": ("nest_locations",
+        """CREATE TRIGGER IF NOT EXISTS nest_search_nest_del AFTER DELETE ON nest_locations BEGIN
+            DELETE FROM nest_search WHERE nest_id = old.nest_id AND kind <> 'alt';
+        END"""),
+    "nest_search_nest_upd": ("nest_locations",
+        """CREATE TRIGGER IF NOT EXISTS nest_search_nest_upd
+            AFTER UPDATE OF official_name, short_name ON nest_locations BEGIN
+            DELETE FROM nest_search WHERE nest_id = old.nest_id AND kind <> 'alt';
+            INSERT INTO nest_search(name, nest_id, kind) VALUES (new.official_name, new.nest_id, 'official');
+            INSERT INTO nest_search(name, nest_id, kind)
+                SELECT new.short_name, new.nest_id, 'short' WHERE new.short_name IS NOT NULL;
+        END"""),
+    "nest_search_alt_ins": ("alt_names",
+        """CREATE TRIGGER IF NOT EXISTS nest_search_alt_ins AFTER INSERT ON alt_names BEGIN
+            INSERT INTO nest_search(name, nest_id, kind) VALUES (new.name, new.main_entry, 'alt');
+        END"""),
+    "nest_search_alt_del": ("alt_names",
+        """CREATE TRIGGER IF NOT EXISTS nest_search_alt_del AFTER DELETE ON alt_names BEGIN
+            DELETE FROM nest_search WHERE rowid = (SELECT rowid FROM nest_search
+                WHERE kind = 'alt' AND nest_id = old.main_entry AND name = old.name LIMIT 1);
+        END"""),
+    "nest_search_alt_upd": ("alt_names",
+        """CREATE TRIGGER IF NOT EXISTS nest_search_alt_upd AFTER UPDATE ON alt_names BEGIN
+            DELETE FROM nest_search WHERE rowid = (SELECT rowid FROM nest_search
+                WHERE kind = 'alt' AND nest_id = old.main_entry AND name = old.name LIMIT 1);
+            INSERT INTO nest_search(name, nest_id, kind) VALUES (new.name, new.main_entry, 'alt');
+        END"""),
+}
+
+# fills nest_search from the tables it indexes
+sql_fill_search = [
+    "DELETE FROM nest_search",
+    """INSERT INTO nest_search(name, nest_id, kind)
+        SELECT official_name, nest_id, 'official' FROM nest_locations""",
+    """INSERT INTO nest_search(name, nest_id, kind)
+        SELECT short_name, nest_id, 'short' FROM nest_locations WHERE short_name IS NOT NULL""",
+    """INSERT INTO nest_search(name, nest_id, kind)
+        SELECT name, main_entry, 'alt' FROM alt_names""",
+]
+
+
+# checks if this build of SQLite has FTS5 with the trigram tokenizer (SQLite 3.34+)
+def has_trigram(dbc):
+    try:
+        dbc.execute("CREATE VIRTUAL TABLE temp.trigram_test USING fts5(x, tokenize = 'trigram')")
+        dbc.execute("DROP TABLE temp.trigram_test")
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+# builds the park name search index if SQLite supports it
+# without it, query_nest keeps using LIKE scans
+def add_search_index(dbc):
+    if not has_trigram(dbc):
+        print("FTS5 trigram search is not available in this SQLite build; park search will use LIKE")
+        return
+    dbc.execute(sql_search_table)
+    for _, statement in search_triggers.values():
+        dbc.execute(statement)
+    for statement in sql_fill_search:
+        dbc.execute(statement)
+
+
+# builds the search index migration 2 had to leave out, once SQLite is a build with trigram support
+def add_late_search_index(dbc):
+    if has_table(dbc, "nest_search") or not has_trigram(dbc):
+        return
+    add_search_index(dbc)
+    dbc.commit()
+
+
+# builds the search index of version 2 again, whose alt name rows were keyed on the alt_names rowid
+def rekey_search_index(dbc):
+    if not has_table(dbc, "nest_search"):
+        return
+    for trigger in search_triggers:
+        dbc.execute("DROP TRIGGER IF EXISTS " + trigger)
+    dbc.execute("DROP TABLE nest_search")
+    add_search_index(dbc)
+
+
+# the tables whose edits change what a rendered post looks like
+rendered_tables = ["species_list", "nest_locations", "alt_names", "neighborhoods", "regions", "rotation_dates",
+                   "nesting_species"]
+
+
+# a counter bumped by every edit to the rendered tables, and the cache of rendered posts keyed on it
+def add_render_cache(dbc):
+    dbc.execute("CREATE TABLE IF NOT EXISTS data_version (version integer NOT NULL)")
+    dbc.execute("INSERT INTO data_version SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM data_version)")
+    dbc.execute("""CREATE TABLE IF NOT EXISTS render_cache (
+                    rotation_num integer NOT NULL,
+                    format text NOT NULL,
+                    rundate text NOT NULL,
+                    data_version integer NOT NULL,
+                    body text NOT NULL,
+                    size integer NOT NULL,
+                    last_used real,
+                    PRIMARY KEY (rotation_num, format, rundate)
+                )""")
+    for table in rendered_tables:
+        if has_table(dbc, table):  # nesting_species is only there once setup_db has loaded it
+            for statement in version_triggers(table).values():
+                dbc.execute(statement)
+
+
+# the triggers that bump data_version on every edit to a table
+def version_triggers(table):
+    return {table + "_" + op.lower() + "_version": "CREATE TRIGGER IF NOT EXISTS " + table + "_" + op.lower() +
+            "_version AFTER " + op + " ON " + table + " BEGIN UPDATE data_version SET version = version + 1; END"
+            for op in ["INSERT", "UPDATE", "DELETE"]}
+
+
+# the triggers that keep nest_search and data_version in step with the tables this database has
+# returns a dict of trigger name -> (table, CREATE TRIGGER statement)
+def sync_triggers(dbc):
+    tables = set(row[0] for row in dbc.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+    triggers = {}
+    if "nest_search" in tables:
+        triggers.update(search_triggers)
+    if "data_version" in tables:
+        for table in rendered_tables:
+            if table in tables:
+                for name, statement in version_triggers(table).items():
+                    triggers[name] = (table, statement)
+    return triggers
+
+
+# creates the sync triggers that are missing, e.g. after an import was killed inside bulk_load
+# with catch_up, what they would have done is done once: the search index is filled again and
+# data_version is bumped
+# returns the names of the triggers created
+def restore_triggers(dbc, catch_up=True):
+    have = set(row[0] for row in dbc.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'"))
+    missing = [(name, statement) for name, (_, statement) in sync_triggers(dbc).items() if name not in have]
+    for _, statement in missing:
+        dbc.execute(statement)
+    if catch_up and any(name in search_triggers for name, _ in missing):
+        for statement in sql_fill_search:
+            dbc.execute(statement)
+    if catch_up and any(name not in search_triggers for name, _ in missing):
+        dbc.execute("UPDATE data_version SET version = version + 1")
+    return [name for name, _ in missing]
+
+
+# with migrations.bulk_load(dbc, ["nest_locations", "alt_names"]): ...
+# drops the sync triggers on the tables while a bulk import writes them, so they don't run once per row,
+# then creates them again and, if any row changed, fills the search index and bumps data_version once
+# commits before and after, rolling back an import that raises first
+@contextlib.contextmanager
+def bulk_load(dbc, tables):
+    dbc.commit()
+    for name, (table, _) in sync_triggers(dbc).items():
+        if table in tables:
+            dbc.execute("DROP TRIGGER IF EXISTS " + name)
+    changes = dbc.total_changes
+    try:
+        yield dbc
+    except BaseException:
+        dbc.rollback()
+        raise
+    finally:
+        restore_triggers(dbc, dbc.total_changes != changes)
+        dbc.commit()
+
+
+# each entry is one schema version; never edit an entry once it has shipped, append a new one
+# MIGRATIONS[0] takes a database from version 0 to version 1 and so on
+# an entry is either a list of SQL statements or a function that takes the connection
+MIGRATIONS = [
+    [  # 1: secondary indexes for the lookups done on every render, edit, and import
+        "CREATE INDEX IF NOT EXISTS alt_names_main_entry ON alt_names (main_entry)",
+        "CREATE INDEX IF NOT EXISTS species_list_nestid ON species_list (nestid)",
+        "CREATE INDEX IF NOT EXISTS rotation_dates_date ON rotation_dates (date)",
+        "CREATE INDEX IF NOT EXISTS neighborhoods_name ON neighborhoods (name COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS nest_locations_location ON nest_locations (location)",
+    ],
+    add_search_index,  # 2: full-text search of park names
+    add_render_cache,  # 3: cache of rendered posts
+    [  # 4: the old nest list each rotation was imported from, so the import can skip the unchanged ones
+        """CREATE TABLE IF NOT EXISTS hist_imports (
+            date text PRIMARY KEY,
+            file text NOT NULL,
+            size integer,
+            mtime integer,
+            hash text NOT NULL
+        )""",
+    ],
+    rekey_search_index,  # 5: alt names found in the search index without their rowid
+]
+
+
+# the version a fully-migrated database reports
+def latest_version():
+    return len(MIGRATIONS)
+
+
+def get_version(dbc):
+    return dbc.execute("PRAGMA user_version").fetchone()[0]
+
+
+# checks if a table exists in the database
+def has_table(dbc, table):
+    sql = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+    return dbc.execute(sql, [table]).fetchone() is not None
+
+
+# applies every migration newer than the database's recorded version
+# an empty database is left alone until setup_db has created the tables
+# returns the schema version after migrating
+def migrate(dbc):
+    version = get_version(dbc)
+    if not has_table(dbc, "nest_locations"):
+        return version
+    for num in range(version, latest_version()):
+        try:
+            if callable(MIGRATIONS[num]):
+                MIGRATIONS[num](dbc)
+            else:
+                for statement in MIGRATIONS[num]:
+                    dbc.execute(statement)
+            # PRAGMA doesn't take ? parameters
+            dbc.execute("PRAGMA user_version = " + str(num + 1))
+            dbc.commit()
+        except sqlite3.Error as e:
+            dbc.rollback()
+            print("Error applying schema migration " + str(num + 1) + ": " + str(e))
+            return num
+    try:
+        add_late_search_index(dbc)
+        if len(restore_triggers(dbc)) > 0:
+            dbc.commit()
+    except sqlite3.Error as e:
+        dbc.rollback()
+        print("Error bringing the park name search index and data_version up to date: " + str(e))
+    return latest_version()
+
+
+# the queries that run on every render, edit, or import
+# each entry is (description, SQL, sample parameters, tables that are allowed to be scanned)
+# a scan is only allowed where the query has to read every row anyway
+def hot_queries():
+    import update  # here to avoid a circular import with importoldlists
+    return [
+        ("rotation lookup",
+         "SELECT * FROM rotation_dates WHERE date <= ? ORDER BY date DESC LIMIT 1", ["2000-01-01"], set()),
+        ("rotation exists",
+         "SELECT num FROM rotation_dates WHERE date = ?", ["2000-01-01"], set()),
+        ("alt names for one nest",
+         "SELECT name FROM alt_names WHERE main_entry = ?", [1], set()),
+        ("rotations for one nest",
+         "SELECT rotation_num FROM species_list WHERE nestid = ?", [1], set()),
+        ("neighborhood by name",
+         "SELECT id FROM neighborhoods WHERE name = ? COLLATE NOCASE", [""], set()),
+        ("nests in a neighborhood",
+         "SELECT nest_id FROM nest_locations WHERE location = ?", [1], set()),
+        ("park name search",
+         "SELECT nest_id FROM nest_search WHERE name MATCH ?", ['"park"'], set()),
+        ("reported nests", update.sqnests, [1], set()),
+        ("empty nests", update.sqmt, [1], {"nls"}),
+    ]
+
+
+# returns the tables that an EXPLAIN QUERY PLAN shows being read with a full scan
+def full_scans(dbc, sql, params):
+    scans = []
+    for row in dbc.execute("EXPLAIN QUERY PLAN " + sql, params):
+        detail = row[3]
+        if detail.startswith("SCAN ") and "INDEX" not in detail:
+            scans.append(detail.split(" ")[1])
+    return scans
+
+
+# prints the plan check for each hot query and returns True if all of them use an index
+def check_query_plans(dbc):
+    allgood = True
+    for description, sql, params, allowed in hot_queries():
+        try:
+            bad = [t for t in full_scans(dbc, sql, params) if t not in allowed]
+        except sqlite3.OperationalError as e:
+            print("SKIP " + description + " (" + str(e) + ")")
+            continue
+        if len(bad) > 0:
+            allgood = False
+            print("SCAN " + description + ": full scan of " + ", ".join(bad))
+        else:
+            print("OK   " + description)
+    return allgood
+
+
+def main(dbfile="nests.db"):
+    if not os.path.isfile(dbfile):
+        print("There is no database at " + dbfile)
+        return
+    dbc = sqlite3.connect(dbfile)
+    print("Schema version " + str(get_version(dbc)) + " → " + str(migrate(dbc)))
+    check_query_plans(dbc)
+    dbc.close()
+
+
+if __name__ == "__main__":
+    main()
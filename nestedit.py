@@ -8,8 +8,11 @@ from collections import defaultdict
 
 import click
 
+import citydb
 import importoldlists as dbutils
 import rotate as dateparse
+import species as speciesdb
+import timings
 import update as output
 
 nested_dict = lambda: defaultdict(nested_dict)
@@ -88,21 +91,21 @@ def disp_park_list(dbc, results1):
     return choices[selected]
 
 
+# looks the species up in the registry, asking which one was meant if there's more than one match
+# returns (species number, species name); text that matches nothing is used verbatim
 def match_species(dbc, sptxt):
-    reslst = nested_dict()
-    num = 0
-    for result in dbc.execute("SELECT * FROM nesting_species WHERE Name like ?", ['%' + sptxt + '%']):
-        num += 1
-        reslst[num] = result
+    reslst = speciesdb.registry(dbc).match(sptxt)
     if len(reslst) == 0:
         return None, sptxt
     if len(reslst) == 1:
-        return reslst[1][0], reslst[1][1]
-    reslst[0] = (None, sptxt)
-    for item in reslst:
-        print(str(item) + '. ' + reslst[item][1] + ' [' + str(reslst[item][0]) + ']')
-    option = selectlist("Index of species (not species number): ", num, 0)
-    return reslst[option][0], reslst[option][1]
+        return reslst[0].num, reslst[0].name
+    for num, result in enumerate(reslst, 1):
+        print(str(num) + '. ' + str(result))
+    print('0. ' + sptxt + ' [None]')
+    option = selectlist("Index of species (not species number): ", len(reslst), 0)
+    if option == 0:
+        return None, sptxt
+    return reslst[option - 1].num, reslst[option - 1].name
 
 
 def update_park(dbc, rotnum):
@@ -185,9 +188,9 @@ def update_park(dbc, rotnum):
         return False
     if dateparse.str_int(species):
         spnum = int(species)
-        species = dbc.execute("SELECT * FROM nesting_species WHERE `#` = ?", [spnum]).fetchone()
+        species = speciesdb.registry(dbc).get(spnum)
         if species is not None:
-            species = species[1]
+            species = species.name
         else:
             print(f"#{spnum:03} is not a nesting species.  No changes applied.")
             return False  # something to prevent the insertion of junk nests?
@@ -201,21 +204,144 @@ def update_park(dbc, rotnum):
     return False
 
 
+# parses park|species|confirm lines, skipping blank lines and # comments
+# returns a list of (line number, park search, species text, confirmation)
+# a blank species deletes the park's report; a confirm field starting with Y marks it confirmed
+def read_batch(lines):
+    edits = []
+    for num, line in enumerate(lines, 1):
+        if line.strip() == '' or line.lstrip().startswith('#'):
+            continue
+        fields = [field.strip() for field in line.rstrip('\n').split('|')]
+        fields += [''] * (3 - len(fields))
+        edits.append((num, fields[0], fields[1], 1 if output.true_if_Y(fields[2]) else None))
+    return edits
+
+
+# finds the nest ID for each park search in one pass over the name index
+# a nest ID matches directly; otherwise an exact name, then a substring search, has to find exactly one park
+# returns a dict of search -> list of matching nest IDs
+def resolve_parks(dbc, searches):
+    index = dbutils.NestResolver(dbc)
+    ids = set(row[0] for row in dbc.execute("SELECT nest_id FROM nest_locations"))
+    found = {}
+    for search in set(searches):
+        if dateparse.str_int(search) and int(search) in ids:
+            found[search] = [int(search)]
+            continue
+        matches = []
+        for nid, _ in index.names.get(dbutils.normalize_name(search), []):
+            if nid not in matches:
+                matches.append(nid)
+        if len(matches) == 0:
+            results, _ = dbutils.query_nest(search, dbc)
+            for result in results or []:
+                if result[0] not in matches:
+                    matches.append(result[0])
+        found[search] = matches
+    return found
+
+
+# finds the species for each species text with the species registry
+# returns a dict of text -> list of (dex number, name); text that matches nothing is used verbatim
+def resolve_species(dbc, texts):
+    registry = speciesdb.registry(dbc)
+    found = {}
+    for text in set(texts):
+        if text == '':
+            found[text] = [(None, None)]
+            continue
+        matches = [(species.num, species.name) for species in registry.match(text)]
+        if len(matches) == 0 and not dateparse.str_int(text):
+            matches = [(None, text)]
+        found[text] = matches
+    return found
+
+
+# applies a batch of park|species|confirm edits to a rotation in one transaction
+# lines that don't match exactly one park and one species are reported and skipped
+# returns the number of edits applied
+def batch_edit(dbc, rotnum, lines):
+    edits = read_batch(lines)
+    with timings.phase("park lookup"):
+        parks = resolve_parks(dbc, [edit[1] for edit in edits])
+        names = dict((row[0], row[1:]) for row in dbc.execute(
+            """SELECT nest_id, official_name, neighborhoods.name FROM nest_locations
+                LEFT OUTER JOIN neighborhoods ON nest_locations.location = neighborhoods.id"""))
+    with timings.phase("species lookup"):
+        species = resolve_species(dbc, [edit[2] for edit in edits])
+
+    saves = {}  # nest ID -> (species number, species, confirmation, rotation, nest ID)
+    for num, park, sptxt, conf in edits:
+        nids = parks[park]
+        if len(nids) != 1:
+            print("Line " + str(num) + ": " + ("no park matches " if len(nids) == 0 else "ambiguous park ") + park)
+            for nid in nids:
+                print("    " + str(nid) + ". " + names[nid][0] + " [" + str(names[nid][1] or "Missing") + "]")
+            continue
+        matches = species[sptxt]
+        if len(matches) != 1:
+            print("Line " + str(num) + ": " + ("#" + sptxt + " is not a nesting species" if len(matches) == 0
+                                               else "ambiguous species " + sptxt))
+            for spnum, name in matches:
+                print("    " + name + " [" + str(spnum) + "]")
+            continue
+        if nids[0] in saves:
+            print("Line " + str(num) + ": replaces an earlier line for " + names[nids[0]][0])
+        saves[nids[0]] = (matches[0][0], matches[0][1], conf, rotnum, nids[0])
+
+    upserts = [save for save in saves.values() if save[1] is not None]
+    deletes = [(rotnum, save[4]) for save in saves.values() if save[1] is None]
+    with timings.phase("save"):
+        dbc.executemany("""INSERT INTO species_list(species_no, species_txt, confirmation, rotation_num, nestid)
+            VALUES (?,?,?,?,?)
+            ON CONFLICT (rotation_num, nestid) DO UPDATE SET
+                species_no = excluded.species_no, species_txt = excluded.species_txt,
+                confirmation = excluded.confirmation""", upserts)
+        dbc.executemany("DELETE FROM species_list WHERE rotation_num = ? AND nestid = ?", deletes)
+    print("Saved " + str(len(upserts)) + " nests and cleared " + str(len(deletes)) + " from " +
+          str(len(edits)) + " lines")
+    return len(saves)
+
+
 @click.command()
 @click.option(
     '-d',
     '--date',
-    default="today",
-    prompt="Date to edit",
-    help="Date you choose to edit, can be absolute (YYYY-MM-DD) or relative (w+2)"
+    default=None,
+    help="Date you choose to edit, can be absolute (YYYY-MM-DD) or relative (w+2); asked for unless --batch, "
+         "which edits today's rotation without it"
 )
-def main(date):
-    dbc = dbutils.create_connection("nests.db")
-    rotnum, d8 = output.get_rot8d8(dateparse.getdate(date), dbc)
+@click.option(
+    '--profile',
+    default="render",
+    help="Database connection profile, see connection_profiles in importoldlists.py and general.cfg")
+@click.option(
+    '-b',
+    '--batch',
+    type=click.File('r'),
+    default=None,
+    help="Apply park|species|confirm lines from this file (- for stdin) instead of prompting")
+@citydb.city_option(many=False)
+@timings.option
+def main(date, profile, batch, cities=((None, citydb.default_database),)):
+    if date is None:
+        # --batch - reads the edits from stdin, so it can't be asked for the date there
+        date = "today" if batch is not None else click.prompt("Date to edit", default="today")
+    dbc = dbutils.create_connection(cities[0][1], profile)
+    with timings.phase("rotation lookup"):
+        rotnum, d8 = output.get_rot8d8(dateparse.getdate(date), dbc)
     print("Editing rotation " + str(rotnum) + " from " + d8)
+    if batch is not None:
+        batch_edit(dbc, rotnum, batch)
+        with timings.phase("save"):
+            dbc.commit()
+        dbc.close()
+        return
     stop = False
     while stop is False:
-        stop = update_park(dbc, rotnum)
+        with timings.phase("edit one park"):  # includes the time spent at the prompts
+            stop = update_park(dbc, rotnum)
     if stop == 1:
         dbc.commit()
         print("Nests saved!")
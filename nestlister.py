@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+# -*- coding: UTF-8 -*-
+# vim: set fileencoding=UTF-8 :
+
+# One command for all of the nest tools: nestlister.py <subcommand> [options]
+# Each subcommand only imports its own script when it runs, so a bot calling
+# `nestlister.py update` doesn't pay to load the importer or the editor
+
+import importlib
+
+import click
+
+# subcommand -> (script it runs, help text)
+subcommands = {
+    "rotate": ("rotate", "Start a new nest rotation"),
+    "update": ("update", "Output the nest post for a rotation"),
+    "edit": ("nestedit", "Edit the nests reported in a rotation"),
+    "import": ("importoldlists", "Import a city's nest list and history into a new database"),
+    "sort": ("sort", "Sort a city's nest list"),
+    "renumber": ("date_fix", "Renumber the rotations to match their order column"),
+    "stats": ("analytics", "Species, park, and streak statistics from the nest history"),
+}
+
+
+# imports the script behind a subcommand
+def load(name):
+    return importlib.import_module(subcommands[name][0])
+
+
+# makes a subcommand that hands every argument, --help included, to its script's main
+def passthrough(name):
+    @click.command(name=name, help=subcommands[name][1], context_settings={
+        "ignore_unknown_options": True,
+        "allow_extra_args": True,
+        "help_option_names": [],
+    })
+    @click.pass_context
+    def run(ctx):
+        main = load(name).main
+        if isinstance(main, click.Command):
+            main(args=ctx.args, prog_name="nestlister.py " + name)
+        else:
+            main(*ctx.args)
+
+    return run
+
+
+@click.group()
+def main():
+    pass
+
+
+for subcommand in subcommands:
+    main.add_command(passthrough(subcommand))
+
+if __name__ == "__main__":
+    main()
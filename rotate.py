@@ -10,8 +10,8 @@ import click
 from dateutil.parser import *
 from dateutil.relativedelta import *
 
-import importoldlists as dbutils
-import sort
+import citydb
+import timings
 
 # Creates a new nest list in the hist-list/<CITY> folder with a YYYY-MM-DD name
 
@@ -24,6 +24,7 @@ date = None
 # Probably can share more code with sort.py methods
 # but they're slightly different
 def val_city(city=None):
+    import sort
     cpath = sort.choose_city(city + sort.ext)  # path to the city's template file
     city2 = cpath.split("/")[1][:-len(sort.ext)]  # just the city name
     return cpath, city2
@@ -56,25 +57,24 @@ def str_int(str):
     return True
 
 
+# turns a relative date statement like w+2 into a relativedelta, or None if it isn't one
+def relative_shift(date):
+    if date[0].lower() in "ymwt" and len(date) > 2 and date[1] in "+-" and str_int(date[1:]):
+        return relativedelta(**{expand8(date[0].lower()): int(date[1:])})
+    return None
+
+
 # gets a date (also accepts relative dates like y-1, t+3, w+2)
 def getdate(date=None):
     today = datetime.datetime.today()
     while True:
         if date is None:
             date = input("What is the date of the nest rotation (blank for today, " + str(today.date()) + ")? ")
-        if date.strip() == "" or (len(date) == 1 and date[0].lower() == "t"):
+        if date.strip().lower() in ("", "t", "today"):
             return today.date()
-        if date[0].lower() in "ymwt" and len(date) > 2 and date[1] in "+-" and str_int(date[1:]):
-            dateshift = int(date[1:])
-            units = date[0].lower()
-            # print("shifting by " + str(dateshift) + " " + expand8(units))
-            createdate = today + {
-                'y': relativedelta(years=dateshift),
-                'm': relativedelta(months=dateshift),
-                'w': relativedelta(weeks=dateshift),
-                't': relativedelta(days=dateshift)
-            }.get(units, 0)
-            return createdate.date()
+        dateshift = relative_shift(date)
+        if dateshift is not None:
+            return (today + dateshift).date()
         try:
             return parse(date).date()
         except (ValueError, TypeError):
@@ -82,6 +82,42 @@ def getdate(date=None):
             date = input("What is the date of the nest rotation (blank for today, " + str(today.date()) + ")? ")
 
 
+# every date from start through end (inclusive), interval apart
+# each date is counted from start so that monthly rotations don't drift after a short month
+def schedule(start, end, interval):
+    dates = []
+    step = 0
+    while start + interval * step <= end:
+        dates.append(start + interval * step)
+        step += 1
+    return dates
+
+
+# the permanent nests are copied into a new rotation as confirmed reports
+sql_copy_permanent = """INSERT INTO species_list(rotation_num, nestid, species_txt, confirmation)
+                        SELECT ?, nest_id, permanent_species, 1 FROM nest_locations
+                        WHERE permanent_species IS NOT NULL"""
+
+
+# creates a rotation on each date that doesn't already have one, with its permanent nests filled in
+# doesn't commit so that a whole schedule goes in as one transaction
+# returns a list of (rotation number, date) for the rotations created
+def add_rotations(dbc, dates):
+    existing = set(row[0] for row in dbc.execute("SELECT date FROM rotation_dates"))
+    cur = dbc.cursor()
+    added = []
+    for d8 in [str(date) for date in dates]:
+        if d8 in existing:
+            print("Rotation already exists for " + d8)
+            continue
+        existing.add(d8)
+        cur.execute("INSERT INTO rotation_dates(date) VALUES(?)", [d8])
+        rotnum = cur.lastrowid
+        cur.execute(sql_copy_permanent, [rotnum])
+        added.append((rotnum, d8))
+    return added
+
+
 @click.command()
 @click.option(
     '-d',
@@ -90,27 +126,36 @@ def getdate(date=None):
     prompt="Date of nest shift",
     help="Date when the nest shift occured, can be absolute (YYYY-MM-DD) or relative (w+2)"
 )
+@click.option(
+    '--through',
+    default=None,
+    help="Also create every rotation after --date through this date (absolute or relative), --every apart")
+@click.option(
+    '--every',
+    default="w+2",
+    show_default=True,
+    help="Time between the rotations created with --through, in the relative date format")
+@click.option(
+    '--profile',
+    default="render",
+    help="Database connection profile, see connection_profiles in importoldlists.py and general.cfg")
+@citydb.city_option()
+@timings.option
 # main method
-def main(date):
-    d8 = str(getdate(date.strip()))
-    dbc = dbutils.create_connection("nests.db")
-    d8tst = "SELECT * FROM rotation_dates WHERE date LIKE ?"
-    cur = dbc.cursor()
-    cur.execute(d8tst, [d8])
-    if len(cur.fetchall()) > 0:
-        print("Rotation already exists for " + d8)
-        return
-    add8 = "INSERT INTO rotation_dates(date) VALUES(?)"
-    cur.execute(add8, [d8])
-    rotnum = cur.lastrowid
-    perm_nst = "SELECT nest_id, permanent_species FROM nest_locations WHERE permanent_species IS NOT NULL"
-    cur.execute(perm_nst)
-    permanent = cur.fetchall()
-    add_prm = "INSERT INTO species_list(rotation_num, nestid, species_txt, confirmation) VALUES(?,?,?,1) "
-    for perm in permanent:
-        cur.execute(add_prm, (rotnum, perm[0], perm[1]))
-    print("Added rotation " + str(rotnum) + " on " + d8)
-    dbc.commit()
+def main(date, through, every, profile, cities=((None, citydb.default_database),)):
+    start = getdate(date.strip())
+    dates = [start]
+    if through is not None:
+        interval = relative_shift(every.strip())
+        if interval is None or start + interval <= start:
+            print("--every needs a forward relative date like w+2, not " + every)
+            return
+        dates = schedule(start, getdate(through.strip()), interval)
+    for city, dbfile in cities:
+        with timings.phase("add rotations"), citydb.connection_pool(profile).connection(dbfile) as dbc:
+            added = add_rotations(dbc, dates)
+        for rotnum, d8 in added:
+            print("Added rotation " + str(rotnum) + " on " + d8 + ("" if city is None else " for " + city))
 
 
 if __name__ == "__main__":
@@ -3,12 +3,19 @@
 # -*- coding: UTF-8 -*-
 # vim: set fileencoding=UTF-8 :
 
-import sys
 import os
 import csv
-from collections import OrderedDict
+import heapq
+import shutil
+import sys
+import tempfile
+
+import click
+
+import timings
 
 # Sorts the nests for a given city
+# The list is sorted a chunk at a time and the chunks are merged, so a list bigger than memory sorts fine
 
 ext = ".tsv"
 citypath = "cities/"
@@ -22,10 +29,6 @@ tstext = ""
 def getcity():
     return input("Which city would you like to sort? ") + ext
 
-city = None
-if len(sys.argv) > 1:
-    city = sys.argv[1] + ext
-
 
 # checks if the city has a file in the cities directory
 def validate_cityfile(city):
@@ -43,58 +46,140 @@ def choose_city(city=None):
     return citypath+city
 
 
-# reads a tsv city nest list into memory and returns it
-def read_city(cfile):
-    cmem = open(cfile, "r")
-    nestin = csv.DictReader(cmem, delimiter="\t")
-    nestout = {}
-    nestout[""] = {}
-    first = True
-    for nest in nestin:
-        # convert to lower case and hope for the best with non-ASCII names
-        # print(nest) # debugging the inputs
-        sortkey = nest["Primary Name"].lower() + nest["Location"].lower()
-        nestout[sortkey] = {}
-        for key in nest.keys():
-            nestout[sortkey][key] = nest[key]
-            if first is True:
-                nestout[""][key] = ""
-        first = False
-        #print(nestout[sortkey])
-    cmem.close()
-    return nestout
-
-
-# sorts the nestlist
-def sort_nests(nestlist):
-    sorted_nests = OrderedDict(sorted(nestlist.items()))
-    return sorted_nests
-
-
-# writes the sorted nests back to the file
-def write_nests(nestlist, cfile):
-    out = open(cfile+tstext, "w")
-    #print(nestlist)
-    writer = csv.DictWriter(
-            out,
-            delimiter="\t",
-            fieldnames=nestlist[""],
-            quoting=csv.QUOTE_ALL)
-    writer.writeheader()
-    del nestlist[""]  # remove the header row (different use than rest of the list)
-    for nest in nestlist:
-        writer.writerow(nestlist[nest])
-    out.close()
-    return
+chunk_bytes = 64 * 1024 * 1024  # about how much memory the rows sorted at once take, as sys.getsizeof counts it
+max_runs = 64  # sorted chunks waiting in temporary files at once, each one an open file
+name_columns = ["Official Name", "Primary Name"]  # city lists and old lists name the column differently
+
+
+# the collation key of a nest: its name, then its location, casefolded so that case doesn't split them up
+def collation_key(row, name_col, loc_col):
+    return row[name_col].casefold(), row[loc_col].casefold()
+
+
+# the column numbers of the name and location in a list's header
+def key_columns(header):
+    for name in name_columns:
+        if name in header and "Location" in header:
+            return header.index(name), header.index("Location")
+    return None
+
+
+# writes sorted (key, row) pairs to a temporary file and returns an iterator that reads it back
+def spill(chunk):
+    run = tempfile.TemporaryFile('w+', newline='')
+    writer = csv.writer(run, delimiter="\t")
+    for key, row in chunk:
+        writer.writerow(list(key) + row)
+    run.seek(0)
+
+    def read_run():
+        with run:
+            for row in csv.reader(run, delimiter="\t"):
+                yield (row[0], row[1]), row[2:]
+
+    return read_run()
+
+
+# the memory a row of width columns takes besides its characters: the list, the strings, the key,
+# and the (key, row) pair, by sys.getsizeof; an ASCII string takes one byte per character on top of that
+def row_overhead(width):
+    empty = sys.getsizeof("")
+    return sys.getsizeof([""] * width) + empty * width + sys.getsizeof(("", "")) * 2 + empty * 2
+
+
+# sorts the rows of a list in chunks of about chunk bytes and returns one sorted iterator per chunk
+# the key of each row is computed once; a list that fits in one chunk never touches the disk
+# when max_runs chunks are waiting on disk they're merged into one, so the open files stay bounded
+def sorted_runs(reader, width, name_col, loc_col, chunk=chunk_bytes):
+    runs = []
+    rows = []
+    size = 0
+    overhead = row_overhead(width)
+    for row in reader:
+        if len(row) < width:
+            row += [""] * (width - len(row))  # a short row gets empty columns like DictWriter gave it
+        key = collation_key(row, name_col, loc_col)
+        rows.append((key, row))
+        size += overhead + sum(map(len, row)) + len(key[0]) + len(key[1])
+        if size >= chunk:
+            rows.sort(key=lambda pair: pair[0])  # stable, so nests with the same key keep their order
+            runs.append(spill(rows))
+            rows = []
+            size = 0
+            if len(runs) >= max_runs:
+                runs = [spill(heapq.merge(*runs, key=lambda pair: pair[0]))]
+    rows.sort(key=lambda pair: pair[0])
+    if len(rows) > 0 or len(runs) == 0:
+        runs.append(iter(rows))
+    return runs
+
+
+# writes the merged rows to a temporary file next to cfile and renames it over cfile when it's complete,
+# so an interrupted sort leaves the old list alone
+# returns the (name, location) of every key that more than one nest has, as the first of them spells it
+def write_sorted(merged, header, cfile, columns):
+    folder = os.path.dirname(os.path.abspath(cfile))
+    out = tempfile.NamedTemporaryFile('w', dir=folder, prefix=".sorting-", suffix=ext, delete=False, newline='')
+    dupes = []
+    try:
+        with out:
+            writer = csv.writer(out, delimiter="\t", quoting=csv.QUOTE_ALL)
+            writer.writerow(header)
+            previous = None
+            reported = None
+            for key, row in merged:
+                if key == previous and key != reported:
+                    dupes.append((first[columns[0]], first[columns[1]]))
+                    reported = key
+                elif key != previous:
+                    first = row
+                previous = key
+                writer.writerow(row)
+        if os.path.exists(cfile):
+            shutil.copymode(cfile, out.name)
+        os.replace(out.name, cfile)
+    except BaseException:
+        os.remove(out.name)
+        raise
+    return dupes
+
+
+# sorts a city nest list by name and location without holding more than a chunk of it in memory
+# nests with the same name and location are all kept, in their original order, and returned to warn about
+def sort_city(cfile, outfile=None, chunk=chunk_bytes):
+    with open(cfile, "r", newline='') as cmem:
+        reader = csv.reader(cmem, delimiter="\t")
+        header = next(reader, None)
+        columns = key_columns(header or [])
+        if columns is None:
+            raise click.ClickException(cfile + " needs a Location column and one of " + " or ".join(name_columns))
+        with timings.phase("sort"):
+            runs = sorted_runs(reader, len(header), columns[0], columns[1], chunk)
+    with timings.phase("merge"):
+        merged = heapq.merge(*runs, key=lambda pair: pair[0])  # stable across runs too
+        return write_sorted(merged, header, outfile or cfile, columns)
 
 
 # main method and all
-def main():
-    cfile = choose_city(city)
-    nestlist = read_city(cfile)
-    nestlist = sort_nests(nestlist)
-    write_nests(nestlist, cfile)
+@click.command()
+@click.argument('city', required=False)
+@click.option(
+    '--chunk-mb',
+    type=click.IntRange(min=1),
+    default=chunk_bytes // (1024 * 1024),
+    show_default=True,
+    help="Megabytes of memory for the rows sorted at once, the rest waits in temporary files")
+@timings.option
+def main(city=None, chunk_mb=chunk_bytes // (1024 * 1024)):
+    cfile = choose_city(city + ext if city is not None else None)
+    dupes = sort_city(cfile, cfile + tstext, chunk_mb * 1024 * 1024)
     print("Successfully sorted " + cfile)
+    if len(dupes) > 0:
+        print(str(len(dupes)) + " names are used by more than one nest in the same location, all of them were kept:")
+        for name, location in dupes[:20]:
+            print("  " + name + " (" + location + ")")
+        if len(dupes) > 20:
+            print("  … and " + str(len(dupes) - 20) + " more")
     return
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+# -*- coding: UTF-8 -*-
+# vim: set fileencoding=UTF-8 :
+
+# The nesting species, loaded once per database from its nesting_species table or nest_species.csv
+# Editing, importing, and rendering all look species up here instead of querying nesting_species
+
+import csv
+import os
+import sqlite3
+import unicodedata
+
+species_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nest_species.csv")
+
+sql_create_species_table = """CREATE TABLE IF NOT EXISTS nesting_species (
+                                    `#` integer PRIMARY KEY,
+                                    Name text NOT NULL,
+                                    Type text,
+                                    Subtype text
+                            );"""
+
+
+class Species:
+    __slots__ = ("num", "name", "type", "subtype")
+
+    def __init__(self, num, name, type=None, subtype=None):
+        self.num = num
+        self.name = name
+        self.type = type
+        self.subtype = subtype
+
+    def is_type(self, kind):
+        return kind in (self.type, self.subtype)
+
+    def __repr__(self):
+        return self.name + " [" + str(self.num) + "]"
+
+
+# the name a species is indexed under: case, spacing, accents, and punctuation don't matter
+# "Mr. Mime", "mr mime", and "MrMime" are the same key; ♀ and ♂ are kept so the Nidorans stay apart
+def species_key(name):
+    if name is None:
+        return ''
+    name = unicodedata.normalize("NFKD", name.casefold())
+    return "".join(c for c in name if c.isalnum() or c in "♀♂")
+
+
+class SpeciesRegistry:
+    def __init__(self, rows=()):
+        self.by_num = {}
+        self.by_key = {}
+        for row in rows:
+            self.add(Species(*row))
+
+    def add(self, species):
+        self.by_num[species.num] = species
+        self.by_key[species_key(species.name)] = species
+
+    def __len__(self):
+        return len(self.by_num)
+
+    # returns the species with this dex number or None
+    def get(self, num):
+        try:
+            return self.by_num.get(int(num))
+        except (TypeError, ValueError):
+            return None
+
+    # returns the species with exactly this name (as species_key sees it) or None
+    def lookup(self, name):
+        return self.by_key.get(species_key(name))
+
+    # returns the species with a dex number whose type or subtype is kind, False for unknown numbers
+    def is_type(self, num, kind):
+        species = self.get(num)
+        return species is not None and species.is_type(kind)
+
+    # returns every species that text could mean, the best kind of match first
+    # a dex number or an exact name is one match, then names starting with text,
+    # then names containing it, then names within a typo of it
+    def match(self, text, typos=0.75):
+        text = str(text).strip()
+        if text.isdigit():
+            species = self.get(text)
+            return [species] if species is not None else []
+        key = species_key(text)
+        if key == '':
+            return []
+        if key in self.by_key:
+            return [self.by_key[key]]
+        for test in [str.startswith, str.__contains__]:
+            found = [species for name, species in self.by_key.items() if test(name, key)]
+            if len(found) > 0:
+                return sorted(found, key=lambda species: species.num)
+        # a typo doesn't add or drop more than a letter, so Pikachu isn't taken for Pichu
+        import difflib
+        return [self.by_key[name] for name in difflib.get_close_matches(key, self.by_key, n=5, cutoff=typos)
+                if abs(len(name) - len(key)) <= 1]
+
+
+# reads (dex number, name, type, subtype) rows from nest_species.csv, where NULL is an empty subtype
+def read_species_file(file=species_file):
+    with open(file, 'r', newline='') as fin:
+        rows = []
+        for row in csv.DictReader(fin):
+            rows.append((int(row["#"]), row["Name"], row["Type"] if row["Type"] != "NULL" else None,
+                         row["Subtype"] if row["Subtype"] != "NULL" else None))
+    return rows
+
+
+# creates nesting_species and fills it from nest_species.csv without touching rows already there
+def load_species_table(dbc, file=species_file):
+    dbc.execute(sql_create_species_table)
+    dbc.executemany("INSERT OR IGNORE INTO nesting_species(`#`, Name, Type, Subtype) VALUES (?,?,?,?)",
+                    read_species_file(file))
+
+
+_registries = {}  # database file -> (its data_version, its registry)
+
+
+# the file of a connection's main database, '' for an in-memory or temporary one
+def database_file(dbc):
+    return dbc.execute("PRAGMA database_list").fetchone()[2]
+
+
+# returns the registry of a database, loading it on the first call for that database file
+# a database's nesting_species table wins over nest_species.csv so local additions are seen,
+# and each database has its own, so one process can work through several cities
+# it's loaded again once data_version shows an edit, since nesting_species is one of the tables it counts
+# without a database it's nest_species.csv alone
+def registry(dbc=None):
+    if dbc is None:
+        key, version = None, None
+    else:
+        key = database_file(dbc)
+        try:
+            version = dbc.execute("SELECT version FROM data_version").fetchone()
+        except sqlite3.OperationalError:
+            version = None
+    cached = _registries.get(key)
+    if cached is not None and cached[0] == version and key != '':
+        return cached[1]
+    rows = []
+    if dbc is not None:
+        try:
+            rows = dbc.execute("SELECT `#`, Name, Type, Subtype FROM nesting_species").fetchall()
+        except sqlite3.OperationalError:
+            pass
+    found = SpeciesRegistry(rows if len(rows) > 0 else read_species_file())
+    _registries[key] = (version, found)
+    return found
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+# -*- coding: UTF-8 -*-
+# vim: set fileencoding=UTF-8 :
+
+# Writes a made-up city of any size in the same files a real one uses:
+# cities/<City>.tsv, hist-list/<City>/YYYY-MM-DD.tsv, and a [<City>] section in cities/<City>.neighborhoods.cfg
+# The regions get a file of their own so the hand-kept cities/neighborhoods.cfg is never rewritten
+# The names collide the way real ones do so the importer and search have to work for their answers:
+# the same park name in several neighborhoods, alt names that are another park's name,
+# neighborhoods whose name is part of another's, and history lists that spell neighborhoods and parks
+# the way people type them, some of them too far off for an exact match
+
+import configparser
+import csv
+import datetime
+import os
+import random
+
+import click
+
+import species as speciesdb
+
+city_header = ["Official Name", "Short Name", "Alternate Names", "Location", "Notes", "Private Property?",
+               "Species", "Confirm?"]
+old_header = ["Primary Name", "Alternate Name", "Location", "Notes", "Private Property?", "Species", "Confirm?"]
+
+name_words = ["Oak", "Maple", "Cedar", "Willow", "Elm", "Birch", "Walnut", "Cherry", "Pine", "Aspen", "Hickory",
+              "Sycamore", "Linden", "Juniper", "Magnolia", "Cottonwood", "Lincoln", "Washington", "Jefferson",
+              "Franklin", "Madison", "Monroe", "Jackson", "Harrison", "Wilson", "Taylor", "Grant", "Hayes",
+              "Garfield", "Cleveland", "Liberty", "Union", "Heritage", "Pioneer", "Frontier", "Meadow", "Prairie",
+              "River", "Creek", "Brook", "Spring", "Lake", "Pond", "Hill", "Ridge", "Valley", "Glen", "Hollow",
+              "Stone", "Mill", "Bridge", "Harbor", "Summit", "Sunset", "Sunrise", "Veterans", "Memorial",
+              "Central", "North", "South", "East", "West", "Academy", "Friendship", "Unity"]
+park_kinds = ["Park", "Park", "Park", "Playground", "Commons", "Green", "Preserve", "Nature Preserve",
+              "Recreation Center", "Sports Complex", "Golf Course", "Library", "Trailhead", "Athletic Fields",
+              "Metro Park", "Dog Park"]
+hood_kinds = ["Heights", "Village", "Township", "Hills", "Park", "Estates", "Crossing", "Station", "Grove",
+              "Falls", "Landing", "Square", ""]
+region_kinds = ["North", "South", "East", "West", "Central", "Downtown", "Uptown", "Northeast", "Northwest",
+                "Southeast", "Southwest", "Lakeside", "Riverside", "Outer Belt"]
+
+hood_collisions = 0.05  # neighborhoods named after another one with a word added, like Oak Hills Estates
+name_variations = 0.03  # history rows that name the park or neighborhood in a way that isn't an exact match
+
+
+# a made-up name of two words and a kind, e.g. Maple Ridge Playground
+def make_name(rng, kinds):
+    name = rng.choice(name_words) + " " + rng.choice(name_words) + " " + rng.choice(kinds)
+    return name.strip()
+
+
+# the way people type a name in a hurry: different case, doubled spaces, or a trailing space
+def misspell(rng, name):
+    return rng.choice([name.lower(), name.upper(), name.replace(" ", "  ", 1), name + " ", name])
+
+
+# a name the way someone who doesn't know it exactly writes it: without its last or first word,
+# which the importer's search finds, or with two letters swapped, which it doesn't
+def vary(rng, name):
+    words = name.split(" ")
+    if len(words) < 2:
+        return name
+    way = rng.random()
+    if way < 0.5:
+        return " ".join(words[:-1])
+    if way < 0.8:
+        return " ".join(words[1:])
+    pos = rng.randrange(len(name) - 1)
+    return name[:pos] + name[pos + 1] + name[pos] + name[pos + 2:]
+
+
+# makes size parks spread over about one neighborhood per 20 parks and one region per 10 neighborhoods
+# collisions is the share of neighborhoods named after another one with a word added
+# returns a list of (official name, short name, alt names, neighborhood, private) and a dict of
+# neighborhood -> region
+def make_city(size, seed=57, collisions=hood_collisions):
+    rng = random.Random(seed)
+    hoods = []
+    for num in range(max(1, size // 20)):
+        if len(hoods) > 0 and rng.random() < collisions:
+            hood = rng.choice(hoods) + " " + rng.choice(hood_kinds[:-1])
+        else:
+            hood = make_name(rng, hood_kinds)
+        if hood in hoods:  # a neighborhood name has to be unique for its region to be unambiguous
+            hood += " " + str(num)
+        hoods.append(hood)
+    regions = {}
+    for num, hood in enumerate(hoods):
+        region = num // 10
+        regions[hood] = region_kinds[region % len(region_kinds)]
+        if region >= len(region_kinds):
+            regions[hood] += " " + str(region // len(region_kinds) + 1)
+
+    parks = []
+    taken = set()  # (name, neighborhood) has to be unique, the same name in two neighborhoods is fine
+    popular = []  # names reused all over town, like Memorial Park
+    for num in range(size):
+        hood = rng.choice(hoods)
+        if len(popular) > 0 and rng.random() < 0.1:
+            name = rng.choice(popular)
+        else:
+            name = make_name(rng, park_kinds)
+            if rng.random() < 0.02:
+                popular.append(name)
+        if (name, hood) in taken:
+            name += " " + str(num)
+        taken.add((name, hood))
+        short = name.rsplit(" ", 1)[0] if name.endswith(" Park") and rng.random() < 0.1 else ""
+        alts = []
+        if rng.random() < 0.2:
+            alts.append(make_name(rng, park_kinds))
+        if rng.random() < 0.03 and len(parks) > 0:
+            alts.append(rng.choice(parks)[0])  # an alt name that is also some other park's name
+        parks.append((name, short, alts, hood, rng.random() < 0.05))
+    return parks, regions
+
+
+# writes the city nest list; old_style writes the Primary Name columns that sort.py and old lists use
+def write_city(cfile, parks, old_style=False):
+    with open(cfile, 'w', newline='') as out:
+        writer = csv.writer(out, delimiter="\t", quoting=csv.QUOTE_ALL)
+        writer.writerow(old_header if old_style else city_header)
+        for name, short, alts, hood, private in parks:
+            if old_style:
+                writer.writerow([name, "/".join(alts), hood, "", "Y" if private else "", "", ""])
+            else:
+                writer.writerow([name, short, "/".join(alts), hood, "", "Y" if private else "", "", ""])
+
+
+# writes rotations old nest lists two weeks apart, starting on start
+# each one reports about a third of the parks, by whichever of their names the reporter used,
+# and variations is the share of rows whose park or neighborhood name is written some other way, see vary
+# returns the list of files written
+def write_history(hfolder, parks, rotations, start=datetime.date(2017, 1, 5), seed=57, variations=name_variations):
+    rng = random.Random(seed)
+    names = [row[1] for row in speciesdb.read_species_file()]
+    os.makedirs(hfolder, exist_ok=True)
+    files = []
+    for week in range(rotations):
+        hfile = os.path.join(hfolder, str(start + datetime.timedelta(weeks=2 * week)) + ".tsv")
+        with open(hfile, 'w', newline='') as out:
+            writer = csv.writer(out, delimiter="\t", quoting=csv.QUOTE_ALL)
+            writer.writerow(old_header)
+            for name, short, alts, hood, private in rng.sample(parks, len(parks) // 3):
+                if len(alts) > 0 and rng.random() < 0.2:
+                    name, alt = alts[0], name
+                else:
+                    alt = "/".join(alts)
+                if rng.random() < 0.1:
+                    name, hood = misspell(rng, name), misspell(rng, hood)
+                if rng.random() < variations:
+                    if rng.random() < 0.7:
+                        name, alt = vary(rng, name), ""
+                    else:
+                        hood = vary(rng, hood)
+                writer.writerow([name, alt, hood, "", "Y" if private else "", rng.choice(names), rng.choice("Y ")])
+        files.append(hfile)
+    return files
+
+
+# where a made-up city's neighborhood -> region section goes, see importoldlists.load_neighborhood_regions
+def regions_file(root, city):
+    return os.path.join(root, "cities", city + ".neighborhoods.cfg")
+
+
+# writes the city's neighborhood -> region section to a cfg file of its own, replacing an old one
+def write_regions(cfgfile, city, regions):
+    cfg = configparser.ConfigParser(delimiters=(':',), interpolation=None)
+    cfg.optionxform = str  # keep the neighborhood capitalization
+    cfg.add_section(city)
+    for hood, region in regions.items():
+        cfg.set(city, hood, region)
+    with open(cfgfile, 'w') as out:
+        cfg.write(out, space_around_delimiters=False)
+
+
+# writes a whole city under root the way the tools expect to find it
+# returns the path of the city list and of the history folder
+def write_synthetic_city(root, city, size, rotations, seed=57, collisions=hood_collisions,
+                         variations=name_variations):
+    parks, regions = make_city(size, seed, collisions)
+    os.makedirs(os.path.join(root, "cities"), exist_ok=True)
+    cfile = os.path.join(root, "cities", city + ".tsv")
+    write_city(cfile, parks)
+    write_regions(regions_file(root, city), city, regions)
+    hfolder = os.path.join(root, "hist-list", city) + "/"
+    write_history(hfolder, parks, rotations, seed=seed, variations=variations)
+    return cfile, hfolder
+
+
+@click.command()
+@click.argument('city')
+@click.option('-n', '--parks', 'size', default=1000, help="Number of parks in the city")
+@click.option('-w', '--rotations', default=26, help="Number of old nest lists to write, two weeks apart")
+@click.option('--seed', default=57, help="Random seed, the same seed writes the same city")
+@click.option('--root', default=".", help="Folder to write cities/ and hist-list/ under")
+@click.option('--collisions', default=hood_collisions, show_default=True,
+              help="Share of neighborhoods named after another one with a word added")
+@click.option('--variations', default=name_variations, show_default=True,
+              help="Share of old list rows that don't name their park or neighborhood exactly")
+def main(city, size, rotations, seed, root, collisions, variations):
+    cfile, hfolder = write_synthetic_city(root, city, size, rotations, seed, collisions, variations)
+    print("Wrote " + str(size) + " parks to " + cfile + " and " + str(rotations) + " nest lists to " + hfolder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# coding=UTF-8
+# Shared fixtures: a small synthetic city imported into a database, built once per test run
+
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import importoldlists as dbutils  # noqa: E402
+import synthcity  # noqa: E402
+
+city_name = "Testville"
+# spelled out rather than left to synthcity's defaults, the golden posts are rendered from this exact city
+testville_args = dict(size=400, rotations=6, seed=57, collisions=0.05, variations=0.03)
+
+
+# writes Testville, 400 parks and 6 rotations, under root and imports it the way the tools import a city
+# tests/golden/render_baseline.py renders the golden posts from it
+# returns the database file
+def build_testville(root):
+    cfile, hfolder = synthcity.write_synthetic_city(root, city_name, **testville_args)
+    dbfile = os.path.join(root, "nests.db")
+    dbc = dbutils.create_connection(dbfile)
+    dbutils.setup_db(dbc)
+    regions = dbutils.load_neighborhood_regions(city_name, synthcity.regions_file(root, city_name))
+    dbutils.import_city(cfile, dbc, regions)
+    dbc.commit()
+    dbutils.import_old_lists(hfolder, dbc, workers=1)
+    dbc.commit()
+    dbc.close()
+    return dbfile
+
+
+@pytest.fixture(scope="session")
+def testville_db(tmp_path_factory):
+    return build_testville(str(tmp_path_factory.mktemp("testville")))
+
+
+# a connection to a copy of Testville that the test is free to change
+@pytest.fixture
+def testville(testville_db, tmp_path):
+    dbfile = str(tmp_path / "nests.db")
+    shutil.copy(testville_db, dbfile)
+    dbc = dbutils.create_connection(dbfile)
+    yield dbc
+    dbc.close()
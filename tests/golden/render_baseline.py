@@ -0,0 +1,68 @@
+# coding=UTF-8
+# Renders the golden posts in this folder with update.py as it was before the renderers were rewritten
+# Testville is built by the current tree, the same way tests/conftest.py builds it, then rendered by the
+# baseline code in a checkout of its own:
+#     git worktree add /tmp/baseline 54b3471
+#     python3 tests/golden/render_baseline.py /tmp/baseline
+# The baseline refuses to copy a Discord region over 2000 characters, which Testville's regions are,
+# so it's run with that check lifted and the Discord golden is every part it copied, joined
+
+import builtins
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+import click
+
+here = os.path.dirname(os.path.abspath(__file__))
+rundate = "18 Oct 2026"
+build = "import sys; sys.path[:0] = sys.argv[2:]; import conftest; print(conftest.build_testville(sys.argv[1]))"
+
+
+# update.py from the baseline checkout, with pyperclip and input() stubbed out so nothing waits on a person
+def baseline_update(baseline, copied):
+    sys.path.insert(0, baseline)
+    import pyperclip
+    pyperclip.copy = copied.append
+    builtins.input = lambda prompt='': ''
+    with open(os.path.join(baseline, "update.py"), 'r', encoding="utf-8") as fin:
+        source = fin.read().replace("if len(loclst) > 2000:", "if False:")
+    update = type(sys)("update")
+    update.__file__ = os.path.join(baseline, "update.py")
+    sys.modules["update"] = update
+    exec(compile(source, update.__file__, "exec"), update.__dict__)
+    return update
+
+
+def write_golden(rotnum, post, text):
+    with open(os.path.join(here, "testville-" + str(rotnum) + "." + post + ".txt"), 'w', newline='') as out:
+        out.write(text)
+
+
+@click.command()
+@click.argument("baseline", type=click.Path(exists=True, file_okay=False))
+def main(baseline):
+    root = tempfile.mkdtemp()
+    tests = os.path.dirname(here)
+    dbfile = subprocess.run([sys.executable, "-c", build, root, tests, os.path.dirname(tests)],
+                            check=True, capture_output=True, text=True).stdout.splitlines()[-1]
+    copied = []
+    update = baseline_update(os.path.abspath(baseline), copied)
+    dbc = sqlite3.connect(dbfile)
+    for rotnum, shiftdate in dbc.execute("SELECT num, date FROM rotation_dates ORDER BY num").fetchall():
+        nests, empties, species = update.get_nests(rotnum, dbc)
+        copied.clear()
+        update.FB_post(nests, rundate, shiftdate, mt=empties, slist=species, rotnum=rotnum)
+        write_golden(rotnum, "fb", copied[0])
+        nests, empties, species = update.get_nests(rotnum, dbc)
+        copied.clear()
+        update.disc_posts(nests, rundate, shiftdate, slist=species, rotnum=rotnum)
+        write_golden(rotnum, "discord", "".join(copied))
+        print("Rotation", rotnum, "rendered")
+    dbc.close()
+
+
+if __name__ == "__main__":
+    main()
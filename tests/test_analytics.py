@@ -0,0 +1,53 @@
+# coding=UTF-8
+# The saved stats matrix has to notice edits to any rotation, not just the latest
+
+import pytest
+
+import analytics
+import species as speciesdb
+
+pytest.importorskip("numpy")
+
+
+def matrix(dbc, tmp_path):
+    return analytics.load_matrix(dbc, str(tmp_path / "nests.db"))
+
+
+def test_unchanged_database_loads_nothing(testville, tmp_path):
+    first = matrix(testville, tmp_path)
+    assert len(first.rotations) == 6
+    again = analytics.NestMatrix.load(analytics.matrix_file(str(tmp_path / "nests.db")))
+    assert again.refresh(testville) == 0
+    assert (again.matrix == first.matrix).all()
+
+
+def test_edit_to_an_old_rotation_is_reloaded(testville, tmp_path):
+    matrix(testville, tmp_path)
+    oldest = testville.execute("SELECT num FROM rotation_dates ORDER BY date").fetchone()[0]
+    eevee = speciesdb.registry(testville).lookup("Eevee").num
+    testville.execute("UPDATE species_list SET species_no = ?, species_txt = 'Eevee' WHERE rotation_num = ?",
+                      [eevee, oldest])
+    testville.commit()
+    saved = analytics.NestMatrix.load(analytics.matrix_file(str(tmp_path / "nests.db")))
+    assert saved.refresh(testville) == 1
+    rebuilt = analytics.NestMatrix()
+    rebuilt.refresh(testville, rebuild=True)
+    assert (saved.matrix == rebuilt.matrix).all()
+    assert saved.park_counts(eevee).sum() == rebuilt.park_counts(eevee).sum()
+
+
+# two parks trading species keeps the count of each species but still has to be noticed
+def test_swapped_species_are_reloaded(testville, tmp_path):
+    matrix(testville, tmp_path)
+    rotnum = testville.execute("SELECT num FROM rotation_dates ORDER BY date").fetchone()[0]
+    reports = testville.execute("""SELECT nestid, species_no, species_txt FROM species_list
+        WHERE rotation_num = ? ORDER BY species_no""", [rotnum]).fetchall()
+    (a, sa, ta), (b, sb, tb) = reports[0], reports[-1]
+    assert sa != sb
+    update = "UPDATE species_list SET species_no = ?, species_txt = ? WHERE rotation_num = ? AND nestid = ?"
+    testville.execute(update, [sb, tb, rotnum, a])
+    testville.execute(update, [sa, ta, rotnum, b])
+    testville.commit()
+    saved = analytics.NestMatrix.load(analytics.matrix_file(str(tmp_path / "nests.db")))
+    assert saved.refresh(testville) == 1
+    assert saved.matrix[0, saved.column(a)] == sb
@@ -0,0 +1,27 @@
+# coding=UTF-8
+# fan_out has to finish every city whether or not one of them fails
+
+import pytest
+
+import citydb
+
+
+# at module level so the worker processes can import it
+def halve(city, num):
+    if num % 2 == 1:
+        raise ValueError(city + " is odd")
+    return num // 2
+
+
+jobs = [("A", 2), ("B", 3), ("C", 4)]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_failed_city_doesnt_stop_the_others(workers):
+    assert citydb.fan_out(halve, jobs, workers) == [(("A", 2), 1, None), (("B", 3), None, "ValueError: B is odd"),
+                                                    (("C", 4), 2, None)]
+
+
+def test_single_city_raises():
+    with pytest.raises(ValueError):
+        citydb.fan_out(halve, [("B", 3)])
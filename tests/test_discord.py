@@ -0,0 +1,118 @@
+# coding=UTF-8
+# Properties of the Discord packer on random rotations: every message fits, nothing is lost or reordered,
+# and there are never more messages than a plain line-by-line fill that repeats the region headers
+
+import random
+import re
+
+import pytest
+
+import bench
+import update
+
+header = re.compile(r"__\*\*[^\n]*?\*\*__\n")  # a region header, repeated when the region is split
+
+
+# a rotation with regions from a handful of nests to several messages' worth, and long park names
+def random_rotation(seed):
+    rng = random.Random(seed)
+    nests = update.NestGroups()
+    species = update.NestGroups()
+    for region in range(rng.randrange(1, 60)):
+        loc = "Region " + str(region) + " " + "x" * rng.randrange(30)
+        for num in range(rng.choice([1, 5, 20, 150])):
+            name = "Park " + str(region) + "-" + str(num) + " " + "y" * rng.randrange(80)
+            nest = update.Nest(species=rng.choice(["Magikarp", "Eevee", "Gastly", "Pikachu"]),
+                               status=rng.choice([1, 2]), ghost=False,
+                               alt="Alt " + str(num) if rng.random() < 0.2 else '')
+            nests.add(loc, name, nest)
+            species.add(nest.species, name, nest)
+    species.spooked.add("Gastly")
+    return nests, species
+
+
+# the nest lines of a rotation in the order the post lists them
+def sections(nests):
+    result = [('', [update.disc_preamble("run", "shift", 1)])]
+    for loc in sorted(nests.keys()):
+        lines = []
+        for name in sorted(nests[loc].keys()):
+            nest = nests[loc][name]
+            lines.append(name + ('/' + nest.alt if nest.alt != '' else '') + ": " +
+                         update.decorate_text(nest.species, '****' if nest.status == 2 else '__') + '\n')
+        result.append((update.decorate_text(loc, '__****__') + '\n', lines))
+    return result
+
+
+# how many messages filling each one line by line takes, repeating a region's header when it's split
+def greedy_count(sections, limit=update.discord_limit):
+    count = 0
+    size = 0
+    current = None
+    for num, (head, lines) in enumerate(sections):
+        for line in lines:
+            need = len(line) if current == num else len(head) + len(line)
+            if size > 0 and size + need > limit:
+                count += 1
+                size = 0
+                need = len(head) + len(line)
+            size += need
+            current = num
+    return count + (1 if size > 0 else 0)
+
+
+def nest_messages(messages, slist):
+    popular = len(update.pack_messages([(update.popular_header, update.disc_species_lines(slist))]))
+    return messages[:len(messages) - popular], messages[len(messages) - popular:]
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_every_message_fits(seed):
+    nests, slist = random_rotation(seed)
+    for message in update.disc_messages(nests, "run", "shift", slist=slist, rotnum=1):
+        assert 0 < len(message) <= update.discord_limit
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_every_line_is_posted_in_order(seed):
+    nests, slist = random_rotation(seed)
+    posts, popular = nest_messages(update.disc_messages(nests, "run", "shift", slist=slist, rotnum=1), slist)
+    assert posts[0].startswith(update.disc_preamble("run", "shift", 1))
+    expected = "".join(line for _, lines in sections(nests) for line in lines)
+    assert header.sub("", "".join(posts)) == expected
+    assert "".join(popular).replace(update.popular_header, "") == "".join(update.disc_species_lines(slist))
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_no_more_messages_than_a_greedy_fill(seed):
+    nests, slist = random_rotation(seed)
+    posts, popular = nest_messages(update.disc_messages(nests, "run", "shift", slist=slist, rotnum=1), slist)
+    assert len(posts) <= greedy_count(sections(nests))
+    assert len(popular) <= greedy_count([(update.popular_header, update.disc_species_lines(slist))])
+
+
+# a species reported at more parks than one message holds is continued on more lines
+def test_long_popular_species_is_split():
+    nests, slist = random_rotation(3)
+    for num in range(400):
+        slist.add("Magikarp", "Lake " + str(num), update.Nest(species="Magikarp", status=2))
+    popular = update.pack_messages([(update.popular_header, update.disc_species_lines(slist))])
+    assert len(popular) > 1
+    for message in popular:
+        assert message.startswith(update.popular_header)
+        assert len(message) <= update.discord_limit
+
+
+def test_fake_city_fits():
+    nests, empties, slist = bench.fake_rotation(10000)
+    messages = update.disc_messages(nests, "run", "shift", slist=slist, rotnum=1)
+    assert max(len(message) for message in messages) <= update.discord_limit
+    posts, _ = nest_messages(messages, slist)
+    assert len(posts) <= greedy_count(sections(nests))
+
+
+def test_nest_too_long_for_a_message():
+    nests = update.NestGroups()
+    nests.add("Region", "P" * 2100, update.Nest(species="Eevee", status=2))
+    with pytest.raises(Exception, match="too long"):
+        update.disc_messages(nests, "run", "shift")
@@ -0,0 +1,48 @@
+# coding=UTF-8
+# The history import reads lists in worker processes and writes them from one
+
+import concurrent.futures
+import os
+import shutil
+
+import importoldlists as dbutils
+
+
+# runs each job as it's submitted, keeping count of the results not yet used
+class CountingPool:
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, func, *args):
+        self.submitted += 1
+        future = concurrent.futures.Future()
+        future.set_result(func(*args))
+        return future
+
+
+def test_read_ahead_is_bounded():
+    pool = CountingPool()
+    used = 0
+    for result in dbutils.read_ahead(pool, lambda num: num * 2, range(100), 4):
+        assert result == used * 2
+        used += 1
+        assert pool.submitted - used <= 4
+    assert used == 100
+
+
+# the lists read by a pool of workers import the same as the ones read here
+def test_parallel_import_matches(testville_db, tmp_path):
+    hfolder = os.path.join(os.path.dirname(testville_db), "hist-list", "Testville") + "/"
+    dbfile = str(tmp_path / "pool.db")
+    shutil.copy(testville_db, dbfile)
+    dbc = dbutils.create_connection(dbfile)
+    expected = dbc.execute("SELECT * FROM species_list ORDER BY rotation_num, nestid").fetchall()
+    dbc.execute("DELETE FROM species_list")
+    dbc.execute("DELETE FROM rotation_dates")
+    dbc.execute("DELETE FROM hist_imports")
+    dbc.commit()
+    dbutils.import_old_lists(hfolder, dbc, workers=2)
+    offset = dbc.execute("SELECT min(num) FROM rotation_dates").fetchone()[0] - 1
+    found = dbc.execute("SELECT * FROM species_list ORDER BY rotation_num, nestid").fetchall()
+    assert [(row[0] - offset,) + row[1:] for row in found] == expected
+    dbc.close()
@@ -0,0 +1,122 @@
+# coding=UTF-8
+# The schema migrations and the triggers that keep the park name search index in step
+
+import migrations
+
+
+# the (park, name) of every alt name, from alt_names and from the search index
+def alt_names(dbc):
+    table = sorted(dbc.execute("SELECT main_entry, name FROM alt_names").fetchall())
+    index = sorted(dbc.execute("SELECT nest_id, name FROM nest_search WHERE kind = 'alt'").fetchall())
+    return table, index
+
+
+def test_testville_is_fully_migrated(testville):
+    assert migrations.get_version(testville) == migrations.latest_version()
+    table, index = alt_names(testville)
+    assert len(table) > 0
+    assert index == table
+
+
+# alt_names has no INTEGER PRIMARY KEY, so VACUUM is free to renumber its rowids,
+# which it does when the table has no index
+def test_alt_name_edits_after_vacuum(testville):
+    rows = testville.execute("SELECT rowid, main_entry, name FROM alt_names ORDER BY rowid").fetchall()
+    testville.execute("DELETE FROM alt_names WHERE rowid <= ?", [rows[len(rows) // 2][0]])
+    testville.commit()
+    testville.execute("DROP INDEX alt_names_main_entry")
+    testville.execute("VACUUM")
+    _, park, name = rows[-1]
+    assert testville.execute("SELECT min(rowid) FROM alt_names").fetchone()[0] == 1
+    testville.execute("UPDATE alt_names SET name = 'Renamed Green' WHERE main_entry = ? AND name = ?", [park, name])
+    testville.execute("DELETE FROM alt_names WHERE rowid = (SELECT max(rowid) FROM alt_names)")
+    testville.commit()
+    table, index = alt_names(testville)
+    assert index == table
+
+
+# a name entered twice for one park is indexed twice, and deleting one leaves the other
+def test_repeated_alt_name(testville):
+    park = testville.execute("SELECT min(nest_id) FROM nest_locations").fetchone()[0]
+    testville.executemany("INSERT INTO alt_names(main_entry, name) VALUES (?, 'Twice Park')", [[park], [park]])
+    testville.execute("DELETE FROM alt_names WHERE rowid = (SELECT max(rowid) FROM alt_names)")
+    testville.commit()
+    table, index = alt_names(testville)
+    assert index == table
+    assert (park, "Twice Park") in index
+
+
+# a database the rowid-keyed index was built in gets it built again
+def test_search_index_is_rekeyed(testville):
+    testville.execute("PRAGMA user_version = 4")
+    testville.execute("DELETE FROM nest_search WHERE kind = 'alt'")
+    testville.commit()
+    assert migrations.migrate(testville) == migrations.latest_version()
+    table, index = alt_names(testville)
+    assert index == table
+
+
+# without trigram support the migrations go on without the index, which is built once SQLite has it
+def test_search_index_built_after_upgrade(testville, monkeypatch):
+    testville.execute("DROP TABLE nest_search")
+    for trigger in migrations.search_triggers:
+        testville.execute("DROP TRIGGER " + trigger)
+    testville.execute("PRAGMA user_version = 1")
+    monkeypatch.setattr(migrations, "has_trigram", lambda dbc: False)
+    assert migrations.migrate(testville) == migrations.latest_version()
+    assert not migrations.has_table(testville, "nest_search")
+    monkeypatch.undo()
+    assert migrations.migrate(testville) == migrations.latest_version()
+    table, index = alt_names(testville)
+    assert index == table
+
+
+def triggers(dbc):
+    return set(row[0] for row in dbc.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'"))
+
+
+def data_version(dbc):
+    return dbc.execute("SELECT version FROM data_version").fetchone()[0]
+
+
+# an import writes without the triggers and puts them back after, with the index filled and one version bump
+def test_bulk_load_puts_the_triggers_back(testville):
+    before = data_version(testville)
+    park = testville.execute("SELECT min(nest_id) FROM nest_locations").fetchone()[0]
+    with migrations.bulk_load(testville, ["alt_names", "species_list"]):
+        assert "nest_search_alt_ins" not in triggers(testville)
+        assert "species_list_insert_version" not in triggers(testville)
+        assert "nest_search_nest_ins" in triggers(testville)
+        testville.executemany("INSERT INTO alt_names(main_entry, name) VALUES (?, ?)",
+                              [(park, "Bulk Green " + str(num)) for num in range(50)])
+        assert data_version(testville) == before
+    assert set(migrations.sync_triggers(testville)) <= triggers(testville)
+    assert data_version(testville) == before + 1
+    table, index = alt_names(testville)
+    assert index == table
+
+
+def test_bulk_load_rolls_back_an_import_that_raises(testville):
+    before = alt_names(testville)
+    try:
+        with migrations.bulk_load(testville, ["alt_names"]):
+            testville.execute("INSERT INTO alt_names(main_entry, name) VALUES (1, 'Half Imported')")
+            raise KeyError("a bad row")
+    except KeyError:
+        pass
+    assert set(migrations.sync_triggers(testville)) <= triggers(testville)
+    assert alt_names(testville) == before
+
+
+# an import killed inside bulk_load leaves the triggers out, and the next connection puts them back
+def test_missing_triggers_are_restored(testville):
+    before = data_version(testville)
+    for name in migrations.sync_triggers(testville):
+        testville.execute("DROP TRIGGER " + name)
+    testville.execute("INSERT INTO alt_names(main_entry, name) VALUES (1, 'Unseen Green')")
+    testville.commit()
+    migrations.migrate(testville)
+    assert set(migrations.sync_triggers(testville)) <= triggers(testville)
+    assert data_version(testville) == before + 1
+    table, index = alt_names(testville)
+    assert index == table
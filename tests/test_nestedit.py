@@ -0,0 +1,30 @@
+# coding=UTF-8
+# The batch edit mode of nestedit.py
+
+import sqlite3
+
+from click.testing import CliRunner
+
+import nestedit
+
+
+def test_confirm_needs_a_y():
+    edits = nestedit.read_batch(["Park A|Eevee|Y\n", "Park B|Eevee|N\n", "Park C|Eevee|yes\n", "Park D|Eevee\n",
+                                 "# a comment\n", "\n"])
+    assert [(park, conf) for _, park, _, conf in edits] == [("Park A", 1), ("Park B", None), ("Park C", 1),
+                                                            ("Park D", None)]
+
+
+# the edits come from stdin, so the date mustn't be asked for there
+def test_batch_from_stdin_doesnt_prompt(testville, tmp_path, monkeypatch):
+    nid = testville.execute("SELECT min(nest_id) FROM nest_locations").fetchone()[0]
+    rotnum = testville.execute("SELECT num FROM rotation_dates ORDER BY date DESC").fetchone()[0]
+    testville.close()
+    monkeypatch.chdir(tmp_path)  # the testville fixture's copy is tmp_path/nests.db
+    result = CliRunner().invoke(nestedit.main, ["--batch", "-"], input=str(nid) + "|Eevee|N\n")
+    assert result.exit_code == 0, result.output
+    assert "Date to edit" not in result.output
+    dbc = sqlite3.connect(str(tmp_path / "nests.db"))
+    assert dbc.execute("SELECT species_txt, confirmation FROM species_list WHERE rotation_num = ? AND nestid = ?",
+                       [rotnum, nid]).fetchone() == ("Eevee", None)
+    dbc.close()
@@ -0,0 +1,125 @@
+# coding=UTF-8
+# The rendered posts have to come out byte for byte the same as before the renderers were rewritten
+
+import datetime
+import io
+import os
+import re
+
+import pytest
+
+import bench
+import importoldlists as dbutils
+import synthcity
+import update
+
+rundate = "18 Oct 2026"
+goldens = os.path.join(os.path.dirname(__file__), "golden")
+
+
+def rotations(dbc):
+    return dbc.execute("SELECT num, date FROM rotation_dates ORDER BY num").fetchall()
+
+
+def test_testville_has_every_rotation(testville):
+    assert len(rotations(testville)) == 6
+
+
+# the posts update.py rendered from Testville before the rewrite, see golden/render_baseline.py
+def golden(rotnum, post):
+    with open(os.path.join(goldens, "testville-" + str(rotnum) + "." + post + ".txt"), 'r', newline='') as fin:
+        return fin.read()
+
+
+# the Discord messages as one text, with the region header a message repeats from the one before taken out
+def joined(messages):
+    text = messages[0]
+    for prev, msg in zip(messages, messages[1:]):
+        headers = re.findall(r"^__\*\*.*?\*\*__\n?", prev, re.M)
+        if headers and msg.startswith(headers[-1]):
+            msg = msg[len(headers[-1]):]
+        text += msg
+    return text
+
+
+@pytest.mark.parametrize("rotation", range(6))
+def test_fb_post_matches_the_golden(testville, rotation):
+    rotnum, shiftdate = rotations(testville)[rotation]
+    nests, empties, species = update.get_nests(rotnum, testville)
+    assert update.write_FB_post(nests, rundate, shiftdate, mt=empties, slist=species, rotnum=rotnum) == \
+        golden(rotnum, "fb")
+
+
+# the old renderer copied a region whole, the new one splits it, so the text has to match once joined
+@pytest.mark.parametrize("rotation", range(6))
+def test_discord_post_matches_the_golden(testville, rotation):
+    rotnum, shiftdate = rotations(testville)[rotation]
+    nests, empties, species = update.get_nests(rotnum, testville)
+    messages = update.disc_messages(nests, rundate, shiftdate, slist=species, rotnum=rotnum)
+    assert all(len(msg) <= 2000 for msg in messages)
+    assert joined(messages) == golden(rotnum, "discord")
+
+
+@pytest.mark.parametrize("rotation", range(6))
+def test_fb_post_streams_the_same_text(testville, rotation):
+    rotnum, shiftdate = rotations(testville)[rotation]
+    nests, empties, species = update.get_nests(rotnum, testville)
+    sink = io.StringIO()
+    assert update.write_FB_post(nests, rundate, shiftdate, mt=empties, slist=species, rotnum=rotnum,
+                                out=sink) is None
+    assert sink.getvalue() == update.write_FB_post(nests, rundate, shiftdate, mt=empties, slist=species,
+                                                   rotnum=rotnum)
+
+
+# a cache hit marks the post as used, and that has to survive the connection closing
+def test_cache_hit_is_saved(testville):
+    rotnum, shiftdate = rotations(testville)[0]
+    first = update.cached_render(testville, rotnum, shiftdate, rundate, ["Facebook", "Discord"])
+    testville.execute("UPDATE render_cache SET last_used = 0")
+    testville.commit()
+    assert update.cached_render(testville, rotnum, shiftdate, rundate, ["Facebook", "Discord"]) == first
+    dbfile = testville.execute("PRAGMA database_list").fetchone()[2]
+    other = dbutils.create_connection(dbfile)
+    assert other.execute("SELECT min(last_used) FROM render_cache").fetchone()[0] > 0
+    other.close()
+
+
+# an old TSV list loads into the same post with csv.reader as it did with DictReader
+def test_old_list_loads_like_dictreader(tmp_path):
+    parks, _ = synthcity.make_city(600)
+    nestfile = synthcity.write_history(str(tmp_path), parks, 1)[0]
+    with open(nestfile, 'a') as out:
+        out.write("\n")  # DictReader skips blank lines
+    new = update.load_nests(nestfile)
+    old = bench.old_load_nests(nestfile)
+    assert update.write_FB_post(new[0], rundate, "shift", mt=new[1]) == \
+        update.write_FB_post(old[0], rundate, "shift", mt=old[1])
+
+
+# DictReader gave a row missing its last columns None for them, which crashed on .strip()
+def test_short_row_loads(tmp_path):
+    nestfile = tmp_path / "2019-01-01.tsv"
+    nestfile.write_text("\t".join(update.old_list_columns) + "\nNowhere\tShort Park\tEevee\n")
+    nests, empties = update.load_nests(str(nestfile))
+    assert nests["Nowhere"]["Short Park"].species == "Eevee"
+
+
+# batch mode passes the date as a date, and one before every rotation falls back to the oldest
+def test_date_before_every_rotation(testville):
+    oldest = rotations(testville)[0]
+    assert update.get_rot8d8(datetime.date(2000, 1, 1), testville) == oldest
+
+
+# nesting_species decides which nests are ghosts, so editing it has to miss the cache
+def test_species_edit_misses_the_cache(testville, monkeypatch):
+    rotnum, shiftdate = rotations(testville)[0]
+    update.cached_render(testville, rotnum, shiftdate, rundate, ["Facebook"])
+    renders = []
+    render_rotation = update.render_rotation
+    monkeypatch.setattr(update, "render_rotation", lambda *args: renders.append(args) or render_rotation(*args))
+    update.cached_render(testville, rotnum, shiftdate, rundate, ["Facebook"])
+    assert len(renders) == 0
+    testville.execute("UPDATE nesting_species SET Subtype = 'Ghost' WHERE Name = 'Eevee'")
+    testville.commit()
+    update.cached_render(testville, rotnum, shiftdate, rundate, ["Facebook"])
+    assert len(renders) == 1
@@ -0,0 +1,41 @@
+# coding=UTF-8
+# Sorting a city list in chunks gives the same list as sorting it in memory
+
+import csv
+
+from click.testing import CliRunner
+
+import sort
+import synthcity
+
+
+def write_list(path, size):
+    parks, _ = synthcity.make_city(size)
+    synthcity.write_city(str(path), parks)
+    return str(path)
+
+
+def read_list(path):
+    with open(path, newline='') as fin:
+        return list(csv.reader(fin, delimiter="\t"))
+
+
+# a chunk of one byte spills every row, and the spilled runs are merged before there are too many open
+def test_tiny_chunks_sort_the_same(tmp_path, monkeypatch):
+    cfile = write_list(tmp_path / "Chunkville.tsv", 300)
+    sort.sort_city(cfile, str(tmp_path / "memory.tsv"))
+    with open(cfile, newline='') as fin:
+        reader = csv.reader(fin, delimiter="\t")
+        header = next(reader)
+        monkeypatch.setattr(sort, "max_runs", 8)
+        runs = sort.sorted_runs(reader, len(header), *sort.key_columns(header), chunk=1)
+        assert len(runs) <= 8
+    monkeypatch.setattr(sort, "max_runs", 8)
+    sort.sort_city(cfile, str(tmp_path / "chunks.tsv"), chunk=1)
+    assert read_list(tmp_path / "chunks.tsv") == read_list(tmp_path / "memory.tsv")
+
+
+def test_chunk_mb_has_to_be_positive():
+    result = CliRunner().invoke(sort.main, ["Nowhere", "--chunk-mb", "0"])
+    assert result.exit_code == 2
+    assert "--chunk-mb" in result.output
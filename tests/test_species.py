@@ -0,0 +1,32 @@
+# coding=UTF-8
+# Each database has its own species registry, even when one process works on several cities
+
+import shutil
+
+import importoldlists as dbutils
+import species
+
+
+def test_each_database_has_its_own_registry(testville_db, tmp_path):
+    dbcs = []
+    for city in ["Ghostville", "Plainville"]:
+        dbfile = str(tmp_path / (city + ".db"))
+        shutil.copy(testville_db, dbfile)
+        dbcs.append(dbutils.create_connection(dbfile))
+    ghosts, plain = dbcs
+    assert not species.registry(plain).is_type(133, "Ghost")
+    ghosts.execute("UPDATE nesting_species SET Subtype = 'Ghost' WHERE `#` = 133")
+    ghosts.commit()
+    assert species.registry(ghosts).is_type(133, "Ghost")
+    assert not species.registry(plain).is_type(133, "Ghost")
+    for dbc in dbcs:
+        dbc.close()
+
+
+# an edit to nesting_species is seen by the next lookup in the same process
+def test_registry_sees_edits(testville):
+    assert species.registry(testville).lookup("Eevee") is not None
+    testville.execute("UPDATE nesting_species SET Name = 'Eievui' WHERE Name = 'Eevee'")
+    testville.commit()
+    assert species.registry(testville).lookup("Eevee") is None
+    assert species.registry(testville).lookup("Eievui").num == 133
@@ -0,0 +1,98 @@
+# coding=UTF-8
+# An export has to read back as the same rows, with every value fitting the MariaDB type of its column
+# There's no MariaDB server here, so check_export stands in for one running in strict mode
+
+import sqlite3
+
+from click.testing import CliRunner
+
+import SQLite2Maria as maria
+
+
+def export_to(dbc, path, rows=maria.batch_size):
+    with open(path, 'w', encoding="utf-8") as out:
+        maria.export(dbc, out, rows)
+    return str(path)
+
+
+def test_integers_are_bigint():
+    assert maria.column_type("INTEGER") == "BIGINT"
+    assert maria.column_type("int") == "BIGINT"
+    assert maria.column_type("TEXT", keyed=True) == "VARCHAR(255)"
+
+
+def test_testville_round_trip(testville, tmp_path):
+    sqlfile = export_to(testville, tmp_path / "nests.sql", rows=97)
+    assert maria.check_export(testville, sqlfile) == []
+
+
+edge_rows = [
+    (1, 1792325965012579579, 0.1, "plain", b"\x00\x01\xff"),
+    (2, -2 ** 63, float("inf"), "it's a \\ backslash", b""),
+    (3, 2 ** 63 - 1, float("-inf"), "NUL \0 and \x1a and\r\nnewlines", None),
+    (4, None, float("nan"), "Pokéstop ✨ 🐉", b"'\\"),
+    (5, 0, -1.5e-300, "", None),
+]
+
+
+def edge_db(path):
+    dbc = sqlite3.connect(str(path))
+    dbc.execute("CREATE TABLE edges (id INTEGER PRIMARY KEY, big INTEGER, real REAL, words TEXT NOT NULL, raw BLOB)")
+    dbc.executemany("INSERT INTO edges VALUES (?, ?, ?, ?, ?)", edge_rows)
+    dbc.commit()
+    return dbc
+
+
+def test_edge_values_round_trip(tmp_path):
+    dbc = edge_db(tmp_path / "edges.db")
+    sqlfile = export_to(dbc, tmp_path / "edges.sql", rows=2)
+    assert maria.check_export(dbc, sqlfile) == []
+    with open(sqlfile, 'r') as fin:
+        script = fin.read()
+    assert "`big` BIGINT" in script
+    assert "NULL,'Pok" in script  # NaN goes out as NULL
+
+
+def test_int_columns_are_reported(tmp_path):
+    dbc = edge_db(tmp_path / "edges.db")
+    sqlfile = export_to(dbc, tmp_path / "edges.sql")
+    with open(sqlfile, 'r') as fin:
+        script = fin.read()
+    with open(sqlfile, 'w') as out:
+        out.write(script.replace(" BIGINT", " INT"))
+    problems = maria.check_export(dbc, sqlfile)
+    assert len(problems) == 1
+    assert problems[0].startswith("edges.big: 3 values MariaDB won't take as they are, out of range for INT")
+
+
+def test_value_problems():
+    assert maria.value_problem(2 ** 31, "INT") == "out of range for INT"
+    assert maria.value_problem(2 ** 31, "BIGINT") is None
+    assert maria.value_problem(2 ** 63, "BIGINT") == "out of range for BIGINT"
+    assert maria.value_problem("12", "BIGINT") is None
+    assert maria.value_problem("twelve", "BIGINT") == "text in a BIGINT column"
+    assert maria.value_problem(1.5, "BIGINT") == "a fraction rounded off in a BIGINT column"
+    assert maria.value_problem(b"x", "DOUBLE") == "binary data in a DOUBLE column"
+    assert maria.value_problem("é" * 255, "VARCHAR(255)") is None
+    assert maria.value_problem("x" * 256, "VARCHAR(255)") == "too long for VARCHAR(255)"
+    assert maria.value_problem("é" * 40000, "TEXT") == "too long for TEXT"
+
+
+def test_null_in_not_null_column_is_reported(tmp_path):
+    dbc = edge_db(tmp_path / "edges.db")
+    sqlfile = export_to(dbc, tmp_path / "edges.sql")
+    with open(sqlfile, 'r') as fin:
+        script = fin.read()
+    with open(sqlfile, 'w') as out:
+        out.write(script.replace("`raw` BLOB", "`raw` BLOB NOT NULL"))
+    assert maria.check_export(dbc, sqlfile) == ["edges.raw: 2 values MariaDB won't take as they are, "
+                                                "NULL in a NOT NULL column, e.g. NULL"]
+
+
+# --check reads the script back from its file, so -o - is refused before anything is exported
+def test_check_needs_a_file(tmp_path):
+    edge_db(tmp_path / "edges.db").close()
+    result = CliRunner().invoke(maria.main, [str(tmp_path / "edges.db"), "--check"])
+    assert result.exit_code == 2
+    assert "INSERT" not in result.output
+    assert "--check needs the script in a file" in result.output
@@ -0,0 +1,51 @@
+# coding=UTF-8
+# synthcity.py must leave the hand-kept cities/neighborhoods.cfg alone
+
+import pytest
+
+import importoldlists as dbutils
+import synthcity
+
+shared = """# regions by hand
+[Columbus]
+Kenyon College : Gambier
+"""
+
+
+def test_shared_cfg_is_untouched(tmp_path):
+    (tmp_path / "cities").mkdir()
+    (tmp_path / "cities" / "neighborhoods.cfg").write_text(shared)
+    synthcity.write_synthetic_city(str(tmp_path), "Testville", 200, 1)
+    assert (tmp_path / "cities" / "neighborhoods.cfg").read_text() == shared
+
+
+def test_regions_are_found(tmp_path, monkeypatch):
+    (tmp_path / "cities").mkdir()
+    (tmp_path / "cities" / "neighborhoods.cfg").write_text(shared)
+    _, regions = synthcity.make_city(200)
+    synthcity.write_synthetic_city(str(tmp_path), "Testville", 200, 1)
+    monkeypatch.chdir(tmp_path)
+    assert dbutils.load_neighborhood_regions("Testville") == {dbutils.normalize_name(hood): region
+                                                              for hood, region in regions.items()}
+    assert dbutils.load_neighborhood_regions("Columbus") == {dbutils.normalize_name("Kenyon College"): "Gambier"}
+
+
+def test_some_neighborhoods_collide():
+    _, regions = synthcity.make_city(2000)
+    hoods = list(regions)
+    assert any(other != hood and other.startswith(hood + " ") for hood in hoods for other in hoods)
+
+
+# the rows that aren't exact matches go to the database search, so the benchmarks time it
+@pytest.mark.parametrize("variations", [0, 0.1])
+def test_history_needs_the_search(tmp_path, variations):
+    cfile, hfolder = synthcity.write_synthetic_city(str(tmp_path), "Testville", 400, 2, variations=variations)
+    dbc = dbutils.create_connection(str(tmp_path / "nests.db"))
+    dbutils.setup_db(dbc)
+    regions = dbutils.load_neighborhood_regions("Testville", synthcity.regions_file(str(tmp_path), "Testville"))
+    dbutils.import_city(cfile, dbc, regions)
+    resolver = dbutils.NestResolver(dbc)
+    dbutils.import_old_lists(hfolder, dbc, workers=1, resolver=resolver)
+    dbc.close()
+    assert resolver.hits > 0
+    assert (resolver.misses > 0) == (variations > 0)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# coding=UTF-8
+# -*- coding: UTF-8 -*-
+# vim: set fileencoding=UTF-8 :
+
+# Shows where the time goes in a run of one of the tools: the wall time of each phase, and the calls,
+# rows, time, and SQLite VM steps of every SQL statement, grouped by the statement's text
+# Each tool turns it on with --timings (a summary on stderr) or --timings FILE (a JSON report)
+# When it's off, phase() does nothing and connections are plain sqlite3 connections
+
+import contextlib
+import functools
+import json
+import re
+import sqlite3
+import sys
+import time
+
+import click
+
+progress_steps = 1000  # SQLite VM instructions between calls of the progress handler
+
+_active = None  # the Timings of the current run, when --timings is on
+
+
+# collapses the whitespace and literals of a SQL statement so that every run of it counts as one statement
+# "IN (?,?,?)" lists of any length count as the same statement too
+def normalize_sql(sql):
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(…)", sql)
+    return " ".join(sql.split())
+
+
+class Timings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}  # phase name -> [calls, seconds]
+        self.statements = {}  # normalized SQL -> [calls, rows, seconds, VM steps]
+        self.current = None  # the statement SQLite is running, for the progress handler
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats = self.phases.setdefault(name, [0, 0.0])
+            stats[0] += 1
+            stats[1] += time.perf_counter() - start
+
+    # runs one cursor call for a statement, charging its time and rows to the statement
+    def run(self, key, calls, func, *args):
+        stats = self.statements.setdefault(key, [0, 0, 0.0, 0])
+        outer = self.current
+        self.current = stats
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+        finally:
+            stats[2] += time.perf_counter() - start
+            stats[0] += calls
+            self.current = outer
+        return result
+
+    def tick(self):
+        if self.current is not None:
+            self.current[3] += progress_steps
+        return 0  # anything else would abort the statement
+
+    # the report as a dict, with the statements that took the longest first
+    def summary(self):
+        return {
+            "seconds": time.perf_counter() - self.started,
+            "phases": [{"phase": name, "calls": calls, "seconds": seconds}
+                       for name, (calls, seconds) in self.phases.items()],
+            "statements": [{"sql": sql, "calls": calls, "rows": rows, "seconds": seconds, "vm_steps": steps}
+                           for sql, (calls, rows, seconds, steps)
+                           in sorted(self.statements.items(), key=lambda item: -item[1][2])],
+        }
+
+
+# a cursor that charges everything it does to its statement
+# rows are counted as they are fetched, so a statement that is never read shows 0 rows
+class TimedCursor(sqlite3.Cursor):
+    key = None
+
+    def execute(self, sql, parameters=()):
+        self.key = normalize_sql(sql)
+        return _active.run(self.key, 1, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self.key = normalize_sql(sql)
+        params = list(seq_of_parameters)
+        return _active.run(self.key, len(params), super().executemany, sql, params)
+
+    def executescript(self, sql_script):
+        self.key = normalize_sql(sql_script)
+        return _active.run(self.key, 1, super().executescript, sql_script)
+
+    def fetched(self, func, *args):
+        rows = _active.run(self.key, 0, func, *args)
+        if rows is not None:
+            _active.statements[self.key][1] += len(rows) if isinstance(rows, list) else 1
+        return rows
+
+    def fetchone(self):
+        return self.fetched(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self.fetched(super().fetchmany, size if size is not None else self.arraysize)
+
+    def fetchall(self):
+        return self.fetched(super().fetchall)
+
+    def __next__(self):
+        return self.fetched(super().__next__)
+
+
+# a connection whose statements all run through TimedCursor
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+# opens a database the way sqlite3.connect does, but with every statement timed when --timings is on
+def connect(db_file, **kwargs):
+    if _active is None:
+        return sqlite3.connect(db_file, **kwargs)
+    conn = sqlite3.connect(db_file, factory=TimedConnection, **kwargs)
+    conn.set_progress_handler(_active.tick, progress_steps)
+    return conn
+
+
+# times a phase of the run: with timings.phase("render"): ...
+def phase(name):
+    if _active is None:
+        return contextlib.nullcontext()
+    return _active.phase(name)
+
+
+def start():
+    global _active
+    _active = Timings()
+
+
+# ends the run, printing the summary to stderr or writing the JSON report to a file
+def finish(report="-", top=20):
+    global _active
+    summary = _active.summary()
+    _active = None
+    if report != "-":
+        with open(report, 'w') as out:
+            json.dump(summary, out, indent=1)
+        return summary
+    err = sys.stderr
+    print(f"{'phase':<40}{'calls':>8}{'seconds':>10}", file=err)
+    for row in summary["phases"]:
+        print(f"{row['phase']:<40}{row['calls']:>8}{row['seconds']:>10.3f}", file=err)
+    print(f"{'total':<48}{summary['seconds']:>10.3f}", file=err)
+    if len(summary["statements"]) == 0:
+        return summary
+    print(f"\n{'SQL':<60}{'calls':>8}{'rows':>9}{'seconds':>10}{'VM steps':>12}", file=err)
+    for row in summary["statements"][:top]:
+        sql = row["sql"] if len(row["sql"]) <= 58 else row["sql"][:57] + "…"
+        print(f"{sql:<60}{row['calls']:>8}{row['rows']:>9}{row['seconds']:>10.3f}{row['vm_steps']:>12}", file=err)
+    if len(summary["statements"]) > top:
+        print("… and " + str(len(summary["statements"]) - top) + " more statements, use --timings FILE for all",
+              file=err)
+    return summary
+
+
+# adds --timings to a click command or group and reports on the run when it's done
+def option(func):
+    @click.option(
+        '--timings',
+        'timings_report',
+        is_flag=False,
+        flag_value="-",
+        default=None,
+        metavar="[FILE]",
+        help="Report the time of each phase and SQL statement on stderr, or as JSON to FILE")
+    @functools.wraps(func)
+    def timed(*args, timings_report=None, **kwargs):
+        if timings_report is not None:
+            start()
+            # a group's callback returns before its subcommand runs, so wait for the context to close
+            click.get_current_context().call_on_close(lambda: finish(timings_report))
+        return func(*args, **kwargs)
+
+    return timed
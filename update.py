@@ -5,17 +5,22 @@
 
 import csv
 import datetime
+import functools
+import io
+import json
 import os
+import sqlite3
+import sys
+import time
 from collections import defaultdict
 
 import click
-import pyperclip
-from sortedcontainers import SortedList
 
-import importoldlists as dbutils
+import citydb
 import rotate as dateparse
+import species
+import timings
 
-nested_dict = lambda: defaultdict(nested_dict)
 global private_reminder, ghost_icon, giraffe_icon, smallwhale, largewhale, rat_icon, hoothoot
 private_reminder = '☝'  # maybe this should be in a config file in the future
 ghost_icon = '👻'
@@ -25,6 +30,8 @@ largewhale = '🐋'
 rat_icon = '🐀'
 hoothoot = '🦉'
 water_icon = '💦'
+discord_limit = 2000  # Discord post length limit
+render_cache_limit = 8 * 1024 * 1024  # bytes of rendered posts to keep in the database
 
 '''
 Takes the city and date and outputs the FB-formatted nest post
@@ -34,8 +41,47 @@ If no lists are older than the specified date, output error and use oldest avail
 '''
 
 
+# one park's entry in a nest list
+# slotted so that a big rotation doesn't carry a dict per nest and a typo is an AttributeError
+class Nest:
+    __slots__ = ("species", "status", "private", "ghost", "alt", "note",
+                 "official_name", "short_name", "neighborhood", "region", "species_num")
+
+    def __init__(self, species=None, status=0, private=False, ghost=False, alt='', note=None,
+                 official_name=None, short_name=None, neighborhood=None, region=None, species_num=None):
+        self.species = species
+        self.status = status  # 0 for no info, 1 for unconfirmed, 2 for confirmed
+        self.private = private
+        self.ghost = ghost
+        self.alt = alt  # alt names joined with /
+        self.note = note
+        self.official_name = official_name
+        self.short_name = short_name
+        self.neighborhood = neighborhood
+        self.region = region
+        self.species_num = species_num
+
+
+# nests grouped by location or species, then keyed by park name within each group
+# spooked holds the groups that have a ghost-type nest in them
+class NestGroups(dict):
+    __slots__ = ("spooked",)
+
+    def __init__(self):
+        super().__init__()
+        self.spooked = set()
+
+    def add(self, group, name, nest):
+        if group not in self:
+            self[group] = {}
+        self[group][name] = nest
+        if nest.ghost:
+            self.spooked.add(group)
+
+
 # check that you're running a valid city
 def city_folder_check(city, prefix):
+    import histlist
     cfolder = prefix + city + "/"
     if os.path.exists(cfolder) is False:
         print("There is no folder for " + city +
@@ -43,12 +89,7 @@ def city_folder_check(city, prefix):
         return False
 
     # ignore .hidden files and folders
-    files = 0
-    for f in os.listdir(cfolder):
-        if not f.startswith('.') and os.path.isfile(cfolder + f):
-            files += 1
-
-    if files == 0:
+    if len(histlist.manifest(cfolder)) == 0:
         print("There are no nest records in " + city + "'s folder")
         return False
     return True
@@ -71,19 +112,14 @@ def decorate_text(text, decor):
 
 # finds the closest matching nest list to the given date
 def find_nest_list(path, date):
-    searchlist = SortedList()
-    for file in os.listdir(path):
-        if not file.startswith('.') and os.path.isfile(path + file):
-            searchlist.add(file)
-
-    # ZZZ to ensure it goes after other files
-    loc = searchlist.bisect_right(str(date) + "ZZZ ") - 1
-    if loc < 0:
+    import histlist
+    found = histlist.manifest(path).on_or_before(date)
+    if found is None:
         print("Date " + str(date) +
               " is prior to any stored rotations.  Using oldest available data instead.")
-        loc = 0
-    recentrotation = searchlist[loc].split(".")[0]
-    return dateparse.getdate(recentrotation), path + searchlist[loc]
+        found = histlist.manifest(path).oldest()
+    recentrotation, file = found
+    return dateparse.getdate(recentrotation), file
 
 
 # checks a nest's status: 0 for no info, 1 for unconfirmed, 2 for confirmed
@@ -104,28 +140,39 @@ def true_if_Y(str):
     return False
 
 
+# the columns of an old nest list that load_nests reads, found by name in the header
+old_list_columns = ["Location", "Primary Name", "Species", "Confirm?", "Private Property?", "Alternate Name", "Notes"]
+
+
 # loads the nests from a file into memory and separates them by city and status
+# each row is the list csv.reader makes, read by column position, instead of a DictReader dict
 def load_nests(nestfile):
-    nestlist = nested_dict()
-    empties = nested_dict()
-    f = open(nestfile, 'r')
-    nests = csv.DictReader(f, delimiter="\t")
-    for nest in nests:
-        loc = nest["Location"].strip()
-        if loc == "":
-            loc = "ZZZZZZNo location information"  # sort at the end
-        stat = assign_status(nest["Species"], nest["Confirm?"])
-        name = nest["Primary Name"].strip()
-        if stat == 0:
-            list = empties
-        else:
-            list = nestlist
-        list[loc][name]["Private"] = true_if_Y(nest["Private Property?"])
-        list[loc][name]["Alt"] = nest["Alternate Name"].strip()
-        list[loc][name]["Note"] = nest["Notes"].strip()
-        list[loc][name]["Species"] = nest["Species"].strip()
-        list[loc][name]["Status"] = stat
-    f.close()
+    nestlist = NestGroups()
+    empties = NestGroups()
+    with open(nestfile, 'r', newline='') as f:
+        rows = csv.reader(f, delimiter="\t")
+        header = next(rows, [])
+        missing = [name for name in old_list_columns if name not in header]
+        if len(missing) > 0:
+            raise ValueError(nestfile + " has no " + ", ".join(missing) + " column")
+        iloc, iname, ispecies, iconfirm, iprivate, ialt, inote = [header.index(name) for name in old_list_columns]
+        width = len(header)
+        for row in rows:
+            if len(row) == 0:
+                continue  # DictReader skips blank lines too
+            if len(row) < width:
+                row += [""] * (width - len(row))
+            loc = row[iloc].strip()
+            if loc == "":
+                loc = "ZZZZZZNo location information"  # sort at the end
+            stat = assign_status(row[ispecies], row[iconfirm])
+            list = empties if stat == 0 else nestlist
+            list.add(loc, row[iname].strip(), Nest(
+                species=sys.intern(row[ispecies].strip()),
+                status=stat,
+                private=true_if_Y(row[iprivate]),
+                alt=row[ialt].strip(),
+                note=row[inote].strip()))
     return nestlist, empties
 
 
@@ -152,61 +199,89 @@ def gen_parenthetical(notes, private):
     return decorate_text(combined, "()")
 
 
+# lets a renderer either write into a text sink or return its text
+# the decorated function does all of its output through out.write
+# called without out=, it renders into a buffer and returns the string
+def streams(render):
+    @functools.wraps(render)
+    def wrapper(*args, out=None, **kwargs):
+        if out is not None:
+            render(*args, out=out, **kwargs)
+            return None
+        buf = io.StringIO()
+        render(*args, out=buf, **kwargs)
+        return buf.getvalue()
+
+    return wrapper
+
+
 # outputs the formatted nest list for the FB post
 # nnl stands for Nested Nest List
-def FB_format_nests(nnl):
-    list = ""
+@streams
+def FB_format_nests(nnl, out=None):
+    w = out.write
     for location in sorted(nnl.keys()):
         # use "ZZZ" instead of just "Z" to accommodate Zanesville
         # and any city that two consecutive Z in its name
-        list += decorate_text(location.split("ZZZ")[-1], "{~()~}") + '\n'
-        for nestname in nnl[location]:
-            status = nnl[location][nestname]["Status"]
-            nest = nnl[location][nestname]
-            if nest["Ghost"]:
-                list += ghost_icon
-            if nest["Private"]:
-                list += private_reminder  # private property reminder
-            list += nestname  # nest name
-            if nest["Alt"] != "":
-                list += "/" + nest["Alt"]
-            if nest["Note"] is not None and nest["Note"] != "":
-                list += " " + gen_parenthetical(nest["Note"], '')
-            list += ": " + nest["Species"]
-            if status == 1:
-                list += "*"
-            list += '\n'  # prepare for next item
-        list += '\n'
-    return list
-
-
-def FB_empty(empties):
-    list = decorate_text("No Reports", "[--  --]") + '\n'
+        w(decorate_text(location.split("ZZZ")[-1], "{~()~}"))
+        w('\n')
+        for nestname, nest in nnl[location].items():
+            if nest.ghost:
+                w(ghost_icon)
+            if nest.private:
+                w(private_reminder)  # private property reminder
+            w(nestname)  # nest name
+            if nest.alt != "":
+                w("/")
+                w(nest.alt)
+            if nest.note is not None and nest.note != "":
+                w(" ")
+                w(gen_parenthetical(nest.note, ''))
+            w(": ")
+            w(nest.species)
+            if nest.status == 1:
+                w("*")
+            w('\n')  # prepare for next item
+        w('\n')
+
+
+@streams
+def FB_empty(empties, out=None):
+    w = out.write
+    w(decorate_text("No Reports", "[--  --]"))
+    w('\n')
     for location in sorted(empties.keys()):
-        list += "• " + location + ": "
+        w("• ")
+        w(location)
+        w(": ")
         first = True
         for park in sorted(empties[location].keys()):
             if first is False:
-                list += ","
-            list += " " + (private_reminder if empties[location][park]["Private"] else '') + park
+                w(",")
+            w(" ")
+            if empties[location][park].private:
+                w(private_reminder)
+            w(park)
             first = False
-        list += '\n'
-    return list
+        w('\n')
 
 
+# regroups a nest list by species
 def make_summary(nnl):
-    summary = nested_dict()
+    summary = NestGroups()
     for location in nnl.keys():
-        for park in nnl[location].keys():
-            summary[nnl[location][park]["Species"]][park] = nnl[location][park]["Status"]
+        for park, nest in nnl[location].items():
+            summary.add(nest.species, park, nest)
     return summary
 
 
-def FB_summary(summary):
-    out = decorate_text("Summary", "[--  --]")
+@streams
+def FB_summary(summary, out=None):
+    w = out.write
+    w(decorate_text("Summary", "[--  --]"))
     for species in sorted(summary.keys()):
         spico = ''
-        if summary[species]["-Spooked"] is True:
+        if species in summary.spooked:
             spico = ghost_icon
         elif species == "Wailmer":
             spico = smallwhale
@@ -220,32 +295,34 @@ def FB_summary(summary):
             spico = rat_icon
         elif species == "Water Biome":
             spico = water_icon
-        out += "\n" + spico + species + ":"
+        w("\n")
+        w(spico)
+        w(species)
+        w(":")
         first = True
         for park in sorted(summary[species].keys()):
-            if park == "-Spooked":
-                continue
             if first is False:
-                out += ","
-            if summary[species][park]["Private"]:
-                out += private_reminder
-            out += " " + park
-            if summary[species][park]["Status"] == 1:
-                out += "*"
+                w(",")
+            if summary[species][park].private:
+                w(private_reminder)
+            w(" ")
+            w(park)
+            if summary[species][park].status == 1:
+                w("*")
             first = False
-    out += "\n\n"
-    return out
+    w("\n\n")
 
 
 # Preamble for FB post
 # dates here should be previously-formatted as strings
-def FB_preamble(updated8, rotationday, rotnum):
-    out = "#Nests #Tracking #Migration\n"
-    out += "* = Unconfirmed, "
-    out += private_reminder + "️ = Private property, please be respectful\n"
-    out += rotationday + " nest shift (#" + str(rotnum) + ")\n"
-    out += "Last updated: " + updated8 + "\n\n"
-    return out
+@streams
+def FB_preamble(updated8, rotationday, rotnum, out=None):
+    w = out.write
+    w("#Nests #Tracking #Migration\n")
+    w("* = Unconfirmed, ")
+    w(private_reminder + "️ = Private property, please be respectful\n")
+    w(rotationday + " nest shift (#" + str(rotnum) + ")\n")
+    w("Last updated: " + updated8 + "\n\n")
 
 
 # Preamble for Discord
@@ -256,101 +333,127 @@ def disc_preamble(updated8, rotationday, rotnum):
     return out
 
 
-# discord post of top/important species & parks
+popular_header = decorate_text("Popular Species", "__****__")
+
+
+# discord post of top/important species & parks, one line per species
+# a species with too many parks for one message is continued on more lines of at most width characters
 # maybe this should be from a config file?
-def disc_important_species(slist):
+def disc_species_lines(slist, width=discord_limit - len(popular_header)):
     important_species = ["Magikarp", "Walimer", "Water Biome"]
-    out = decorate_text("Popular Species", "__****__")
-    count = 0
+    lines = []
     for species in sorted(slist.keys()):
-        if species not in important_species and slist[species]["-Spooked"] is not True:
+        if species not in important_species and species not in slist.spooked:
             continue
-        count += 1
-        out += '\n• ' + species + ": "
-        first = True
+        prefix = '\n• ' + species + ": "
+        line = prefix
         for park in slist[species]:
-            if park == "-Spooked":
-                continue
-            if first is False:
-                out += ', '
-            out += decorate_text(park, '****' if slist[species][park]["Status"] == 2 else '__')
-            first = False
-    if count == 0:
-        return ''
-    return out
+            entry = decorate_text(park, '****' if slist[species][park].status == 2 else '__')
+            if line != prefix and len(line) + 2 + len(entry) > width:
+                lines.append(line)
+                line = prefix
+            line += (', ' if line != prefix else '') + entry
+        lines.append(line)
+    return lines
 
 
-# generate and copy a Discord post to the clipboard
-# assumes all lines are roughly the same length and you don't troll
-# with a 2000+ chars line for a single region
-def disc_posts(nnl2, rundate, shiftdate, slist=None, rotnum=0):
-    list = []
-    olen = 0
-    max = 2000  # Discord post length limit
-    pre = disc_preamble(rundate, shiftdate, rotnum)
-    olen += len(pre)
-    list.append('')  # this is required for things to split up right later
-    list.append(pre)
+def disc_important_species(slist):
+    lines = disc_species_lines(slist)
+    if len(lines) == 0:
+        return ''
+    return popular_header + ''.join(lines)
+
+
+# fills messages in order from (header, lines) sections, starting a new one whenever the next line won't fit
+# under cap; a section split between messages has its header repeated at the top of the next one
+def fill_messages(sections, cap):
+    messages = []
+    msg = ''
+    current = None  # the section whose header msg last wrote
+    for num, (header, lines) in enumerate(sections):
+        for line in lines:
+            size = len(line) if current == num else len(header) + len(line)
+            if msg != '' and len(msg) + size > cap:
+                messages.append(msg)
+                msg = ''
+                current = None
+            if current != num:
+                msg += header
+                current = num
+            msg += line
+    if msg != '':
+        messages.append(msg)
+    return messages
+
+
+# packs (header, lines) sections, in order, into as few messages of at most limit characters as possible
+# messages break between lines, so a section can be split anywhere and picks up its header again
+# filling each message in turn gives the fewest messages since dropping lines from the front of a message
+# never makes it longer; the lowest cap that still needs no more than that many messages is then
+# binary searched to even out their lengths
+def pack_messages(sections, limit=discord_limit):
+    sections = [(header, lines) for header, lines in sections if len(lines) > 0]
+    if len(sections) == 0:
+        return []
+    longest = max(len(header) + len(line) for header, lines in sections for line in lines)
+    if longest > limit:
+        line = max((line for header, lines in sections for line in lines), key=len)
+        raise Exception("The entry " + line.strip()[:60] + "... is too long to fit in a Discord message")
+    count = len(fill_messages(sections, limit))
+    low, high = longest, limit
+    while low < high:
+        mid = (low + high) // 2
+        if len(fill_messages(sections, mid)) <= count:
+            high = mid
+        else:
+            low = mid + 1
+    return fill_messages(sections, low)
+
 
+# generates the Discord post as a list of messages that each fit under the length limit
+# the preamble starts the first message and sub-regions are split between nests wherever that
+# makes the fewest, most even messages
+# the popular species list, when there is one, is packed the same way into messages of its own at the end
+def disc_messages(nnl2, rundate, shiftdate, slist=None, rotnum=0):
+    sections = [('', [disc_preamble(rundate, shiftdate, rotnum)])]
     for loc in sorted(nnl2.keys()):
-        loclst = decorate_text(loc, '__****__') + '\n'
+        lines = []
         for nestname in sorted(nnl2[loc].keys()):
-            loclst += nestname
+            line = nestname
             nest = nnl2[loc][nestname]
-            if nest["Alt"] != '':
-                loclst += '/' + str(nest["Alt"])
-            loclst += ": " + decorate_text(nest["Species"], '****' if nest["Status"] == 2 else '__') + '\n'
-        if len(loclst) > 2000:
-            raise Exception("Nest list for sub-region " + loc + """ exceeds 2000 characters,
-            which causes Discord problems.  Consider breaking into smaller areas.""")
-        olen += len(loclst)
-        list.append(loclst)
-
-    start = 0
-    end = 0
-    num = olen // max + 1
-    trg = olen // num
-    outparts = []
-    pts = len(list) // num
-    ix = 0
-    count = 0
-    tmpstr = ""
-    for nbh in list:
-        if len(nbh) + count < max and count <= trg:
-            tmpstr += nbh
-            count += len(nbh)
-        else:
-            outparts.append(tmpstr)
-            tmpstr = nbh
-            count = 0
-            ix += 1
-    outparts.append(tmpstr)
-
-    outparts.append(disc_important_species(slist))
-
-    pos = 0
-    num = len(outparts)
-    for part in outparts:
-        pyperclip.copy(part)
-        pos += 1
-        if pos < num:
-            input(
-                "Copied part " + str(pos) + " of " + str(num) + " to the clipboard. Press enter or return to continue.")
-        else:
-            print("Copied part " + str(num) + " of " + str(num) + " to the clipboard.")
+            if nest.alt != '':
+                line += '/' + str(nest.alt)
+            line += ": " + decorate_text(nest.species, '****' if nest.status == 2 else '__') + '\n'
+            lines.append(line)
+        sections.append((decorate_text(loc, '__****__') + '\n', lines))
+    messages = pack_messages(sections)
+    if slist is not None:
+        messages += pack_messages([(popular_header, disc_species_lines(slist))])
+    return messages
 
 
-# generate and copy a FB post to the clipboard
-def FB_post(nnl, rundate, shiftdate, mt=None, slist=None, rotnum=0):
-    post = FB_preamble(rundate, shiftdate, rotnum)
+# generate and copy a Discord post to the clipboard
+def disc_posts(nnl2, rundate, shiftdate, slist=None, rotnum=0):
+    copy_posts({"Discord": disc_messages(nnl2, rundate, shiftdate, slist=slist, rotnum=rotnum)})
+
+
+# writes the whole FB post to a text sink (a file, sys.stdout, or an io.StringIO)
+@streams
+def write_FB_post(nnl, rundate, shiftdate, mt=None, slist=None, rotnum=0, out=None):
+    FB_preamble(rundate, shiftdate, rotnum, out=out)
     if slist is not None:
-        post += FB_summary(slist)
-        post += decorate_text(" • ", "---==<>==---") + "\n\n"
-    post += FB_format_nests(nnl)
+        FB_summary(slist, out=out)
+        out.write(decorate_text(" • ", "---==<>==---") + "\n\n")
+    FB_format_nests(nnl, out=out)
     if mt is not None:
-        # post += decorate_text(" • ", "---==<>==---") + "\n\n"
-        post += FB_empty(mt)
-    pyperclip.copy(post)
+        # out.write(decorate_text(" • ", "---==<>==---") + "\n\n")
+        FB_empty(mt, out=out)
+
+
+# generate and copy a FB post to the clipboard
+def FB_post(nnl, rundate, shiftdate, mt=None, slist=None, rotnum=0):
+    import pyperclip
+    pyperclip.copy(write_FB_post(nnl, rundate, shiftdate, mt=mt, slist=slist, rotnum=rotnum))
     print("Nest list copied to clipboard")
 
 
@@ -363,7 +466,7 @@ def get_rot8d8(today, dbc):
     res = cur.fetchall()
     if len(res) > 0:
         return res[0][0], res[0][1]
-    print("Date " + today + " is older than anything in the database.  Using oldest data instead.")
+    print("Date " + str(today) + " is older than anything in the database.  Using oldest data instead.")
     sql = "SELECT * FROM rotation_dates LIMIT 1"
     cur.execute(sql)
     res = cur.fetchall()
@@ -381,22 +484,38 @@ def get_sortloc(nestrow):
         return nestrow[8]
 
 
-# turns a SQL result nest row into an NNL entry
-# the dbc is only necessary if you want to look up and include alternate names
-def nstrw2nnl(nestrow, dbc=None):
-    nst = nested_dict()
-    nst["Official Name"] = nestrow[3]
-    nst["Short Name"] = nestrow[4]
-    nst["Neighborhood"] = nestrow[7]
-    nst["Region"] = nestrow[8]
-    nst["Species"] = nestrow[0]
-    nst["Private"] = nestrow[6]
-    nst["Note"] = nestrow[5]
-    nst["Status"] = 2 if nestrow[1] == 1 else 1
-    nst["Ghost"] = True if (nestrow[10] == 'Ghost' or nestrow[11] == 'Ghost') else False
-    nst["SpNum"] = nestrow[9]
+# loads every alternate name in one pass
+# returns a dict of nest_id -> list of alt names in the order they were entered
+def load_alt_names(dbc):
+    alts = defaultdict(list)
+    for main_entry, name in dbc.execute("SELECT main_entry, name FROM alt_names ORDER BY main_entry, rowid"):
+        alts[main_entry].append(name)
+    return alts
+
+
+# turns a SQL result nest row into a Nest
+# pass the output of load_alt_names as alts to include alternate names
+# the dbc is only necessary if you want to look up alternate names one nest at a time
+# pass the database's species registry when turning many rows
+def nstrw2nnl(nestrow, dbc=None, alts=None, registry=None):
+    if registry is None:
+        registry = species.registry(dbc)
+    dex = registry.get(nestrow[9]) or species.Species(None, None)
+    nst = Nest(
+        official_name=nestrow[3],
+        short_name=nestrow[4],
+        neighborhood=nestrow[7],
+        region=nestrow[8],
+        species=nestrow[0],
+        private=nestrow[6],
+        note=nestrow[5],
+        status=2 if nestrow[1] == 1 else 1,
+        ghost=dex.is_type("Ghost"),
+        species_num=dex.num)
+    if alts is not None:
+        nst.alt = '/'.join(alts.get(nestrow[2], []))
+        return nst
     if dbc is None:
-        nst["Alt"] = ''
         return nst
     slalts = "SELECT name FROM alt_names WHERE main_entry = ?"
     cur = dbc.cursor()
@@ -405,7 +524,7 @@ def nstrw2nnl(nestrow, dbc=None):
     altlst = []
     for alt in rawalt:
         altlst.append(alt[0])
-    nst["Alt"] = '/'.join(altlst)
+    nst.alt = '/'.join(altlst)
     return nst
 
 
@@ -414,32 +533,10 @@ def nestname(nestrow):
     return nestrow[4] if nestrow[4] is not None else nestrow[3]
 
 
-# returns the nested nest list and stack of empties
-def get_nests(rotnum, dbc):
-    nestout = nested_dict()
-    nestmt = nested_dict()
-    ssumry = nested_dict()
-    sqnests = """SELECT
-                    sl.species_txt AS Species --0
-                    ,sl.confirmation AS 'Confirmed?' --1
-                    ,nls.nest_id --2
-                    ,nls.official_name AS 'Primary Name' --3
-                    ,nls.short_name AS 'Short Name' --4
-                    ,nls.notes AS 'Park Notes' --5
-                    ,nls.private AS 'Private Property?' --6
-                    ,nbz.name AS 'Neighborhood' --7
-                    ,regions.name AS 'Location' --8
-                    ,nsp.`#` AS Dex --9
-                    ,nsp.Type --10
-                    ,nsp.Subtype --11
-                FROM species_list AS sl
-                    LEFT OUTER JOIN nest_locations AS nls ON (sl.nestid = nls.nest_id)
-                    LEFT OUTER JOIN neighborhoods AS nbz ON (nls.location = nbz.id)
-                    LEFT OUTER JOIN regions ON (nbz.region = regions.id)
-                    LEFT OUTER JOIN nesting_species AS nsp ON (sl.species_no = nsp.`#`)
-                WHERE sl.rotation_num = ?"""
-    sqmt = """SELECT
-                NULL,NULL --fill in for 0 and 1
+# nests reported for a rotation, shared with the query plan check in migrations.py
+sqnests = """SELECT
+                sl.species_txt AS Species --0
+                ,sl.confirmation AS 'Confirmed?' --1
                 ,nls.nest_id --2
                 ,nls.official_name AS 'Primary Name' --3
                 ,nls.short_name AS 'Short Name' --4
@@ -447,59 +544,282 @@ def get_nests(rotnum, dbc):
                 ,nls.private AS 'Private Property?' --6
                 ,nbz.name AS 'Neighborhood' --7
                 ,regions.name AS 'Location' --8
-                ,NULL,NULL,NULL --filler for 9,10,11
-            FROM nest_locations AS nls
+                ,sl.species_no AS Dex --9
+            FROM species_list AS sl
+                LEFT OUTER JOIN nest_locations AS nls ON (sl.nestid = nls.nest_id)
                 LEFT OUTER JOIN neighborhoods AS nbz ON (nls.location = nbz.id)
                 LEFT OUTER JOIN regions ON (nbz.region = regions.id)
-            WHERE nls.nest_id NOT IN (
-                SELECT nestid FROM species_list
-                WHERE rotation_num = ?
-            )"""
-    for nestrow in dbc.execute(sqnests, [rotnum]):
-        nestdct = nstrw2nnl(nestrow, dbc)
-        nestout[get_sortloc(nestrow)][nestname(nestrow)] = nestdct
-        ssumry[nestrow[0]][nestname(nestrow)] = nestdct
-        if nestdct["Ghost"]:
-            ssumry[nestrow[0]]["-Spooked"] = True
-    for nestrow in dbc.execute(sqmt, [rotnum]):
-        nestmt[nestrow[7]][nestname(nestrow)] = nstrw2nnl(nestrow, dbc)
+            WHERE sl.rotation_num = ?"""
+
+# parks without a report for a rotation, found with an anti-join on the species_list primary key
+# only what the No Reports section shows is selected
+sqmt = """SELECT
+            nls.official_name AS 'Primary Name' --0
+            ,nls.short_name AS 'Short Name' --1
+            ,nls.private AS 'Private Property?' --2
+            ,nbz.name AS 'Neighborhood' --3
+        FROM nest_locations AS nls
+            LEFT OUTER JOIN species_list AS sl ON (sl.rotation_num = ? AND sl.nestid = nls.nest_id)
+            LEFT OUTER JOIN neighborhoods AS nbz ON (nls.location = nbz.id)
+        WHERE sl.nestid IS NULL"""
+
+
+# returns the nested nest list and stack of empties
+def get_nests(rotnum, dbc):
+    nestout = NestGroups()
+    nestmt = NestGroups()
+    ssumry = NestGroups()
+    with timings.phase("alt-name lookup"):
+        alts = load_alt_names(dbc)
+    with timings.phase("species lookup"):
+        registry = species.registry(dbc)
+    with timings.phase("nest query"):
+        for nestrow in dbc.execute(sqnests, [rotnum]):
+            nest = nstrw2nnl(nestrow, alts=alts, registry=registry)
+            nestout.add(get_sortloc(nestrow), nestname(nestrow), nest)
+            ssumry.add(nestrow[0], nestname(nestrow), nest)
+    with timings.phase("empty nest query"):
+        for oname, sname, private, neighborhood in dbc.execute(sqmt, [rotnum]):
+            nestmt.add(neighborhood, sname if sname is not None else oname,
+                       Nest(private=private, official_name=oname, short_name=sname, neighborhood=neighborhood))
     return nestout, nestmt, ssumry
 
 
+# returns the (rotation number, date) of every rotation between two dates, inclusive
+def get_rotations(dbc, start, end):
+    sql = "SELECT num, date FROM rotation_dates WHERE date >= ? AND date <= ? ORDER BY date"
+    return dbc.execute(sql, [str(start), str(end)]).fetchall()
+
+
+# returns the (rotation number, date) of a rotation number or None if it doesn't exist
+def get_rotation(dbc, rotnum):
+    return dbc.execute("SELECT num, date FROM rotation_dates WHERE num = ?", [rotnum]).fetchone()
+
+
+# renders one rotation in each of the formats without touching the clipboard
+# the rotation is only fetched from the database once
+# returns a dict of format name -> list of messages (a FB post is a single message)
+def render_rotation(dbc, rotnum, shiftdate, rundate, formats):
+    nests, empties, species = get_nests(rotnum, dbc)
+    posts = {}
+    with timings.phase("render"):
+        if "Facebook" in formats:
+            posts["Facebook"] = [write_FB_post(nests, rundate, shiftdate, mt=empties, slist=species, rotnum=rotnum)]
+        if "Discord" in formats:
+            posts["Discord"] = disc_messages(nests, rundate, shiftdate, slist=species, rotnum=rotnum)
+    return posts
+
+
+# returns the counter that every edit to the rendered tables bumps, or None on a database without it
+def get_data_version(dbc):
+    try:
+        return dbc.execute("SELECT version FROM data_version").fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+
+# drops cached posts from before the latest edit, then the least recently used ones
+# until the cache is no bigger than limit bytes
+def evict_renders(dbc, version, limit=render_cache_limit):
+    dbc.execute("DELETE FROM render_cache WHERE data_version <> ?", [version])
+    total = 0
+    for rotnum, format_name, rundate, size in dbc.execute(
+            "SELECT rotation_num, format, rundate, size FROM render_cache ORDER BY last_used DESC").fetchall():
+        total += size
+        if total > limit:
+            dbc.execute("DELETE FROM render_cache WHERE rotation_num = ? AND format = ? AND rundate = ?",
+                        [rotnum, format_name, rundate])
+
+
+# same as render_rotation, but reuses posts rendered since the last edit to the database
+# the rotation is only fetched from the database if one of the formats isn't cached
+def cached_render(dbc, rotnum, shiftdate, rundate, formats):
+    version = get_data_version(dbc)
+    if version is None:
+        return render_rotation(dbc, rotnum, shiftdate, rundate, formats)
+    posts = {}
+    lookup = """SELECT body FROM render_cache
+        WHERE rotation_num = ? AND format = ? AND rundate = ? AND data_version = ?"""
+    touch = "UPDATE render_cache SET last_used = ? WHERE rotation_num = ? AND format = ? AND rundate = ?"
+    with timings.phase("render cache"):
+        for format_name in formats:
+            row = dbc.execute(lookup, [rotnum, format_name, rundate, version]).fetchone()
+            if row is not None:
+                posts[format_name] = json.loads(row[0])
+                dbc.execute(touch, [time.time(), rotnum, format_name, rundate])
+    missing = [format_name for format_name in formats if format_name not in posts]
+    if len(missing) > 0:
+        store = "INSERT OR REPLACE INTO render_cache VALUES (?,?,?,?,?,?,?)"
+        rendered = render_rotation(dbc, rotnum, shiftdate, rundate, missing)
+        with timings.phase("render cache"):
+            for format_name, messages in rendered.items():
+                body = json.dumps(messages)
+                dbc.execute(store, [rotnum, format_name, rundate, version, body, len(body), time.time()])
+                posts[format_name] = messages
+            evict_renders(dbc, version)
+    with timings.phase("render cache"):
+        dbc.commit()  # the last_used of a hit has to be saved too, or eviction drops the posts in use
+    return {format_name: posts[format_name] for format_name in formats}
+
+
+# copies each post to the clipboard in turn, waiting for enter between the messages
+def copy_posts(posts):
+    import pyperclip  # only the interactive path needs the clipboard
+    for format_name, messages in posts.items():
+        pos = 0
+        num = len(messages)
+        for part in messages:
+            pyperclip.copy(part)
+            pos += 1
+            if num == 1:
+                print(format_name + " post copied to clipboard")
+            elif pos < num:
+                input("Copied part " + str(pos) + " of " + str(num) +
+                      " to the clipboard. Press enter or return to continue.")
+            else:
+                print("Copied part " + str(num) + " of " + str(num) + " to the clipboard.")
+
+
+# writes rendered posts to outdir as <date>.<format>.txt, numbering the files of multi-part posts
+# with no outdir, the posts go to stdout with a header line before each one
+def write_posts(posts, shiftdate, outdir=None):
+    for format_name, messages in posts.items():
+        for num, message in enumerate(messages, 1):
+            part = "" if len(messages) == 1 else "." + str(num)
+            if outdir is None:
+                print("===== " + shiftdate + " " + format_name + part.replace(".", " part ") + " =====")
+                print(message)
+                continue
+            with open(os.path.join(outdir, shiftdate + "." + format_name + part + ".txt"), 'w') as out:
+                out.write(message)
+
+
+# the (rotation number, date) of the rotations to output, picked by number or by a date range
+# by default it's the one in effect on start
+def find_rotations(dbc, start, end=None, rotnums=()):
+    if len(rotnums) > 0:
+        rotations = []
+        for rotnum in rotnums:
+            rotation = get_rotation(dbc, rotnum)
+            if rotation is None:
+                print("There is no rotation #" + str(rotnum), file=sys.stderr)
+                continue
+            rotations.append(rotation)
+        return rotations
+    if end is not None:
+        return get_rotations(dbc, start, end)
+    return [get_rot8d8(start, dbc)]
+
+
+# renders every requested rotation in every format with no prompts or clipboard
+# rotations are picked as in find_rotations
+def batch(dbc, formats, start, end=None, rotnums=(), outdir=None):
+    rundate = datetime.datetime.today().strftime('%d %b %Y')
+    with timings.phase("rotation lookup"):
+        rotations = find_rotations(dbc, start, end, rotnums)
+    if outdir is not None:
+        dateparse.check_dir(outdir)
+    for rotnum, shiftdate in rotations:
+        posts = cached_render(dbc, rotnum, shiftdate, rundate, formats)
+        with timings.phase("output"):
+            write_posts(posts, shiftdate, outdir)
+    return len(rotations)
+
+
+# renders one city's rotations into its own folder under outdir, for fanning out across cities
+def batch_city(city, dbfile, profile, formats, start, end=None, rotnums=(), outdir=None):
+    if outdir is not None and city is not None:
+        outdir = os.path.join(outdir, city)
+    with citydb.connection_pool(profile).connection(dbfile) as dbc:
+        return batch(dbc, formats, start, end, rotnums, outdir)
+
+
+format_choices = ['FB', 'Facebook', 'f', 'd', 'Discord', 'disc', 'all']
+
+
+# turns a --format choice into the list of format names it covers
+def expand_format(format):
+    return {
+        'f': ["Facebook"],
+        'd': ["Discord"],
+        'a': ["Facebook", "Discord"],
+    }.get(format[0].lower())
+
+
 @click.command()
 @click.option(
     '-d',
     '--date',
-    default=str(datetime.datetime.today().date()),
-    prompt="Generate list of nests as of this date",
-    help="Generate list of nests as of this date"
+    default=None,
+    help="Generate list of nests as of this date (the start of the range with --through)"
 )
 @click.option(
     '-o',
     '--format',
-    type=click.Choice(['FB', 'Facebook', 'f', 'd', 'Discord', 'disc']),
-    prompt="Output format",
+    type=click.Choice(format_choices),
     help="Specify the output formatting for the nest list")
+@click.option(
+    '--through',
+    default=None,
+    help="Non-interactively output every rotation from --date through this date")
+@click.option(
+    '-r',
+    '--rotation',
+    type=int,
+    multiple=True,
+    help="Non-interactively output this rotation number (can be repeated)")
+@click.option(
+    '--outdir',
+    default=None,
+    help="Non-interactively write the posts to files in this folder instead of the clipboard")
+@click.option(
+    '--profile',
+    default="render",
+    help="Database connection profile, see connection_profiles in importoldlists.py and general.cfg")
+@click.option(
+    '-j',
+    '--jobs',
+    type=int,
+    default=None,
+    help="Cities to render at once with --all-cities or several --city, one process each")
+@citydb.city_option()
+@timings.option
 # main method
-def main(city=None, date=None, format=None):
+def main(date=None, format=None, through=None, rotation=(), outdir=None, profile="render", jobs=None,
+         cities=((None, citydb.default_database),)):
+    if len(cities) > 1 and outdir is None:
+        raise click.UsageError("Rendering several cities needs --outdir, each city gets a folder in it")
+    if through is not None or len(rotation) > 0 or outdir is not None:
+        start = dateparse.getdate(date if date is not None else "t")
+        end = dateparse.getdate(through) if through is not None else None
+        formats = expand_format(format if format is not None else 'all')
+        results = citydb.fan_out(batch_city, [(city, dbfile, profile, formats, start, end, rotation, outdir)
+                                               for city, dbfile in cities], jobs)
+        for job, count, error in results:
+            if error is not None:
+                print("Failed to render " + job[0] + ": " + error, file=sys.stderr)
+        return None
+
+    if date is None:
+        date = click.prompt("Generate list of nests as of this date", default=str(datetime.datetime.today().date()))
+    if format is None:
+        format = click.prompt("Output format", type=click.Choice(format_choices))
     date = dateparse.getdate(date)
     rundate = date.strftime('%d %b %Y')
     print("Gathering nests as of " + rundate)
-    dbfile = "nests.db"
-    dbc = dbutils.create_connection(dbfile)
+    import importoldlists as dbutils  # it brings in the importer and migrations, which rendering doesn't need
+    dbfile = cities[0][1]
+    dbc = dbutils.create_connection(dbfile, profile)
     if dbc is None:
         print("Error creating database")
         return None
 
-    rotnum, shiftdate = get_rot8d8(date, dbc)
-    nests, empties, species = get_nests(rotnum, dbc)
+    with timings.phase("rotation lookup"):
+        rotnum, shiftdate = get_rot8d8(date, dbc)
     print("Using the nest list from the " + shiftdate + " nest rotation")
-    if format[0].lower() == 'f':
-        format_name = "Facebook"
-        FB_post(nests, rundate, shiftdate, slist=species, mt=empties, rotnum=rotnum)
-    if format[0].lower() == 'd':
-        format_name = "Discord"
-        disc_posts(nests, rundate, shiftdate, slist=species, rotnum=rotnum)
+    posts = cached_render(dbc, rotnum, shiftdate, rundate, expand_format(format))
+    with timings.phase("output"):
+        copy_posts(posts)
 
 
 if __name__ == "__main__":